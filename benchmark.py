@@ -0,0 +1,189 @@
+"""
+Benchmarks for the JK ESS protocol hot paths.
+
+Runs on synthetic frames from the bus simulator, prints the per call cost and
+appends the run to benchmarks.jsonl so per frame regressions show up before
+they reach a gateway:
+
+    python benchmark.py                 # run, compare with the last run and record it
+    python benchmark.py --check 20      # exit 1 if anything got 20% slower than the last run
+    python benchmark.py --no-record     # run and compare only
+
+It also times a cold "import jkess" in a fresh interpreter, which has to stay
+within IMPORT_BUDGET and must not pull in any of the optional backends.
+"""
+import argparse
+import json
+import logging
+import platform
+import random
+import subprocess
+import sys
+import time
+import timeit
+
+import jkess
+from jkess import batch
+
+RESULTS_FILE = 'benchmarks.jsonl'
+# Milliseconds a cold "import jkess" may add to the interpreter start up
+IMPORT_BUDGET = 60.0
+IMPORT_FORBIDDEN = ('paho', 'serial', 'numpy', 'sqlite3', 'asyncio', 'http')
+IMPORT_PROBE = ("import sys, time; start = time.perf_counter(); import jkess; "
+                "elapsed = time.perf_counter() - start; "
+                "print(elapsed, ' '.join(sorted({name.partition('.')[0] for name in sys.modules})))")
+
+def syntheticFrames(packs=16, seed=1):
+    # One polling cycle of every record type for each pack, in bus order
+    simulator = jkess.BusSimulator(packs, infoEvery=1, seed=seed)
+    return list(simulator.cycleFrames())
+
+def chunked(stream, seed=1, maxChunk=128):
+    # Split a byte stream the way a USB serial adapter hands it out
+    rnd = random.Random(seed)
+    chunks = []
+    position = 0
+    while position < len(stream):
+        size = rnd.randint(1, maxChunk)
+        chunks.append(stream[position:position + size])
+        position += size
+    return chunks
+
+def benchmarks():
+    frames = syntheticFrames()
+    records = {frame[4]: frame for frameType, frame in frames if frameType == jkess.FRAME_JK_RECORD}
+    request = next(frame for frameType, frame in frames if frameType == jkess.FRAME_FC16_REQUEST)
+    stream = b''.join(frame for _, frame in frames)
+    chunks = chunked(stream)
+    frameCount = len(frames)
+
+    # State records whose status words keep changing, so the expanded bits are never cached
+    bitRecords = [jkess.buildRecord(2, 1, {'BatAlarms': alarms, 'CellSta': alarms * 7})
+                  for alarms in range(1, 2 * jkess.records.BIT_CACHE_SIZE + 2)]
+
+    def getStateNewBits():
+        for record in bitRecords:
+            jkess.getState(record)
+
+    def reassemble():
+        reassembler = jkess.FrameReassembler()
+        for chunk in chunks:
+            reassembler.feed(chunk)
+
+    def busFeed():
+        # With a listener every record is decoded to a dict, like in the monitor
+        bus = jkess.JkBusMonitor()
+        bus.addListener(lambda id, kind, values: None)
+        for chunk in chunks:
+            bus.feed(chunk)
+
+    def busFeedStore():
+        # Library use without listeners, state records only reach the store
+        bus = jkess.JkBusMonitor()
+        for chunk in chunks:
+            bus.feed(chunk)
+
+    # name: (callable, frames handled per call)
+    cases = {
+        'calcCrc16': (lambda: jkess.calcCrc16(request, len(request) - 2), 1),
+        'calcCheckSum8Mod256': (lambda: jkess.calcCheckSum8Mod256(records[2]), 1),
+        'getConfig': (lambda: jkess.getConfig(records[1]), 1),
+        'getState': (lambda: jkess.getState(records[2]), 1),
+        'getInfo': (lambda: jkess.getInfo(records[3]), 1),
+        'getStateNewBits': (getStateNewBits, len(bitRecords)),
+        'stateUnpack': (lambda: jkess.STATE_LAYOUT.unpack(records[2]), 1),
+        'reassembly': (reassemble, frameCount),
+        'busFeed': (busFeed, frameCount),
+        'busFeedStore': (busFeedStore, frameCount),
+    }
+    if batch.np is not None:
+        buffer = b''.join(frame for frameType, frame in frames if frameType == jkess.FRAME_JK_RECORD) * 50
+        cases['decodeBatch'] = (lambda: batch.decodeBatch(buffer), len(buffer) // jkess.JK_RECORD_SIZE)
+    return cases
+
+def measureImport(repeat=7):
+    # Best of repeat cold imports, each in a fresh interpreter
+    best = None
+    for _ in range(repeat):
+        output = subprocess.run([sys.executable, '-c', IMPORT_PROBE], capture_output=True, text=True,
+                                check=True).stdout.split(None, 1)
+        seconds = float(output[0])
+        if best is None or seconds < best:
+            best = seconds
+        modules = set(output[1].split()) if len(output) > 1 else set()
+    return best, sorted(modules.intersection(IMPORT_FORBIDDEN))
+
+def measure(function, repeat=5, minTime=0.2):
+    # Best of repeat runs, each long enough to drown out timer resolution
+    timer = timeit.Timer(function)
+    number, _ = timer.autorange()
+    number = max(number, int(number * minTime / 0.2))
+    return min(timer.repeat(repeat=repeat, number=number)) / number
+
+def gitCommit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def lastRun(path):
+    try:
+        with open(path) as file:
+            lines = [line for line in file if line.strip()]
+    except FileNotFoundError:
+        return None
+    return json.loads(lines[-1]) if lines else None
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the JK ESS protocol hot paths')
+    parser.add_argument('--results', default=RESULTS_FILE, help='JSON lines file with the benchmark history')
+    parser.add_argument('--check', type=float, metavar='PERCENT', help='fail when a case got this much slower than the last run')
+    parser.add_argument('--no-record', action='store_true', help='do not append this run to the results file')
+    parser.add_argument('--filter', help='only run cases containing this text')
+    args = parser.parse_args()
+    logging.disable(logging.CRITICAL)
+
+    previous = lastRun(args.results)
+    previousResults = previous['results'] if previous else {}
+    results = {}
+    regressions = []
+    for name, (function, perCall) in benchmarks().items():
+        if args.filter and args.filter not in name:
+            continue
+        seconds = measure(function)
+        perFrame = seconds / perCall
+        results[name] = {'perCallUs': round(seconds * 1e6, 3), 'perFrameUs': round(perFrame * 1e6, 3)}
+        change = ''
+        if name in previousResults:
+            before = previousResults[name]['perFrameUs']
+            percent = (perFrame * 1e6 - before) / before * 100
+            change = f"{percent:+6.1f}%"
+            if args.check is not None and percent > args.check:
+                regressions.append(name)
+        print(f"{name:22s} {seconds * 1e6:12.3f} us/call {perFrame * 1e6:10.3f} us/frame {change}")
+
+    failures = []
+    if not args.filter or args.filter in 'import':
+        seconds, forbidden = measureImport()
+        results['import'] = {'ms': round(seconds * 1e3, 3)}
+        print(f"{'import':22s} {seconds * 1e3:12.3f} ms (budget {IMPORT_BUDGET:.0f} ms)"
+              f"{' pulls in ' + ', '.join(forbidden) if forbidden else ''}")
+        if seconds * 1e3 > IMPORT_BUDGET:
+            failures.append(f"import took {seconds * 1e3:.1f} ms, over the {IMPORT_BUDGET:.0f} ms budget")
+        if forbidden:
+            failures.append(f"import jkess pulls in {', '.join(forbidden)}")
+
+    if not args.no_record:
+        run = {'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'), 'commit': gitCommit(),
+               'python': platform.python_version(), 'machine': platform.machine(), 'results': results}
+        with open(args.results, 'a') as file:
+            file.write(json.dumps(run) + '\n')
+    if regressions:
+        print(f"Regressions above {args.check}%: {', '.join(regressions)}")
+    for failure in failures:
+        print(failure)
+    return 1 if regressions or (failures and args.check is not None) else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
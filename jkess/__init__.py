@@ -0,0 +1,60 @@
+"""
+JK ESS (JK-PB) BMS RS485 monitor.
+
+Importing the package loads only the framing and the record decoders, which
+need nothing beyond the standard library:
+
+    import jkess
+    values = jkess.getState(record)
+
+The bus monitor, outputs and simulator are imported on first attribute access,
+and the MQTT and serial backends only when a monitor actually needs them.
+Run the monitor with the jkess command or python -m jkess.
+"""
+from .protocol import (FC16, FRAME_FC16_REQUEST, FRAME_FC16_RESPONSE, FRAME_JK_RECORD, JK_HEADER, JK_RECORD_SIZE,
+                       RECORD_TYPE_ADDRS, FrameReassembler, buildFc16Request, buildFc16Response, calcCheckSum8Mod256,
+                       calcCrc16, checkCrc16, interFrameGap)
+from .records import (CELL_COUNT_MAX, CONFIG_LAYOUT, INFO_LAYOUT, JK_PAYLOAD_OFFSET, RECORD_LAYOUTS, STATE_LAYOUT,
+                      RecordLayout, buildRecord, getConfig, getInfo, getState)
+
+__version__ = '0.2.0'
+
+# Public name to the submodule that defines it, imported on first access
+_LAZY = {
+    'IngestMetrics': 'instrumentation',
+    'FrameTracer': 'instrumentation',
+    'JkBusMonitor': 'monitor',
+    'RequestCorrelator': 'monitor',
+    'PackStateStore': 'store',
+    'HistoryStore': 'history',
+    'BankAggregator': 'bank',
+    'AlarmEngine': 'alarms',
+    'PollMaster': 'poll',
+    'parsePollIds': 'poll',
+    'CaptureWriter': 'capture',
+    'CaptureReader': 'capture',
+    'replayCapture': 'capture',
+    'BusSimulator': 'simulator',
+    'SqliteSink': 'persist',
+    'startHttpServer': 'httpd',
+    'decodeBatch': 'batch',
+    'SerialFrameReader': 'serialio',
+    'read_serial': 'serialio',
+    'connectMqtt': 'mqtt',
+    'MqttOutput': 'mqtt',
+    'DeltaPublisher': 'publish',
+    'EventPublisher': 'publish',
+    'DiscoveryCache': 'publish',
+}
+
+def __getattr__(name):
+    module = _LAZY.get(name)
+    if module is None:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    from importlib import import_module
+    value = getattr(import_module(f".{module}", __name__), name)
+    globals()[name] = value
+    return value
+
+def __dir__():
+    return sorted(set(globals()) | set(_LAZY))
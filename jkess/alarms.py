@@ -0,0 +1,121 @@
+"""
+Alarm raise/clear edge detection on the raw state bit words.
+"""
+import logging
+import struct
+import time
+from operator import itemgetter
+
+from .records import JK_PAYLOAD_OFFSET, STATE_LAYOUT, bitShift
+
+# State bit words watched for edges, True when a set bit is an alarm that is raised at startup
+ALARM_WORDS = {'BatAlarms': True, 'CellWireResSta': True, 'TempSenAlarms': True, 'CellSta': False}
+# Seconds a bit has to stay set before it is raised and stay clear before it is cleared
+ALARM_RAISE_DELAY = 0.0
+ALARM_CLEAR_DELAY = 0.0
+ALARM_RAISE = 'raise'
+ALARM_CLEAR = 'clear'
+
+class AlarmState:
+    __slots__ = ('raw', 'reported', 'pending')
+
+    def __init__(self, raw, reported):
+        self.raw = raw
+        self.reported = reported
+        # (word index, bit mask): timestamp the bit started to differ from its reported state
+        self.pending = {}
+
+class AlarmEngine:
+    """
+    Raise and clear events from the raw alarm and status words of state records.
+
+    The watched words are read from the record with one small struct and
+    compared with the previous ones, so a frame without changes costs one
+    unpack and one tuple compare. A changed word is XORed with the reported
+    word and only the differing bits are looked at. A bit has to stay changed
+    for raiseDelay or clearDelay seconds before its event is emitted, which
+    debounces flapping alarms and holds an alarm for a while after it cleared.
+    """
+    def __init__(self, layout=STATE_LAYOUT, words=None, raiseDelay=ALARM_RAISE_DELAY, clearDelay=ALARM_CLEAR_DELAY):
+        words = ALARM_WORDS if words is None else words
+        structFormat = '<'
+        position = 0
+        self.words = []
+        for wordName, offset, fmt, names in sorted(layout.bitFields, key=itemgetter(1)):
+            if wordName not in words:
+                continue
+            if offset > position:
+                structFormat += f"{offset - position}x"
+            structFormat += fmt
+            position = offset + struct.calcsize('<' + fmt)
+            bits = {1 << bitShift(bit): name for bit, name in enumerate(names) if name is not None}
+            self.words.append((wordName, sum(bits), bits, words[wordName]))
+        self.struct = struct.Struct(structFormat)
+        self.raiseDelay = raiseDelay
+        self.clearDelay = clearDelay
+        self.packs = {}
+        self.listeners = []
+
+    def addListener(self, listener):
+        # listener(event) is called for every raise and clear
+        self.listeners.append(listener)
+
+    def update(self, packKey, recordType, data, timestamp=None):
+        # Bus record listener
+        if recordType != 2:
+            return
+        raw = self.struct.unpack_from(data, JK_PAYLOAD_OFFSET)
+        state = self.packs.get(packKey)
+        if state is not None and raw == state.raw and not state.pending:
+            return
+        now = time.time() if timestamp is None else timestamp
+        if state is None:
+            reported = [word & mask for word, (_, mask, _, _) in zip(raw, self.words)]
+            self.packs[packKey] = AlarmState(raw, reported)
+            for index, (wordName, _, bits, isAlarm) in enumerate(self.words):
+                if isAlarm:
+                    for bit in self.bits(reported[index]):
+                        self.emit(packKey, index, bit, ALARM_RAISE, now, initial=True)
+            return
+        state.raw = raw
+        reported = state.reported
+        pending = state.pending
+        diffs = [(word ^ reportedWord) & mask for word, reportedWord, (_, mask, _, _) in zip(raw, reported, self.words)]
+        # Bits that went back to their reported state before their delay passed are dropped
+        for key in [key for key in pending if not diffs[key[0]] & key[1]]:
+            del pending[key]
+        for index, diff in enumerate(diffs):
+            for bit in self.bits(diff):
+                raising = bool(raw[index] & bit)
+                since = pending.setdefault((index, bit), now)
+                if now - since >= (self.raiseDelay if raising else self.clearDelay):
+                    del pending[(index, bit)]
+                    reported[index] ^= bit
+                    self.emit(packKey, index, bit, ALARM_RAISE if raising else ALARM_CLEAR, now)
+
+    @staticmethod
+    def bits(word):
+        while word:
+            bit = word & -word
+            word ^= bit
+            yield bit
+
+    def emit(self, packKey, index, bit, edge, timestamp, initial=False):
+        wordName, _, bits, isAlarm = self.words[index]
+        event = {'event': 'alarm', 'pack': packKey, 'name': bits[bit], 'word': wordName, 'state': edge,
+                 'timestamp': timestamp, 'initial': initial}
+        level = logging.WARNING if isAlarm and edge == ALARM_RAISE else logging.INFO
+        logging.log(level, f"Pack ID:{packKey} {wordName} {bits[bit]} {edge}")
+        for listener in self.listeners:
+            try:
+                listener(event)
+            except Exception:
+                logging.exception(f"Alarm listener failed for {bits[bit]}")
+
+    def active(self, packKey):
+        # Names of the alarms currently raised for a pack
+        state = self.packs.get(packKey)
+        if state is None:
+            return []
+        return [bits[bit] for word, (_, _, bits, isAlarm) in zip(state.reported, self.words) if isAlarm
+                for bit in self.bits(word)]
@@ -0,0 +1,198 @@
+"""
+Incremental bank level aggregation over all packs.
+"""
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+
+from .records import CELL_COUNT_MAX
+
+BANK_ID = 'bank'
+# Seconds without a state record before a pack no longer counts towards the bank
+BANK_STALE_TIMEOUT = 30.0
+BANK_CELL_FIELDS = [f"CellVol{cell}" for cell in range(CELL_COUNT_MAX)]
+BANK_TEMP_FIELDS = ('TempMos', 'TempBat1', 'TempBat2', 'TempBat3', 'TempBat4', 'TempBat5')
+# Running sums of (state field, bank field)
+BANK_SUMS = (('BatCurrent', 'current'), ('BatWatt', 'power'), ('SOCCapRemain', 'capacityRemain'),
+             ('SOCFullChargeCap', 'capacityFull'))
+# Unsigned sum fields that take the sign of BatCurrent, so charging and discharging packs cancel out
+BANK_SIGNED_SUMS = frozenset(('BatWatt',))
+
+class IndexedHeap:
+    """
+    Binary min heap of [value, key] entries with a key to position index.
+
+    set() replaces the value of a key and remove() drops it in O(log n), which
+    heapq cannot do without scanning. Entries are ordered by value only, so
+    keys never have to be comparable.
+    """
+    def __init__(self):
+        self.heap = []
+        self.index = {}
+
+    def __len__(self):
+        return len(self.heap)
+
+    def top(self):
+        return self.heap[0] if self.heap else None
+
+    def set(self, key, value):
+        position = self.index.get(key)
+        if position is None:
+            position = len(self.heap)
+            self.heap.append([value, key])
+            self.index[key] = position
+        else:
+            self.heap[position][0] = value
+        self._down(self._up(position))
+
+    def remove(self, key):
+        position = self.index.pop(key, None)
+        if position is None:
+            return
+        last = self.heap.pop()
+        if position < len(self.heap):
+            self.heap[position] = last
+            self.index[last[1]] = position
+            self._down(self._up(position))
+
+    def _swap(self, a, b):
+        heap = self.heap
+        heap[a], heap[b] = heap[b], heap[a]
+        self.index[heap[a][1]] = a
+        self.index[heap[b][1]] = b
+
+    def _up(self, position):
+        heap = self.heap
+        while position:
+            parent = (position - 1) >> 1
+            if heap[position][0] >= heap[parent][0]:
+                break
+            self._swap(position, parent)
+            position = parent
+        return position
+
+    def _down(self, position):
+        heap = self.heap
+        size = len(heap)
+        while True:
+            child = 2 * position + 1
+            if child >= size:
+                return
+            if child + 1 < size and heap[child + 1][0] < heap[child][0]:
+                child += 1
+            if heap[position][0] <= heap[child][0]:
+                return
+            self._swap(position, child)
+            position = child
+
+class BankAggregator:
+    """
+    Bank totals over every pack, updated with each state record.
+
+    A pack's previous contribution is subtracted from the running sums and the
+    new one added, and its lowest cell, highest cell and highest temperature
+    are kept in indexed heaps, so an update costs one pass over that pack's
+    cells plus O(log packs) instead of a pass over every pack. Packs silent
+    for staleTimeout seconds are taken out. The result is published as a new
+    dict per update, readers on other threads just take summary.
+    """
+    def __init__(self, staleTimeout=BANK_STALE_TIMEOUT):
+        self.staleTimeout = staleTimeout
+        self.sums = dict.fromkeys((name for _, name in BANK_SUMS), 0)
+        # packId: (sum values, lowest cell, highest cell, highest temperature) of its last record
+        self.packs = {}
+        self.lastSeen = OrderedDict()
+        self.cellMin = IndexedHeap()
+        self.cellMax = IndexedHeap()
+        self.tempMax = IndexedHeap()
+        self.listeners = []
+        self.summary = self.build()
+
+    def addListener(self, listener):
+        # listener(BANK_ID, BANK_ID, summary), same signature as the bus listeners
+        self.listeners.append(listener)
+
+    def update(self, packId, kind, values, timestamp=None):
+        # Bus listener
+        if kind != 'state':
+            return
+        now = time.monotonic()
+        sign = -1 if values.get('BatCurrent', 0) < 0 else 1
+        sums = tuple(sign * values.get(field, 0) if field in BANK_SIGNED_SUMS else values.get(field, 0)
+                     for field, _ in BANK_SUMS)
+        cells = [(voltage, cell) for cell, voltage in enumerate(map(values.get, BANK_CELL_FIELDS)) if voltage]
+        temps = [(values[field], field) for field in BANK_TEMP_FIELDS if field in values]
+        lowest = min(cells, default=None)
+        highest = max(cells, default=None)
+        hottest = max(temps, default=None)
+        previous = self.packs.get(packId)
+        for (_, name), value, old in zip(BANK_SUMS, sums, previous[0] if previous else (0,) * len(BANK_SUMS)):
+            self.sums[name] += value - old
+        self.packs[packId] = (sums, lowest, highest, hottest)
+        self._setExtreme(self.cellMin, packId, lowest, 1)
+        self._setExtreme(self.cellMax, packId, highest, -1)
+        self._setExtreme(self.tempMax, packId, hottest, -1)
+        self.lastSeen[packId] = now
+        self.lastSeen.move_to_end(packId)
+        self.expire(now)
+        self.publish()
+
+    @staticmethod
+    def _setExtreme(heap, packId, extreme, sign):
+        # The max heaps store negated values
+        if extreme is None:
+            heap.remove(packId)
+        else:
+            heap.set(packId, sign * extreme[0])
+
+    def expire(self, now=None):
+        now = time.monotonic() if now is None else now
+        expired = False
+        while self.lastSeen:
+            packId, seen = next(iter(self.lastSeen.items()))
+            if now - seen < self.staleTimeout:
+                break
+            del self.lastSeen[packId]
+            sums = self.packs.pop(packId)[0]
+            for (_, name), value in zip(BANK_SUMS, sums):
+                self.sums[name] -= value
+            for heap in (self.cellMin, self.cellMax, self.tempMax):
+                heap.remove(packId)
+            logging.info(f"Pack ID:{packId} is stale, removed from the bank totals")
+            expired = True
+        return expired
+
+    def build(self):
+        sums = self.sums
+        summary = dict(sums)
+        summary['packs'] = len(self.packs)
+        summary['soc'] = round(100 * sums['capacityRemain'] / sums['capacityFull'], 1) if sums['capacityFull'] else None
+        for name, heap, slot in (('cellMin', self.cellMin, 1), ('cellMax', self.cellMax, 2)):
+            top = heap.top()
+            if top is not None:
+                voltage, cell = self.packs[top[1]][slot]
+                summary.update({name: voltage, f"{name}Pack": top[1], f"{name}Cell": cell})
+        if 'cellMin' in summary and 'cellMax' in summary:
+            summary['cellDelta'] = summary['cellMax'] - summary['cellMin']
+        top = self.tempMax.top()
+        if top is not None:
+            temperature, sensor = self.packs[top[1]][3]
+            summary.update({'tempMax': temperature, 'tempMaxPack': top[1], 'tempMaxSensor': sensor})
+        return summary
+
+    def publish(self):
+        summary = self.summary = self.build()
+        for listener in self.listeners:
+            try:
+                listener(BANK_ID, BANK_ID, summary)
+            except Exception:
+                logging.exception("Bank listener failed")
+
+    async def expireLoop(self):
+        # Stale packs also have to leave the bank when no record arrives at all
+        while True:
+            await asyncio.sleep(self.staleTimeout / 2)
+            if self.expire():
+                self.publish()
@@ -0,0 +1,87 @@
+"""
+Batch decoding of captured frames with NumPy.
+"""
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+from .protocol import JK_HEADER, JK_RECORD_SIZE
+from .records import CELL_COUNT_MAX, CONFIG_LAYOUT, JK_PAYLOAD_OFFSET, STATE_LAYOUT
+
+# Per cell fields are returned as one (N, 32) column instead of 32 columns
+BATCH_CELL_GROUPS = ('CellVol', 'CellWireRes', 'CellConWireRes')
+_batchDtypes = {}
+
+def requireNumpy():
+    if np is None:
+        raise ImportError("NumPy is required for batch decoding, to install use: python -m pip install 'numpy'")
+
+def recordDtype(layout):
+    # Structured dtype mirroring a RecordLayout over a whole 300 byte record
+    requireNumpy()
+    dtype = _batchDtypes.get(id(layout))
+    if dtype is not None:
+        return dtype
+    names = ['RecordType', 'RecordSource']
+    formats = ['u1', 'u1']
+    offsets = [4, 5]
+    groups = {}
+    for name, offset, fmt in layout.fields:
+        prefix = name.rstrip('0123456789')
+        if prefix in BATCH_CELL_GROUPS:
+            groups.setdefault(prefix, (offset, fmt))
+            continue
+        names.append(name)
+        formats.append('<' + fmt)
+        offsets.append(JK_PAYLOAD_OFFSET + offset)
+    for prefix, (offset, fmt) in groups.items():
+        names.append(prefix)
+        formats.append(('<' + fmt, (CELL_COUNT_MAX,)))
+        offsets.append(JK_PAYLOAD_OFFSET + offset)
+    for wordName, offset, fmt, _ in layout.bitFields:
+        names.append(wordName)
+        formats.append('<' + fmt)
+        offsets.append(JK_PAYLOAD_OFFSET + offset)
+    for name, offset, size in layout.stringFields:
+        names.append(name)
+        formats.append(f"S{size}")
+        offsets.append(JK_PAYLOAD_OFFSET + offset)
+    names.append('Checksum')
+    formats.append('u1')
+    offsets.append(JK_RECORD_SIZE - 1)
+    dtype = np.dtype({'names': names, 'formats': formats, 'offsets': offsets, 'itemsize': JK_RECORD_SIZE})
+    _batchDtypes[id(layout)] = dtype
+    return dtype
+
+def frameArray(buffer):
+    # View a contiguous buffer of 300 byte records as an (N, 300) uint8 array without copying
+    requireNumpy()
+    frames = np.frombuffer(buffer, dtype=np.uint8)
+    if frames.size % JK_RECORD_SIZE:
+        raise ValueError(f"Buffer of {frames.size}bytes is not a whole number of {JK_RECORD_SIZE} byte records")
+    return frames.reshape(-1, JK_RECORD_SIZE)
+
+def batchChecksumValid(frames):
+    # Vectorized calcCheckSum8Mod256 and header check over an (N, 300) array
+    checksum = frames[:, :JK_RECORD_SIZE - 1].sum(axis=1, dtype=np.uint32) & 0xFF
+    header = np.frombuffer(JK_HEADER, dtype=np.uint8)
+    return (checksum == frames[:, JK_RECORD_SIZE - 1]) & (frames[:, :len(JK_HEADER)] == header).all(axis=1)
+
+def decodeBatch(buffer):
+    """
+    Decode N raw 300 byte records in one pass.
+
+    Returns a dict with 'valid' (bool per record), 'recordType' and for the
+    config (type 1) and state (type 2) records that passed the checksum a dict
+    of column arrays keyed by field name. Cell fields are (N, 32) arrays and bit
+    fields are returned as their raw words, e.g. state['BatAlarms'].
+    """
+    frames = frameArray(buffer)
+    valid = batchChecksumValid(frames)
+    recordType = frames[:, 4]
+    result = {'valid': valid, 'recordType': recordType}
+    for key, wantedType, layout in (('config', 1, CONFIG_LAYOUT), ('state', 2, STATE_LAYOUT)):
+        records = frames.view(recordDtype(layout)).reshape(-1)[valid & (recordType == wantedType)]
+        result[key] = {name: records[name] for name in records.dtype.names}
+    return result
@@ -0,0 +1,149 @@
+"""
+Binary capture log and replay.
+"""
+import asyncio
+import bisect
+import logging
+import mmap
+import struct
+import time
+
+from .protocol import FRAME_FC16_REQUEST, FRAME_FC16_RESPONSE, FRAME_JK_RECORD
+
+# File: magic followed by records of timestamp (8) + tag (1) + length (2) + raw bytes.
+# Every CAPTURE_INDEX_INTERVAL records a (timestamp, file offset) entry is added to
+# the .idx sidecar so a replay can seek by time without scanning the capture.
+CAPTURE_MAGIC = b'JKCAP\x01\n\x00'
+CAPTURE_RECORD = struct.Struct('<dBH')
+CAPTURE_INDEX = struct.Struct('<dQ')
+CAPTURE_INDEX_INTERVAL = 256
+
+# Capture tags
+CAPTURE_RX = 0  # raw bytes as read from the bus
+CAPTURE_TX = 1  # raw bytes written to the bus
+CAPTURE_FC16_REQUEST = 2
+CAPTURE_FC16_RESPONSE = 3
+CAPTURE_JK_RECORD = 4
+CAPTURE_FRAME_TAGS = {FRAME_FC16_REQUEST: CAPTURE_FC16_REQUEST,
+                      FRAME_FC16_RESPONSE: CAPTURE_FC16_RESPONSE,
+                      FRAME_JK_RECORD: CAPTURE_JK_RECORD}
+CAPTURE_TAG_FRAMES = {tag: frameType for frameType, tag in CAPTURE_FRAME_TAGS.items()}
+
+class CaptureWriter:
+    """
+    Append-only writer for the binary capture log.
+    """
+    def __init__(self, path, indexInterval=CAPTURE_INDEX_INTERVAL):
+        self.path = path
+        self.indexInterval = indexInterval
+        self.file = open(path, 'ab')
+        if self.file.tell() == 0:
+            self.file.write(CAPTURE_MAGIC)
+        self.index = open(path + '.idx', 'ab')
+        self.count = 0
+
+    def write(self, tag, data, timestamp=None):
+        if timestamp is None:
+            timestamp = time.time()
+        if self.count % self.indexInterval == 0:
+            self.index.write(CAPTURE_INDEX.pack(timestamp, self.file.tell()))
+        self.file.write(CAPTURE_RECORD.pack(timestamp, tag, len(data)))
+        self.file.write(data)
+        self.count += 1
+
+    def writeFrame(self, frameType, frame, timestamp=None):
+        self.write(CAPTURE_FRAME_TAGS[frameType], frame, timestamp)
+
+    def flush(self):
+        self.file.flush()
+        self.index.flush()
+
+    def close(self):
+        self.file.close()
+        self.index.close()
+
+class CaptureReader:
+    """
+    Memory mapped reader for the binary capture log.
+
+    Iterating yields (timestamp, tag, data) where data is a memoryview into the
+    mapped file, so it has to be copied if it is kept after the reader is closed.
+    """
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as file:
+            self.map = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        if self.map[:len(CAPTURE_MAGIC)] != CAPTURE_MAGIC:
+            self.map.close()
+            raise ValueError(f"{path} is not a JK capture file")
+        self.view = memoryview(self.map)
+        self.index = self._readIndex(path + '.idx')
+
+    @staticmethod
+    def _readIndex(path):
+        try:
+            with open(path, 'rb') as file:
+                data = file.read()
+        except FileNotFoundError:
+            return []
+        usable = len(data) - len(data) % CAPTURE_INDEX.size
+        return list(CAPTURE_INDEX.iter_unpack(data[:usable]))
+
+    def seek(self, timestamp):
+        # File offset of the last index entry at or before timestamp
+        position = bisect.bisect_right(self.index, (timestamp, float('inf'))) - 1
+        if position < 0:
+            return len(CAPTURE_MAGIC)
+        return self.index[position][1]
+
+    def records(self, start=None):
+        offset = len(CAPTURE_MAGIC) if start is None else self.seek(start)
+        view = self.view
+        end = len(view)
+        while offset + CAPTURE_RECORD.size <= end:
+            timestamp, tag, length = CAPTURE_RECORD.unpack_from(view, offset)
+            offset += CAPTURE_RECORD.size
+            if offset + length > end:
+                # Truncated last record of a capture that is still being written
+                break
+            if start is None or timestamp >= start:
+                yield timestamp, tag, view[offset:offset + length]
+            offset += length
+
+    def __iter__(self):
+        return self.records()
+
+    def close(self):
+        self.view.release()
+        self.map.close()
+
+async def replayCapture(path, bus, realtime=False, speed=1.0, start=None):
+    # Feed a capture into a JkBusMonitor, as fast as possible or at the captured pace
+    reader = CaptureReader(path)
+    count = 0
+    firstTimestamp = None
+    startTime = time.monotonic()
+    data = None
+    logging.info(f"Replaying capture {path}{' in real time' if realtime else ''}")
+    try:
+        for timestamp, tag, data in reader.records(start):
+            if realtime:
+                if firstTimestamp is None:
+                    firstTimestamp = timestamp
+                delay = (timestamp - firstTimestamp) / speed - (time.monotonic() - startTime)
+                if delay > 0:
+                    await asyncio.sleep(delay)
+            if tag == CAPTURE_RX:
+                bus.feed(data, timestamp)
+            elif tag in CAPTURE_TAG_FRAMES:
+                bus.handleFrame(CAPTURE_TAG_FRAMES[tag], data.tobytes(), timestamp)
+            count += 1
+            # Let other tasks run during a fast replay
+            if not realtime and count % 1000 == 0:
+                await asyncio.sleep(0)
+    finally:
+        del data
+        reader.close()
+    elapsed = time.monotonic() - startTime
+    logging.info(f"Replayed {count} capture records in {elapsed:.2f}s")
+    return count
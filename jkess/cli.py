@@ -0,0 +1,298 @@
+"""
+The jkess command: read one or more buses and feed the configured outputs.
+
+The MQTT, serial, SQLite and HTTP backends are imported only when the options
+ask for them, so a replay or a simulation runs without paho or pyserial.
+"""
+import argparse
+import asyncio
+import logging
+import os
+import signal
+import time
+
+from .alarms import ALARM_CLEAR_DELAY, ALARM_RAISE_DELAY, AlarmEngine
+from .bank import BANK_STALE_TIMEOUT, BankAggregator
+from .config import CONFIG_ENV_FILE, applyConfig, loadConfig
+from .instrumentation import METRICS_LOG_INTERVAL, OUTPUT_COUNTERS, TRACE_FRAMES, FrameTracer
+from .monitor import MEMO_TTL, JkBusMonitor
+from .poll import parsePollIds
+from .protocol import FRAME_JK_RECORD
+from .store import PackStateStore
+
+# Defaults of the settings that used to be module globals, override them in the
+# config file or the environment
+DEFAULT_PORT = '/dev/ttyUSB0'
+DEFAULT_BAUDRATE = 115200
+DEFAULT_MQTT_BROKER = "localhost"
+DEFAULT_MQTT_PORT = 1883
+DEFAULT_MQTT_CLIENT_ID = "jkess-mqtt-1"
+DEFAULT_MQTT_USERNAME = None
+DEFAULT_MQTT_TOPIC = "tele"
+DEFAULT_MQTT_DISCOVERY_PREFIX = "homeassistant"
+DEFAULT_MQTT_STATUS_TOPIC = "homeassistant/status"
+# Same defaults as the MQTT backend, repeated so --help does not import it
+DEFAULT_MQTT_QUEUE = 256
+OVERFLOW_POLICIES = ('latest-per-pack', 'drop-oldest')
+SQLITE_RETENTION_DAYS = 7
+HTTP_HOST = '0.0.0.0'
+
+def latencyReport(report):
+    # One "id: mean/max ms timeouts" entry per pack of a correlator report
+    return ', '.join(f"{id}: {stats['mean'] * 1e3:.1f}/{stats['max'] * 1e3:.1f}ms {stats['timeouts']} timeouts"
+                     if stats['count'] else f"{id}: no records {stats['timeouts']} timeouts"
+                     for id, stats in report.items())
+
+async def metricsLogLoop(metrics, interval=METRICS_LOG_INTERVAL, name='bus', correlator=None):
+    previous = {}
+    while True:
+        await asyncio.sleep(interval)
+        counters = metrics.counters()
+        delta = {counter: value - previous.get(counter, 0) for counter, value in counters.items()
+                 if value != previous.get(counter, 0)}
+        previous = counters
+        latencies = ' '.join(f"{histogram}: p50 {summary['p50'] * 1e6:.0f}us p99 {summary['p99'] * 1e6:.0f}us"
+                             for histogram, summary in metrics.histograms().items() if summary['count'])
+        logging.info(f"Metrics {name} last {interval}s: {delta} {latencies}")
+        if correlator is not None and correlator.latency:
+            logging.info(f"Request latency {name} per pack: {latencyReport(correlator.report())}")
+
+async def outputLogLoop(outputs, interval=METRICS_LOG_INTERVAL):
+    # Queue depth, counter deltas and publish latency of every output
+    previous = {}
+    while True:
+        await asyncio.sleep(interval)
+        for name, output in list(outputs.items()):
+            stats = output.stats()
+            last = previous.get(name, {})
+            delta = {counter: stats[counter] - last.get(counter, 0) for counter in OUTPUT_COUNTERS
+                     if counter in stats and stats[counter] != last.get(counter, 0)}
+            previous[name] = stats
+            latency = ''
+            if stats.get('meanLatency') is not None:
+                latency = f" latency {stats['meanLatency'] * 1e3:.1f}/{stats['maxLatency'] * 1e3:.1f}ms"
+            error = f" last error {stats['lastError']}" if stats.get('lastError') else ''
+            logging.info(f"Output {name} last {interval}s: queue {stats['queueDepth']} {delta}{latency}{error}")
+
+def parsePortSpec(spec, baudrate):
+    # "[name=]port[@baudrate]" to (name or None, port, baudrate)
+    name, _, port = spec.rpartition('=')
+    port, _, baud = port.partition('@')
+    return name or None, port, int(baud) if baud else baudrate
+
+def busCapturePath(path, name):
+    # One capture file per named bus
+    if path is None or name is None:
+        return path
+    root, ext = os.path.splitext(path)
+    return f"{root}.{name}{ext}"
+
+async def main(args):
+    # Shared event loop, store and publishing for every bus, each with its own reassembly state
+    specs = [parsePortSpec(spec, args.baudrate) for spec in args.port]
+    if len(specs) > 1:
+        # Several buses are always named, after their device unless given
+        specs = [(name or os.path.basename(device), device, baud) for name, device, baud in specs]
+    store = PackStateStore()
+    buses = [JkBusMonitor(FrameTracer(args.trace_frames, enabled=args.trace), name, store) for name, _, _ in specs]
+
+    def dumpTraces():
+        for bus in buses:
+            bus.tracer.dump(f"on demand, bus {bus.name}" if bus.name else 'on demand')
+    # kill -USR1 dumps the recent raw frames
+    try:
+        asyncio.get_running_loop().add_signal_handler(signal.SIGUSR1, dumpTraces)
+    except (AttributeError, NotImplementedError):
+        pass
+    listeners = []
+    eventListeners = []
+    history = None
+    if args.history:
+        from .history import HistoryStore
+        history = HistoryStore()
+        listeners.append(history.update)
+    bank = BankAggregator(args.bank_stale)
+    listeners.append(bank.update)
+    asyncio.create_task(bank.expireLoop())
+    # Name to output, for the /metrics and the metrics log
+    outputs = {}
+    sink = None
+    if args.sqlite:
+        from .persist import SqliteSink
+        sink = SqliteSink(args.sqlite, {'samples': args.sqlite_retention * 86400}).start()
+        listeners.append(sink.update)
+        outputs['sqlite'] = sink
+    if args.http_port:
+        from .httpd import startHttpServer
+        server = startHttpServer(store, args.http_port, args.http_host, buses, bank, outputs, history)
+        listeners.append(server.live.update)
+        bank.addListener(server.live.update)
+    if args.metrics_interval:
+        for bus, (name, _, _) in zip(buses, specs):
+            asyncio.create_task(metricsLogLoop(bus.metrics, args.metrics_interval, name or 'bus', bus.correlator))
+    if args.mqtt:
+        from .mqtt import OVERFLOW_DROP_OLDEST, MqttOutput, connectMqtt
+        from .publish import (DISCOVERY_QUEUE_SIZE, MONITOR_HOST, MQTT_EVENT_QUEUE_SIZE, DeltaPublisher, DiscoveryCache,
+                              EventPublisher, publishLoop)
+        client = connectMqtt(args.mqtt_broker, args.mqtt_port, args.mqtt_client_id, args.mqtt_username,
+                             args.mqtt_password)
+        output = MqttOutput(client, maxSize=args.mqtt_queue, policy=args.mqtt_overflow).start()
+        outputs['mqtt'] = output
+        client.loop_start()
+        stateTopic = f"{args.mqtt_topic}/{MONITOR_HOST}"
+        publisher = DeltaPublisher(output, stateTopic, refreshInterval=args.mqtt_refresh)
+        if args.mqtt_discovery:
+            outputs['mqtt-discovery'] = MqttOutput(client, maxSize=DISCOVERY_QUEUE_SIZE).start()
+            discovery = DiscoveryCache(outputs['mqtt-discovery'], stateTopic, args.mqtt_discovery_prefix,
+                                       statusTopic=args.mqtt_status_topic)
+            discovery.attach()
+            listeners.append(discovery.update)
+        listeners.append(publisher.update)
+        bank.addListener(publisher.update)
+        # Events go through their own FIFO so a raise and its clear are both published
+        outputs['mqtt-events'] = MqttOutput(client, maxSize=MQTT_EVENT_QUEUE_SIZE, policy=OVERFLOW_DROP_OLDEST).start()
+        eventListeners.append(EventPublisher(outputs['mqtt-events'], stateTopic).update)
+        asyncio.create_task(publishLoop(publisher))
+    if args.metrics_interval and outputs:
+        asyncio.create_task(outputLogLoop(outputs, args.metrics_interval))
+    alarms = AlarmEngine(raiseDelay=args.alarm_delay, clearDelay=args.alarm_hold)
+    for listener in eventListeners:
+        alarms.addListener(listener)
+    for bus in buses:
+        # Unchanged config and info records are republished at the MQTT refresh pace
+        bus.memoTtl = args.mqtt_refresh
+        for listener in listeners:
+            bus.addListener(listener)
+        for listener in eventListeners:
+            bus.addEventListener(listener)
+        bus.addRecordListener(alarms.update)
+    if args.replay:
+        from .capture import replayCapture
+        try:
+            await replayCapture(args.replay, buses[0], realtime=args.realtime, speed=args.speed)
+        finally:
+            if sink is not None:
+                sink.stop()
+        return
+    captures = [None] * len(specs)
+    if args.capture:
+        from .capture import CaptureWriter
+        captures = [CaptureWriter(busCapturePath(args.capture, name)) for name, _, _ in specs]
+    simulator = None
+    if args.simulate:
+        from .simulator import BusSimulator
+        simulator = BusSimulator(args.simulate, rate=args.sim_rate, corruption=args.sim_corruption,
+                                 respond=args.poll is not None)
+        specs[0] = (specs[0][0], simulator.open(), specs[0][2])
+    start = time.monotonic()
+    try:
+        from .serialio import read_serial
+        readers = [asyncio.create_task(read_serial(port, baud, bus, capture, args.poll))
+                   for (_, port, baud), bus, capture in zip(specs, buses, captures)]
+        if simulator is None:
+            await asyncio.gather(*readers)
+        else:
+            bus = buses[0]
+            await simulator.run(args.duration)
+            # Give the reader a moment to drain the last frames
+            await asyncio.sleep(0.5)
+            if bus.poller is not None:
+                logging.info(f"Poller {bus.poller.report()} {bus.metrics.counters()}")
+            for reader in readers:
+                reader.cancel()
+            elapsed = time.monotonic() - start
+            records = bus.frameCount(FRAME_JK_RECORD)
+            sent = simulator.sent[FRAME_JK_RECORD]
+            corrupted = simulator.corrupted[FRAME_JK_RECORD]
+            logging.info(f"Decoded {records}/{sent} records ({records / elapsed:.1f} records/s), "
+                         f"lost {sent - records - corrupted} beyond {corrupted} corrupted")
+            for id, stats in bus.correlator.report().items():
+                logging.info(f"Pack ID: {id} latency {stats}")
+    finally:
+        if simulator is not None:
+            simulator.close()
+        for capture in captures:
+            if capture is not None:
+                capture.close()
+        if sink is not None:
+            sink.stop()
+
+def buildParser():
+    parser = argparse.ArgumentParser(description='JK ESS BMS RS485 monitor',
+                                     epilog=f'Every option can also be set in the [jkess] section of the --config file '
+                                            f'or as JKESS_<OPTION> in the environment, e.g. JKESS_MQTT_BROKER. '
+                                            f'The MQTT password is only read from there, as mqtt-password.')
+    parser.add_argument('--config', metavar='FILE', help=f'INI settings file (default ${CONFIG_ENV_FILE} or /etc/jkess.ini)')
+    parser.add_argument('--port', nargs='+', default=[DEFAULT_PORT], metavar='[NAME=]PORT[@BAUD]',
+                        help=f'serial ports, several to read several buses at once (default {DEFAULT_PORT})')
+    parser.add_argument('--baudrate', type=int, default=DEFAULT_BAUDRATE, help='serial baud rate')
+    parser.add_argument('--poll', type=parsePollIds, metavar='IDS',
+                        help='act as the bus master and poll these slave ids, e.g. 1-15 or 1,2,5')
+    parser.add_argument('--capture', metavar='FILE', help='append everything read from the bus to a binary capture')
+    parser.add_argument('--replay', metavar='FILE', help='decode a binary capture instead of reading the serial port')
+    parser.add_argument('--realtime', action='store_true', help='replay at the captured pace instead of as fast as possible')
+    parser.add_argument('--speed', type=float, default=1.0, help='speed factor for a real time replay')
+    parser.add_argument('--trace', action='store_true', help='log every frame, hex dumps included')
+    parser.add_argument('--trace-frames', type=int, default=TRACE_FRAMES, help='raw frames kept for a trace dump on errors or SIGUSR1')
+    parser.add_argument('--metrics-interval', type=float, default=METRICS_LOG_INTERVAL,
+                        help='seconds between ingestion metrics log summaries, 0 to disable')
+    parser.add_argument('--alarm-delay', type=float, default=ALARM_RAISE_DELAY,
+                        help='seconds an alarm bit has to stay set before it is raised')
+    parser.add_argument('--alarm-hold', type=float, default=ALARM_CLEAR_DELAY,
+                        help='seconds an alarm bit has to stay clear before it is cleared')
+    parser.add_argument('--bank-stale', type=float, default=BANK_STALE_TIMEOUT,
+                        help='seconds without a state record before a pack leaves the bank totals')
+    parser.add_argument('--sqlite', metavar='FILE', help='persist state records and their rollups to this SQLite database')
+    parser.add_argument('--sqlite-retention', type=float, default=SQLITE_RETENTION_DAYS,
+                        help='days of raw samples to keep, the rollups are kept longer')
+    parser.add_argument('--http-port', type=int, help='serve Prometheus /metrics, JSON /state/<id> and the /live event stream on this port')
+    parser.add_argument('--http-host', default=HTTP_HOST, help='address for the HTTP server')
+    parser.add_argument('--history', action='store_true',
+                        help='keep an in memory raw and min/max/mean history of every pack, served as /history/<id>')
+    parser.add_argument('--mqtt', action='store_true', help='publish pack changes to the MQTT broker')
+    parser.add_argument('--mqtt-broker', default=DEFAULT_MQTT_BROKER, help='MQTT broker host')
+    parser.add_argument('--mqtt-port', type=int, default=DEFAULT_MQTT_PORT, help='MQTT broker port')
+    parser.add_argument('--mqtt-client-id', default=DEFAULT_MQTT_CLIENT_ID, help='MQTT client id')
+    parser.add_argument('--mqtt-username', default=DEFAULT_MQTT_USERNAME, help='MQTT user name, connects anonymously when unset')
+    parser.add_argument('--mqtt-topic', default=DEFAULT_MQTT_TOPIC, help='MQTT topic prefix, the host name is appended')
+    parser.add_argument('--mqtt-refresh', type=float, default=MEMO_TTL, help='seconds between full MQTT refreshes of a pack')
+    parser.add_argument('--mqtt-discovery', action='store_true', help='publish Home Assistant discovery configs')
+    parser.add_argument('--mqtt-discovery-prefix', default=DEFAULT_MQTT_DISCOVERY_PREFIX,
+                        help='Home Assistant discovery topic prefix')
+    parser.add_argument('--mqtt-status-topic', default=DEFAULT_MQTT_STATUS_TOPIC,
+                        help='Home Assistant birth message topic, discovery is republished when it comes online')
+    parser.add_argument('--mqtt-queue', type=int, default=DEFAULT_MQTT_QUEUE, help='MQTT output queue size')
+    parser.add_argument('--mqtt-overflow', choices=OVERFLOW_POLICIES, default=OVERFLOW_POLICIES[0],
+                        help='what to drop when the MQTT output queue is full')
+    parser.add_argument('--simulate', type=int, metavar='PACKS', help='read from a simulated bus with this many slave packs')
+    parser.add_argument('--sim-rate', type=float, default=1.0, help='simulated polling cycles per second, 0 for as fast as possible')
+    parser.add_argument('--sim-corruption', type=float, default=0.0, help='probability of corrupting a simulated frame')
+    parser.add_argument('--duration', type=float, help='stop the simulation after this many seconds')
+    return parser
+
+def parseArgs(argv=None):
+    parser = buildParser()
+    # The config file is needed before the real parse, its settings become the defaults
+    pre = argparse.ArgumentParser(add_help=False)
+    pre.add_argument('--config')
+    known, _ = pre.parse_known_args(argv)
+    try:
+        config = loadConfig(known.config)
+    except (OSError, ValueError) as exc:
+        parser.error(f"config: {exc}")
+    extra = applyConfig(parser, config)
+    args = parser.parse_args(argv)
+    for key, value in extra.items():
+        setattr(args, key, value)
+    return args
+
+def run(argv=None):
+    # Console entry point
+    logging.basicConfig(format=f"%(asctime)-15s \033[36m%(levelname)-8s\033[0m: %(message)s", level=logging.INFO)
+    args = parseArgs(argv)
+    if args.trace:
+        logging.getLogger().setLevel(logging.DEBUG)
+    try:
+        asyncio.run(main(args))
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,94 @@
+"""
+Monitor settings from an INI file and JKESS_* environment variables.
+
+Every command line option can be set in the [jkess] section of the file, or as
+JKESS_<OPTION> in the environment, e.g. mqtt-broker = broker.lan or
+JKESS_MQTT_BROKER=broker.lan. The command line beats the environment, which
+beats the file, which beats the defaults.
+"""
+import configparser
+import logging
+import os
+
+CONFIG_SECTION = 'jkess'
+CONFIG_ENV_PREFIX = 'JKESS_'
+CONFIG_ENV_FILE = 'JKESS_CONFIG'
+# Read when neither --config nor JKESS_CONFIG names a file
+CONFIG_DEFAULT_PATHS = ('/etc/jkess.ini',)
+
+# Settings without a command line option of their own, kept out of ps output
+CONFIG_ONLY = {
+    'mqtt_password': None,
+}
+
+def configKey(name):
+    return name.strip().lower().replace('-', '_')
+
+def readConfigFile(path):
+    parser = configparser.ConfigParser(interpolation=None)
+    with open(path) as file:
+        parser.read_file(file)
+    if not parser.has_section(CONFIG_SECTION):
+        logging.warning(f"No [{CONFIG_SECTION}] section in {path}")
+        return {}
+    return {configKey(key): value for key, value in parser.items(CONFIG_SECTION)}
+
+def readConfigEnv(environ=None):
+    environ = os.environ if environ is None else environ
+    return {configKey(key[len(CONFIG_ENV_PREFIX):]): value for key, value in environ.items()
+            if key.startswith(CONFIG_ENV_PREFIX) and key != CONFIG_ENV_FILE}
+
+def loadConfig(path=None, environ=None):
+    # Raw string settings from the file and the environment, the environment wins
+    environ = os.environ if environ is None else environ
+    path = path or environ.get(CONFIG_ENV_FILE)
+    config = {}
+    if path:
+        config.update(readConfigFile(path))
+    else:
+        for candidate in CONFIG_DEFAULT_PATHS:
+            if os.path.exists(candidate):
+                config.update(readConfigFile(candidate))
+                break
+    config.update(readConfigEnv(environ))
+    return config
+
+def parseBool(value):
+    value = value.strip().lower()
+    if value in ('1', 'yes', 'true', 'on'):
+        return True
+    if value in ('0', 'no', 'false', 'off', ''):
+        return False
+    raise ValueError(f"not a boolean: {value!r}")
+
+def applyConfig(parser, config):
+    """
+    Turn the settings into parser defaults, converted like the command line would.
+
+    Returns the settings the parser has no option for, CONFIG_ONLY filled in.
+    """
+    actions = {action.dest: action for action in parser._actions}
+    defaults = {}
+    extra = dict(CONFIG_ONLY)
+    for key, value in config.items():
+        action = actions.get(key)
+        if action is None or key == 'help':
+            if key in CONFIG_ONLY:
+                extra[key] = value
+            else:
+                logging.warning(f"Ignoring unknown setting {key}")
+            continue
+        try:
+            if action.nargs == 0:
+                value = parseBool(value)
+            elif action.nargs in ('+', '*'):
+                value = [action.type(item) if action.type else item for item in value.split()]
+            elif action.type is not None:
+                value = action.type(value)
+            if action.choices is not None and value not in action.choices:
+                raise ValueError(f"not one of {', '.join(map(str, action.choices))}")
+        except (TypeError, ValueError) as exc:
+            parser.error(f"setting {key}: {exc}")
+        defaults[key] = value
+    parser.set_defaults(**defaults)
+    return extra
@@ -0,0 +1,174 @@
+"""
+In memory multi resolution telemetry history.
+"""
+import struct
+import time
+from array import array
+from operator import add, itemgetter
+
+from .records import CELL_COUNT_MAX
+
+HISTORY_SERIES = ([f"CellVol{cell}" for cell in range(CELL_COUNT_MAX)] +
+                  ['BatCurrent', 'SOCStateOfCharge', 'TempMos', 'TempBat1', 'TempBat2', 'TempBat3',
+                   'TempBat4', 'TempBat5'])
+# Raw samples kept per pack
+HISTORY_RAW_CAPACITY = 3600
+# (seconds per bucket, buckets kept) of the min/max/mean rollups
+HISTORY_RESOLUTIONS = ((10, 1080), (60, 720), (900, 384))
+
+class TelemetryRing:
+    """
+    Fixed size circular buffer of timestamped float32 rows.
+
+    segments() returns the requested rows as at most two (timestamps, rows)
+    pairs of memoryviews into the ring, oldest first. They are not copies, so
+    they show newer data once the ring wraps over them.
+    """
+    def __init__(self, capacity, width, typecode='f'):
+        self.capacity = capacity
+        self.width = width
+        self.typecode = typecode
+        self.row = struct.Struct(f"<{width}{typecode}")
+        self.data = bytearray(capacity * self.row.size)
+        self.times = array('d', bytes(8 * capacity))
+        self.head = 0
+        self.count = 0
+
+    def append(self, timestamp, values):
+        self.row.pack_into(self.data, self.head * self.row.size, *values)
+        self.times[self.head] = timestamp
+        self.head = (self.head + 1) % self.capacity
+        if self.count < self.capacity:
+            self.count += 1
+
+    def _time(self, index):
+        # Timestamp of the index-th oldest row
+        return self.times[(self.head - self.count + index) % self.capacity]
+
+    def segments(self, last=None, since=None):
+        count = self.count if last is None else min(last, self.count)
+        if since is not None:
+            low, high = self.count - count, self.count
+            while low < high:
+                middle = (low + high) // 2
+                if self._time(middle) < since:
+                    low = middle + 1
+                else:
+                    high = middle
+            count = self.count - low
+        start = (self.head - count) % self.capacity
+        ranges = [(start, start + count)] if start + count <= self.capacity else [(start, self.capacity), (0, self.head)]
+        times = memoryview(self.times)
+        data = memoryview(self.data)
+        size = self.row.size
+        return [(times[begin:end], data[begin * size:end * size].cast(self.typecode, (end - begin, self.width)))
+                for begin, end in ranges if end > begin]
+
+class TelemetryAggregate:
+    """
+    Min/max/mean per fixed time bucket, updated incrementally.
+
+    The open bucket keeps running min, max and sum lists, a closed bucket is
+    written to the ring as one row of width * 3 values: mins, maxes, means.
+    add() takes a partial aggregate so finer buckets can be rolled up into
+    coarser ones; a single sample is (values, values, values, 1).
+    """
+    def __init__(self, resolution, capacity, width):
+        self.resolution = resolution
+        self.width = width
+        self.ring = TelemetryRing(capacity, width * 3)
+        self.bucket = None
+        self.min = self.max = self.sum = None
+        self.samples = 0
+
+    def add(self, timestamp, mins, maxes, sums, samples):
+        # Returns the bucket this closed as (start, mins, maxes, sums, samples), else None
+        bucket = int(timestamp // self.resolution)
+        if bucket == self.bucket:
+            self.min = list(map(min, self.min, mins))
+            self.max = list(map(max, self.max, maxes))
+            self.sum = list(map(add, self.sum, sums))
+            self.samples += samples
+            return None
+        closed = None
+        if self.samples:
+            closed = (self.bucket * self.resolution, self.min, self.max, self.sum, self.samples)
+            self.ring.append(closed[0], self.min + self.max + self._mean())
+        self.bucket = bucket
+        self.min = list(mins)
+        self.max = list(maxes)
+        self.sum = list(sums)
+        self.samples = samples
+        return closed
+
+    def _mean(self):
+        samples = self.samples
+        return [total / samples for total in self.sum]
+
+    def current(self):
+        # (bucket start, mins, maxes, means) of the bucket still being filled
+        if not self.samples:
+            return None
+        return self.bucket * self.resolution, list(self.min), list(self.max), self._mean()
+
+class TelemetryHistory:
+    """
+    Raw samples and rollups of HISTORY_SERIES for one pack.
+
+    Samples only touch the finest rollup, its closed buckets cascade into the
+    coarser ones, so a frame costs the same whatever the number of resolutions.
+    Resolutions must each be a multiple of the previous one.
+    """
+    def __init__(self, series=HISTORY_SERIES, rawCapacity=HISTORY_RAW_CAPACITY, resolutions=HISTORY_RESOLUTIONS):
+        self.series = tuple(series)
+        self.index = {name: column for column, name in enumerate(self.series)}
+        getValues = itemgetter(*self.series)
+        # itemgetter of a single name returns the bare value
+        self.getValues = getValues if len(self.series) > 1 else lambda state: (getValues(state),)
+        self.raw = TelemetryRing(rawCapacity, len(self.series))
+        self.aggregates = {resolution: TelemetryAggregate(resolution, capacity, len(self.series))
+                           for resolution, capacity in sorted(resolutions)}
+        self._cascade = list(self.aggregates.values())
+
+    def add(self, timestamp, state):
+        values = self.getValues(state)
+        self.raw.append(timestamp, values)
+        closed = (timestamp, values, values, values, 1)
+        for aggregate in self._cascade:
+            closed = aggregate.add(*closed)
+            if closed is None:
+                break
+
+    def query(self, resolution=None, last=None, since=None):
+        # Raw rows when resolution is None, else rollup rows of mins, maxes and means
+        ring = self.raw if resolution is None else self.aggregates[resolution].ring
+        return ring.segments(last, since)
+
+    def column(self, name, resolution=None, last=None, since=None, statistic='mean'):
+        # Copy of one series as a list of (timestamp, value)
+        column = self.index[name]
+        if resolution is not None:
+            column += {'min': 0, 'max': 1, 'mean': 2}[statistic] * len(self.series)
+        return [(timestamp, rows[row, column])
+                for times, rows in self.query(resolution, last, since)
+                for row, timestamp in enumerate(times)]
+
+class HistoryStore:
+    """
+    TelemetryHistory per pack, fed from the decoded state records.
+    """
+    def __init__(self, **options):
+        self.options = options
+        self.packs = {}
+
+    def update(self, packId, kind, values, timestamp=None):
+        # Bus listener
+        if kind != 'state':
+            return
+        history = self.packs.get(packId)
+        if history is None:
+            history = self.packs[packId] = TelemetryHistory(**self.options)
+        history.add(time.time() if timestamp is None else timestamp, values)
+
+    def history(self, packId):
+        return self.packs.get(packId)
@@ -0,0 +1,325 @@
+"""
+Prometheus /metrics, JSON /state and /history and Server-Sent Events /live endpoint.
+"""
+import json
+import logging
+import math
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs
+
+from .bank import BANK_ID
+from .instrumentation import OUTPUT_COUNTERS
+from .live import LIVE_WRITE_TIMEOUT, LiveFanout
+from .store import RECORD_KINDS, STORE_FIELDS
+
+HTTP_HOST = '0.0.0.0'
+PROMETHEUS_CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+# Per cell fields are one metric family with a cell label
+METRIC_CELL_PREFIXES = ('CellVol', 'CellSta', 'CellWireRes', 'CellWireResSta', 'CellConWireRes')
+
+def metricName(kind, name):
+    return f"jkess_{kind}_{name.replace('%', 'pct')}"
+
+def metricValue(value):
+    return format(value, '.10g')
+
+class MetricFamilies:
+    """
+    Prometheus metric families of one record kind.
+
+    Each family is (header, [(label suffix, field name)...]) in a fixed order,
+    so a pack renders to one chunk of lines per family and the exposition is
+    the families' headers interleaved with every pack's chunks.
+    """
+    def __init__(self, kind, fields):
+        self.kind = kind
+        self.fields = fields
+        families = {}
+        layout = fields.layout
+        for name in layout.fieldNames + layout.bitNames:
+            prefix = name.rstrip('0123456789')
+            if prefix in METRIC_CELL_PREFIXES and prefix != name:
+                family, label = metricName(kind, prefix), f',cell="{name[len(prefix):]}"'
+            else:
+                family, label = metricName(kind, name), ''
+            families.setdefault(family, []).append((label, name))
+        self.families = [(f"# TYPE {family} gauge\n", members) for family, members in families.items()]
+        self.stringNames = fields.stringNames
+
+    def render(self, snapshot):
+        # Tuple of one text chunk per family for this pack
+        pack = f'pack="{snapshot.packId}"'
+        get = snapshot.get
+        chunks = [''.join(f"{family.split()[2]}{{{pack}{label}}} {metricValue(get(name))}\n" for label, name in members)
+                  for family, members in self.families]
+        if self.stringNames:
+            labels = ''.join(f',{name}="{escapeLabel(value)}"' for name, value in zip(self.stringNames, snapshot.strings))
+            chunks.append(f"jkess_{self.kind}{{{pack}{labels}}} 1\n")
+        return tuple(chunks)
+
+    def headers(self):
+        headers = [header for header, _ in self.families]
+        if self.stringNames:
+            headers.append(f"# TYPE jkess_{self.kind} gauge\n")
+        return headers
+
+def parsePackId(packId):
+    return int(packId) if packId.isdigit() else packId
+
+def queryList(query, name):
+    # Comma separated values of a query parameter, None when it is absent
+    values = [value for item in query.get(name, ()) for value in item.split(',') if value]
+    return values or None
+
+def escapeLabel(value):
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def renderFamilies(counters, summaries, gauges):
+    # Exposition text of {family: [lines]} per metric type
+    parts = []
+    for kind, families in (('counter', counters), ('summary', summaries), ('gauge', gauges)):
+        for family, lines in families.items():
+            parts.append(f"# TYPE {family} {kind}\n")
+            parts.extend(lines)
+    return ''.join(parts).encode()
+
+class MetricsCache:
+    """
+    Cached renderings of the state store for the HTTP endpoint.
+
+    A pack's metric lines are formatted once per snapshot version and its
+    /state JSON once per set of versions, so repeated scrapes between frames
+    return the same bytes and a new frame only re-formats that pack.
+    """
+    def __init__(self, store, buses=(), bank=None, outputs=None):
+        self.store = store
+        self.buses = buses
+        self.bank = bank
+        # Name to MQTT or SQLite output, anything with a stats() dict
+        self.outputs = {} if outputs is None else outputs
+        self.families = {kind: MetricFamilies(kind, STORE_FIELDS[recordType]) for recordType, kind in RECORD_KINDS.items()}
+        self.lock = threading.Lock()
+        self.packChunks = {}
+        self.packJson = {}
+        self.body = None
+        self.bodyVersion = None
+        self.renders = 0
+
+    def metrics(self):
+        version = self.store.version
+        body = self.body
+        if body is not None and self.bodyVersion == version:
+            return body
+        with self.lock:
+            if self.body is not None and self.bodyVersion == version:
+                return self.body
+            slots = sorted(list(self.store.slots.items()), key=lambda item: str(item[0]))
+            parts = []
+            for kind, families in self.families.items():
+                rendered = []
+                for packId, slot in slots:
+                    snapshot = slot.snapshots[kind]
+                    if snapshot is None:
+                        continue
+                    cached = self.packChunks.get((packId, kind))
+                    if cached is None or cached[0] != snapshot.version:
+                        cached = (snapshot.version, families.render(snapshot))
+                        self.packChunks[(packId, kind)] = cached
+                        self.renders += 1
+                    rendered.append(cached[1])
+                if not rendered:
+                    continue
+                for index, header in enumerate(families.headers()):
+                    parts.append(header)
+                    parts.extend(chunks[index] for chunks in rendered)
+            self.body = ''.join(parts).encode()
+            self.bodyVersion = version
+            return self.body
+
+    def bankMetrics(self):
+        if self.bank is None:
+            return b''
+        summary = self.bank.summary
+        parts = []
+        for name, value in summary.items():
+            if isinstance(value, (int, float)) and not name.endswith(('Pack', 'Cell')):
+                labels = ''
+                if f"{name}Pack" in summary:
+                    labels = f'{{pack="{summary[name + "Pack"]}"}}'
+                parts.append(f"# TYPE jkess_bank_{name} gauge\njkess_bank_{name}{labels} {metricValue(value)}\n")
+        return ''.join(parts).encode()
+
+    def busMetrics(self):
+        # Ingestion counters change with every read, so they are rendered per scrape
+        counters = {}
+        histograms = {}
+        gauges = {}
+        for bus in self.buses:
+            label = f'bus="{escapeLabel(str(bus.name or ""))}"'
+            for name, value in sorted(bus.metrics.counters().items()):
+                if name.startswith('frames.'):
+                    family, labels = 'jkess_bus_frames_total', f'{label},type="{name[len("frames."):]}"'
+                else:
+                    family, labels = f"jkess_bus_{name}_total", label
+                counters.setdefault(family, []).append(f"{family}{{{labels}}} {value}\n")
+            for name, summary in bus.metrics.histograms().items():
+                family = f"jkess_bus_{name}_seconds"
+                lines = histograms.setdefault(family, [])
+                for quantile, key in (('0.5', 'p50'), ('0.9', 'p90'), ('0.99', 'p99')):
+                    if summary[key] is not None:
+                        lines.append(f'{family}{{{label},quantile="{quantile}"}} {metricValue(summary[key])}\n')
+                lines.append(f"{family}_sum{{{label}}} {metricValue(summary['mean'] * summary['count'])}\n")
+                lines.append(f"{family}_count{{{label}}} {summary['count']}\n")
+            # Request to record latency and timeouts per pack, to find slow or flaky packs
+            for packId, stats in bus.correlator.report().items():
+                labels = f'{label},pack="{escapeLabel(str(packId))}"'
+                for name in ('timeouts', 'responses'):
+                    family = f"jkess_bus_request_{name}_total"
+                    counters.setdefault(family, []).append(f"{family}{{{labels}}} {stats[name]}\n")
+                if stats['count']:
+                    family = 'jkess_bus_request_latency_seconds'
+                    lines = histograms.setdefault(family, [])
+                    lines.append(f"{family}_sum{{{labels}}} {metricValue(stats['mean'] * stats['count'])}\n")
+                    lines.append(f"{family}_count{{{labels}}} {stats['count']}\n")
+                    for name in ('max', 'last'):
+                        family = f"jkess_bus_request_latency_{name}_seconds"
+                        gauges.setdefault(family, []).append(f"{family}{{{labels}}} {metricValue(stats[name])}\n")
+        return renderFamilies(counters, histograms, gauges)
+
+    def outputMetrics(self):
+        # Queue depth, drops and publish latency of the outputs, rendered per scrape
+        counters = {}
+        summaries = {}
+        gauges = {}
+        for name, output in sorted(list(self.outputs.items())):
+            label = f'output="{escapeLabel(name)}"'
+            stats = output.stats()
+            for key, value in stats.items():
+                if key in OUTPUT_COUNTERS:
+                    family = f"jkess_output_{key}_total"
+                    counters.setdefault(family, []).append(f"{family}{{{label}}} {value}\n")
+                elif isinstance(value, (bool, int, float)) and not key.endswith('Latency'):
+                    family = f"jkess_output_{key}"
+                    gauges.setdefault(family, []).append(f"{family}{{{label}}} {metricValue(value)}\n")
+            if stats.get('meanLatency') is not None:
+                family = 'jkess_output_publish_latency_seconds'
+                lines = summaries.setdefault(family, [])
+                lines.append(f"{family}_sum{{{label}}} {metricValue(stats['meanLatency'] * stats['published'])}\n")
+                lines.append(f"{family}_count{{{label}}} {stats['published']}\n")
+                for key in ('max', 'last'):
+                    family = f"jkess_output_publish_latency_{key}_seconds"
+                    gauges.setdefault(family, []).append(f"{family}{{{label}}} {metricValue(stats[f'{key}Latency'])}\n")
+        return renderFamilies(counters, summaries, gauges)
+
+    def state(self, packId):
+        slot = self.store.slots.get(packId)
+        if slot is None:
+            return None
+        snapshots = [slot.snapshots[kind] for kind in RECORD_KINDS.values()]
+        versions = tuple(snapshot.version if snapshot is not None else 0 for snapshot in snapshots)
+        cached = self.packJson.get(packId)
+        if cached is not None and cached[0] == versions:
+            return cached[1]
+        document = {snapshot.kind: snapshot.asDict() for snapshot in snapshots if snapshot is not None}
+        document['timestamp'] = max(snapshot.timestamp for snapshot in snapshots if snapshot is not None)
+        body = json.dumps(document).encode()
+        self.packJson[packId] = (versions, body)
+        return body
+
+class MetricsRequestHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        cache = self.server.cache
+        path, _, query = self.path.partition('?')
+        if path == '/metrics':
+            self.reply(200, PROMETHEUS_CONTENT_TYPE, cache.metrics() + cache.bankMetrics() + cache.busMetrics()
+                       + cache.outputMetrics())
+        elif path == f"/state/{BANK_ID}" and cache.bank is not None:
+            self.reply(200, 'application/json', json.dumps(cache.bank.summary).encode())
+        elif path.startswith('/state/'):
+            packId = path[len('/state/'):]
+            body = cache.state(parsePackId(packId))
+            if body is None:
+                self.reply(404, 'text/plain', b'Unknown pack\n')
+            else:
+                self.reply(200, 'application/json', body)
+        elif path == '/live':
+            self.live(parse_qs(query))
+        elif path.startswith('/history/'):
+            self.history(parsePackId(path[len('/history/'):]), parse_qs(query))
+        else:
+            self.reply(404, 'text/plain', b'Not found\n')
+
+    def live(self, query):
+        # /live?packs=1,2&kinds=state,bank&fields=BatVol,CellVol&interval=0.5, every parameter optional
+        live = self.server.live
+        try:
+            packs = queryList(query, 'packs')
+            kinds = queryList(query, 'kinds')
+            fields = queryList(query, 'fields')
+            interval = float(query.get('interval', ['0'])[0])
+            if not math.isfinite(interval) or interval < 0:
+                raise ValueError(interval)
+        except ValueError:
+            self.reply(400, 'text/plain', b'Bad interval\n')
+            return
+        if not live.admit():
+            self.reply(503, 'text/plain', b'Too many live viewers\n')
+            return
+        try:
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/event-stream')
+            self.send_header('Cache-Control', 'no-cache')
+            self.end_headers()
+            self.connection.settimeout(LIVE_WRITE_TIMEOUT)
+        except OSError:
+            live.release()
+            return
+        live.stream(self.wfile.write, packs and {parsePackId(packId) for packId in packs}, kinds and set(kinds),
+                    fields and frozenset(fields), interval)
+        self.close_connection = True
+
+    def history(self, packId, query):
+        # /history/<id>?series=BatCurrent,CellVol0&resolution=60&last=100&since=<time>&statistic=max
+        store = self.server.history
+        history = store.history(packId) if store is not None else None
+        if history is None:
+            self.reply(404, 'text/plain', b'No history for this pack\n')
+            return
+        try:
+            series = queryList(query, 'series') or history.series
+            resolution = int(query['resolution'][0]) if 'resolution' in query else None
+            last = int(query['last'][0]) if 'last' in query else None
+            since = float(query['since'][0]) if 'since' in query else None
+            if last is not None and last < 0:
+                raise ValueError(last)
+            statistic = query.get('statistic', ['mean'])[0]
+            document = {name: history.column(name, resolution, last, since, statistic) for name in series}
+        except (KeyError, ValueError):
+            self.reply(400, 'text/plain', b'Bad history query\n')
+            return
+        self.reply(200, 'application/json', json.dumps(document).encode())
+
+    def reply(self, status, contentType, body):
+        self.send_response(status)
+        self.send_header('Content-Type', contentType)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        logging.debug(f"HTTP {self.address_string()} {format % args}")
+
+def startHttpServer(store, port, host=HTTP_HOST, buses=(), bank=None, outputs=None, history=None):
+    server = ThreadingHTTPServer((host, port), MetricsRequestHandler)
+    server.daemon_threads = True
+    # outputs is read on every scrape, outputs added to it later are exported too
+    server.cache = MetricsCache(store, buses, bank, outputs)
+    # Fed by the caller, register server.live.update as a bus and bank listener
+    server.live = LiveFanout()
+    # HistoryStore behind /history/<id>, None when the history is not kept
+    server.history = history
+    thread = threading.Thread(target=server.serve_forever, name='http', daemon=True)
+    thread.start()
+    logging.info(f"Serving /metrics, /state/<id>{', /history/<id>' if history is not None else ''} and /live on {host}:{port}")
+    return server
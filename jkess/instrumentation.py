@@ -0,0 +1,160 @@
+"""
+Ingestion counters, latency histograms and the raw frame tracer.
+"""
+import logging
+import threading
+import time
+from collections import deque
+
+METRIC_BYTES_READ = 'bytesRead'
+METRIC_CRC_FAILURES = 'crcFailures'
+METRIC_CHECKSUM_FAILURES = 'checksumFailures'
+METRIC_FRAGMENT_ABORTS = 'fragmentAborts'
+METRIC_UNKNOWN_PACKETS = 'unknownPackets'
+METRIC_UNKNOWN_BYTES = 'unknownBytes'
+METRIC_NEW_PACKS = 'newPacks'
+METRIC_DECODE_TIME = 'decodeTime'
+METRIC_REASSEMBLY_LATENCY = 'reassemblyLatency'
+# Histogram bucket i counts values below 2**i microseconds, the last one everything above
+HISTOGRAM_BUCKETS = 24
+METRICS_LOG_INTERVAL = 60
+# Counters among the stats() of the MQTT and SQLite outputs, the other numbers are gauges
+OUTPUT_COUNTERS = ('enqueued', 'coalesced', 'dropped', 'published', 'failed', 'written', 'errors')
+
+def frameMetric(frameType):
+    return f"frames.{frameType}"
+
+class MetricsShard:
+    # Counters and histograms only ever written by one thread
+    __slots__ = ('counters', 'histograms')
+
+    def __init__(self):
+        self.counters = {}
+        self.histograms = {}
+
+class IngestMetrics:
+    """
+    Counters and latency histograms for the ingestion path.
+
+    Every thread writes to its own shard, so incr() and observe() are plain
+    dict updates without locks or atomics. snapshot() adds the shards up.
+    Histograms use power of two microsecond buckets.
+    """
+    def __init__(self):
+        self._local = threading.local()
+        self._shards = []
+        self._lock = threading.Lock()
+
+    def _shard(self):
+        try:
+            return self._local.shard
+        except AttributeError:
+            shard = self._local.shard = MetricsShard()
+            with self._lock:
+                self._shards.append(shard)
+            return shard
+
+    def incr(self, name, count=1):
+        counters = self._shard().counters
+        counters[name] = counters.get(name, 0) + count
+
+    def observe(self, name, seconds):
+        histograms = self._shard().histograms
+        histogram = histograms.get(name)
+        if histogram is None:
+            # [count, sum, bucket counts...]
+            histogram = histograms[name] = [0, 0.0] + [0] * HISTOGRAM_BUCKETS
+        histogram[0] += 1
+        histogram[1] += seconds
+        histogram[2 + min(int(seconds * 1e6).bit_length(), HISTOGRAM_BUCKETS - 1)] += 1
+
+    def counters(self):
+        with self._lock:
+            shards = list(self._shards)
+        total = {}
+        for shard in shards:
+            for name, count in list(shard.counters.items()):
+                total[name] = total.get(name, 0) + count
+        return total
+
+    def histograms(self):
+        with self._lock:
+            shards = list(self._shards)
+        total = {}
+        for shard in shards:
+            for name, histogram in list(shard.histograms.items()):
+                merged = total.setdefault(name, [0, 0.0] + [0] * HISTOGRAM_BUCKETS)
+                for index, value in enumerate(histogram):
+                    merged[index] += value
+        return {name: histogramSummary(histogram) for name, histogram in total.items()}
+
+    def snapshot(self):
+        return {'counters': self.counters(), 'histograms': self.histograms()}
+
+def histogramSummary(histogram):
+    count, total, buckets = histogram[0], histogram[1], histogram[2:]
+    summary = {'count': count, 'mean': total / count if count else None,
+               'buckets': [((1 << index) * 1e-6, value) for index, value in enumerate(buckets) if value]}
+    for quantile in (0.5, 0.9, 0.99):
+        summary[f"p{round(quantile * 100)}"] = histogramQuantile(count, buckets, quantile)
+    return summary
+
+def histogramQuantile(count, buckets, quantile):
+    # Upper bound in seconds of the bucket holding the quantile
+    if not count:
+        return None
+    rank = quantile * count
+    seen = 0
+    for index, value in enumerate(buckets):
+        seen += value
+        if seen >= rank:
+            return (1 << index) * 1e-6
+    return (1 << (len(buckets) - 1)) * 1e-6
+
+# Raw frames kept for a trace dump and the minimum seconds between automatic dumps
+TRACE_FRAMES = 64
+TRACE_DUMP_INTERVAL = 10.0
+TRACE_FAULT = 'fault'
+
+class FrameTracer:
+    """
+    Forensic trace of the last raw frames seen on the bus.
+
+    Frames are kept as (timestamp, frameType, bytes) in a fixed size ring,
+    which costs one deque append per frame. Hex strings are only built when the
+    ring is dumped, on a checksum or CRC error or on demand. The per frame log
+    lines are only formatted while enabled is set, so callers check it before
+    building a message.
+    """
+    def __init__(self, size=TRACE_FRAMES, enabled=False, dumpInterval=TRACE_DUMP_INTERVAL):
+        self.ring = deque(maxlen=size)
+        self.enabled = enabled
+        self.dumpInterval = dumpInterval
+        self.lastDump = None
+        self.suppressedDumps = 0
+
+    def record(self, frameType, data):
+        self.ring.append((time.time(), frameType, data))
+
+    def fault(self, reason, data):
+        # Keep the offending bytes with the frames before them and dump, at most once per dumpInterval
+        self.ring.append((time.time(), TRACE_FAULT, bytes(data)))
+        now = time.monotonic()
+        if self.lastDump is not None and now - self.lastDump < self.dumpInterval:
+            self.suppressedDumps += 1
+            return
+        self.dump(reason)
+
+    def frames(self):
+        return list(self.ring)
+
+    def lines(self):
+        for timestamp, frameType, data in list(self.ring):
+            stamp = time.strftime('%H:%M:%S', time.localtime(timestamp)) + f"{timestamp % 1:.6f}"[1:]
+            yield f"{stamp} {frameType:12s} {len(data):3d}bytes {data.hex(' ')}"
+
+    def dump(self, reason='on demand'):
+        self.lastDump = time.monotonic()
+        suppressed = f", {self.suppressedDumps} dumps suppressed since the last one" if self.suppressedDumps else ''
+        self.suppressedDumps = 0
+        logging.warning(f"Trace dump ({reason}) of the last {len(self.ring)} frames{suppressed}:\n" + '\n'.join(self.lines()))
@@ -0,0 +1,129 @@
+"""
+Live pack updates for Server-Sent Events viewers, see httpd /live.
+"""
+import json
+import logging
+import threading
+import time
+
+# Viewers beyond this are turned away, each one holds an HTTP server thread
+LIVE_MAX_CLIENTS = 64
+# Seconds between keep alive comments on an idle stream
+LIVE_KEEPALIVE = 15.0
+# Seconds a viewer may block a write before it is dropped
+LIVE_WRITE_TIMEOUT = 30.0
+
+def fieldSelected(fields, name):
+    # A field is selected by its own name or, for numbered fields, its prefix, e.g. CellVol for CellVol12
+    return name in fields or name.rstrip('0123456789') in fields
+
+class LiveUpdate:
+    """
+    One pack record as handed to the listeners, encoded on demand.
+
+    The SSE event bytes are built the first time a viewer asks for them and
+    cached per field selection, so a record is serialized once for all the
+    viewers that want the same fields however many there are.
+    """
+    __slots__ = ('packId', 'kind', 'values', 'timestamp', 'sequence', 'encoded')
+
+    def __init__(self, packId, kind, values, sequence):
+        self.packId = packId
+        self.kind = kind
+        self.values = values
+        self.timestamp = time.time()
+        self.sequence = sequence
+        self.encoded = {}
+
+    def encode(self, fields=None):
+        # SSE event with the selected fields, b'' when none of them is in this record
+        encoded = self.encoded.get(fields)
+        if encoded is None:
+            values = self.values
+            if fields is not None:
+                values = {name: value for name, value in values.items() if fieldSelected(fields, name)}
+            if values:
+                data = json.dumps({'pack': self.packId, 'kind': self.kind, 'timestamp': self.timestamp, 'values': values})
+                encoded = f"id: {self.sequence}\nevent: {self.kind}\ndata: {data}\n\n".encode()
+            else:
+                encoded = b''
+            self.encoded[fields] = encoded
+        return encoded
+
+class LiveFanout:
+    """
+    Latest record of every pack and kind, shared by all live viewers.
+
+    update() is a bus and bank listener; it only replaces the latest entry for
+    the pack and kind and wakes the viewers, nothing is queued or serialized on
+    the ingestion side. Every viewer thread keeps the sequence numbers it has
+    sent and on each wake writes whatever is newer, so a slow viewer skips the
+    intermediate values of a pack instead of buffering them.
+    """
+    def __init__(self, maxClients=LIVE_MAX_CLIENTS, keepalive=LIVE_KEEPALIVE):
+        self.maxClients = maxClients
+        self.keepalive = keepalive
+        self.condition = threading.Condition()
+        self.latest = {}
+        self.sequence = 0
+        self.clients = 0
+
+    def update(self, packId, kind, values):
+        # Bus listener, also registered with the bank aggregator
+        # Stored before the sequence moves, a viewer that sees the new sequence also sees the record
+        sequence = self.sequence + 1
+        self.latest[(packId, kind)] = LiveUpdate(packId, kind, values, sequence)
+        self.sequence = sequence
+        if self.clients:
+            with self.condition:
+                self.condition.notify_all()
+
+    def admit(self):
+        # Take a viewer slot, stream() gives it back when the viewer goes
+        with self.condition:
+            if self.clients >= self.maxClients:
+                return False
+            self.clients += 1
+            return True
+
+    def release(self):
+        with self.condition:
+            self.clients -= 1
+
+    def stream(self, write, packs=None, kinds=None, fields=None, interval=0.0):
+        """
+        Write the latest records and then every change to write() until it fails.
+
+        packs and kinds are sets of pack ids and record kinds to follow, fields
+        a frozenset of field names or prefixes, None for everything. interval is
+        the least number of seconds between writes, updates in between coalesce.
+        """
+        sentSequences = {}
+        lastWrite = time.monotonic()
+        try:
+            while True:
+                seen = self.sequence
+                chunks = []
+                for key, update in list(self.latest.items()):
+                    if sentSequences.get(key) == update.sequence:
+                        continue
+                    sentSequences[key] = update.sequence
+                    if (packs is None or update.packId in packs) and (kinds is None or update.kind in kinds):
+                        chunk = update.encode(fields)
+                        if chunk:
+                            chunks.append(chunk)
+                now = time.monotonic()
+                if chunks:
+                    write(b''.join(chunks))
+                    lastWrite = now
+                elif now - lastWrite >= self.keepalive:
+                    write(b': keepalive\n\n')
+                    lastWrite = now
+                if interval:
+                    time.sleep(interval)
+                with self.condition:
+                    self.condition.wait_for(lambda: self.sequence != seen, self.keepalive)
+        except OSError as exc:
+            logging.debug(f"Live viewer gone: {exc}")
+        finally:
+            self.release()
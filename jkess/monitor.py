@@ -0,0 +1,381 @@
+"""
+Decoding of one RS485 bus: request correlation, record memoization and JkBusMonitor.
+"""
+import hashlib
+import logging
+import time
+from collections import deque
+
+from .instrumentation import METRIC_DECODE_TIME, METRIC_NEW_PACKS, METRIC_UNKNOWN_PACKETS, FrameTracer, IngestMetrics, frameMetric
+from .protocol import (ADDR_RECORD_TYPES, FRAME_FC16_REQUEST, FRAME_FC16_RESPONSE, FRAME_JK_RECORD, JK_RECORD_SIZE,
+                       FrameReassembler)
+from .records import JK_PAYLOAD_OFFSET, getConfig, getInfo, getState
+from .store import PackStateStore
+
+_MISSING = object()
+
+# --------------------------------------------------------------------------- #
+# FC16 request / record correlation
+# --------------------------------------------------------------------------- #
+REQUEST_TIMEOUT = 1.0
+
+class PackLatency:
+    # Request to record latency statistics of one pack
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.min = None
+        self.max = None
+        self.last = None
+        self.responses = 0
+        self.timeouts = 0
+
+    def add(self, latency):
+        self.count += 1
+        self.total += latency
+        self.last = latency
+        if self.min is None or latency < self.min:
+            self.min = latency
+        if self.max is None or latency > self.max:
+            self.max = latency
+
+    @property
+    def mean(self):
+        return self.total / self.count if self.count else None
+
+    def asDict(self):
+        return {'count': self.count, 'mean': self.mean, 'min': self.min, 'max': self.max,
+                'last': self.last, 'responses': self.responses, 'timeouts': self.timeouts}
+
+class RequestCorrelator:
+    """
+    Pair master FC16 requests with the slave records and responses they trigger.
+
+    Requests stay outstanding until their record or FC16 response arrives, or
+    they time out. A record is attributed to the most recent outstanding
+    request for its record type: the bus is half duplex, so a slave answers
+    the request just sent and an older outstanding one has lost its record.
+    A response retires its own request, which is kept as the acknowledged one
+    for a record that follows the response, until the next request. Times are
+    the time.time() the frames arrived, now when not given.
+    """
+    def __init__(self, timeout=REQUEST_TIMEOUT):
+        self.timeout = timeout
+        self.pending = deque()
+        self.acknowledged = None
+        self.latency = {}
+
+    def stats(self, id):
+        stats = self.latency.get(id)
+        if stats is None:
+            stats = self.latency[id] = PackLatency()
+        return stats
+
+    def expire(self, now):
+        pending = self.pending
+        while pending and now - pending[0][2] > self.timeout:
+            id, writeAddr, sentAt = pending.popleft()
+            self.stats(id).timeouts += 1
+            logging.debug(f"Request to Slave ID: {id} Addr:{writeAddr:04x} timed out")
+
+    def remove(self, id, writeAddr):
+        # The outstanding request to id for writeAddr, taken out of the queue, or None
+        for index, entry in enumerate(self.pending):
+            if entry[0] == id and entry[1] == writeAddr:
+                del self.pending[index]
+                return entry
+        return None
+
+    def request(self, id, writeAddr, now=None):
+        now = time.time() if now is None else now
+        self.expire(now)
+        self.acknowledged = None
+        # A repeated request supersedes the unanswered one
+        if self.remove(id, writeAddr) is not None:
+            self.stats(id).timeouts += 1
+        self.pending.append((id, writeAddr, now))
+
+    def cancel(self, id, writeAddr):
+        # The master gave up on this request, count it as a timeout
+        if self.remove(id, writeAddr) is not None:
+            self.stats(id).timeouts += 1
+
+    def response(self, id, writeAddr, now=None):
+        # The FC16 acknowledge, which may come before or after the record itself
+        self.expire(time.time() if now is None else now)
+        self.stats(id).responses += 1
+        entry = self.remove(id, writeAddr)
+        if entry is not None:
+            self.acknowledged = entry
+
+    def record(self, recordType, now=None):
+        # Returns the pack id the record belongs to, None when no request matches
+        now = time.time() if now is None else now
+        self.expire(now)
+        pending = self.pending
+        for index in range(len(pending) - 1, -1, -1):
+            id, writeAddr, sentAt = pending[index]
+            if ADDR_RECORD_TYPES.get(writeAddr, recordType) == recordType:
+                del pending[index]
+                self.stats(id).add(now - sentAt)
+                return id
+        acknowledged = self.acknowledged
+        if (acknowledged is not None and now - acknowledged[2] <= self.timeout
+                and ADDR_RECORD_TYPES.get(acknowledged[1], recordType) == recordType):
+            self.acknowledged = None
+            id, _, sentAt = acknowledged
+            self.stats(id).add(now - sentAt)
+            return id
+        return None
+
+    def report(self):
+        # Also called from the HTTP thread, so the dict is copied before sorting
+        return {id: stats.asDict() for id, stats in sorted(list(self.latency.items()), key=lambda item: str(item[0]))}
+
+# --------------------------------------------------------------------------- #
+# Config / info record memoization
+# --------------------------------------------------------------------------- #
+# Record types that are rebroadcast unchanged, skipped while their payload digest is the same
+MEMO_RECORD_TYPES = (1, 3)
+# Seconds before an unchanged record is decoded and published again anyway, for the full MQTT refresh
+MEMO_TTL = 300
+# Counters that move on their own and do not make a record "changed"
+MEMO_COUNTER_FIELDS = frozenset(('ODDRunTime', 'PWROnTimes'))
+# Payload byte range of the counters per record type, left out of the digest
+MEMO_COUNTER_BYTES = {3: (32, 40)}
+METRIC_MEMO_HITS = 'memoHits'
+
+def recordDigest(data, recordType=None):
+    # Digest of the payload without the header, type, source, checksum and counters
+    with memoryview(data) as view:
+        payload = view[JK_PAYLOAD_OFFSET:JK_RECORD_SIZE - 1]
+        counters = MEMO_COUNTER_BYTES.get(recordType)
+        if counters is None:
+            return hashlib.blake2b(payload, digest_size=16).digest()
+        digest = hashlib.blake2b(payload[:counters[0]], digest_size=16)
+        digest.update(payload[counters[1]:])
+        return digest.digest()
+
+def fieldDiff(old, new):
+    # {field: [old, new]} for every field whose value differs
+    return {field: [old.get(field), value] for field, value in new.items() if old.get(field, _MISSING) != value}
+
+class JkBusMonitor:
+    """
+    Decode the frames seen on one RS485 bus and keep the latest data per pack.
+
+    Several buses can share one store and the same listeners. A named bus
+    reports its packs as "<name>-<id>" so equal Modbus ids on different buses
+    stay apart, an unnamed bus keeps the plain ids.
+    """
+    def __init__(self, tracer=None, name=None, store=None):
+        self.name = name
+        self.metrics = IngestMetrics()
+        self.tracer = tracer if tracer is not None else FrameTracer()
+        self.reassembler = FrameReassembler(metrics=self.metrics, tracer=self.tracer)
+        self.correlator = RequestCorrelator()
+        self.store = store if store is not None else PackStateStore()
+        self.id = ''
+        # Pack ids seen on this bus, and the last config and info dicts for change detection.
+        # The latest values live in the store snapshots, state dicts are not kept.
+        self.packIds = set()
+        self.previous = {}
+        self.listeners = []
+        self.eventListeners = []
+        self.recordListeners = []
+        # (id, recordType): (payload digest, monotonic time it was last decoded)
+        self.digests = {}
+        self.memoTtl = MEMO_TTL
+        # PollMaster when this process is the bus master
+        self.poller = None
+
+    def addListener(self, listener):
+        # listener(id, kind, values) is called for every decoded 'config', 'state' or 'info' record
+        self.listeners.append(listener)
+
+    def notify(self, id, kind, values):
+        for listener in self.listeners:
+            try:
+                listener(id, kind, values)
+            except Exception:
+                logging.exception(f"Listener failed for ID: {id} {kind}")
+
+    def addRecordListener(self, listener):
+        # listener(packKey, recordType, data, timestamp) is called with every raw record before it is decoded,
+        # timestamp is the time.time() it arrived or was captured
+        self.recordListeners.append(listener)
+
+    def addEventListener(self, listener):
+        # listener(event) is called with a dict holding at least 'event', 'pack' and 'timestamp'
+        self.eventListeners.append(listener)
+
+    def notifyEvent(self, event):
+        for listener in self.eventListeners:
+            try:
+                listener(event)
+            except Exception:
+                logging.exception(f"Event listener failed for {event['event']}")
+
+    def unchanged(self, id, recordType, data):
+        # True when the record repeats the last decoded one, remembers its digest otherwise
+        key = (id, recordType)
+        digest = recordDigest(data, recordType)
+        now = time.monotonic()
+        memo = self.digests.get(key)
+        if memo is not None and memo[0] == digest and now - memo[1] < self.memoTtl:
+            self.metrics.incr(METRIC_MEMO_HITS)
+            return True
+        self.digests[key] = (digest, now)
+        return False
+
+    def recordChanged(self, packKey, kind, old, new):
+        if not old:
+            return
+        changes = fieldDiff(old, new)
+        if changes.keys() - MEMO_COUNTER_FIELDS:
+            logging.info(f"Pack ID:{packKey} {kind} changed: {changes}")
+            self.notifyEvent({'event': f"{kind}Changed", 'pack': packKey, 'kind': kind,
+                              'timestamp': time.time(), 'changes': changes})
+
+    def feed(self, data, timestamp=None):
+        # Feed raw bytes as read from the bus at timestamp, now when None
+        for frameType, frame, arrival in self.reassembler.feedTimed(data, timestamp):
+            self.handleFrame(frameType, frame, arrival)
+
+    def packKey(self, id):
+        return id if self.name is None else f"{self.name}-{id}"
+
+    def frameCount(self, frameType):
+        return self.metrics.counters().get(frameMetric(frameType), 0)
+
+    def handleFrame(self, frameType, data, timestamp=None):
+        # timestamp is the time.time() the frame arrived, it times the requests and records
+        timestamp = time.time() if timestamp is None else timestamp
+        metrics = self.metrics
+        metrics.incr(frameMetric(frameType))
+        self.tracer.record(frameType, data)
+        if frameType == FRAME_FC16_REQUEST:
+            self.handleRequest(data, timestamp)
+        elif frameType == FRAME_FC16_RESPONSE:
+            self.handleResponse(data, timestamp)
+        elif frameType == FRAME_JK_RECORD:
+            start = time.perf_counter()
+            self.handleRecord(data, timestamp)
+            metrics.observe(METRIC_DECODE_TIME, time.perf_counter() - start)
+        else:
+            metrics.incr(METRIC_UNKNOWN_PACKETS)
+            if self.tracer.enabled:
+                logging.debug(f"DEBUG: UNKNOWN Packet {len(data)}bytes Data: {data.hex()}")
+
+    # Identify Modbus FC16 (0x10) Write Multiple registers Request
+    def handleRequest(self, data, timestamp=None):
+        id = data[0]
+        writeAddr = (data[2] << 8) | data[3]
+        self.id = id
+        # Our own polls echoed by the adapter are already known to the correlator
+        if self.poller is None or not self.poller.echo(data):
+            self.correlator.request(id, writeAddr, timestamp)
+        if self.tracer.enabled:
+            writeQty = (data[4] << 8) | data[5]
+            writeByteQount = data[6]
+            writeData = data[7:7 + writeByteQount].hex()
+            logging.debug(f"Write Multiple registers Request ID: {id} FC{data[1]} writeAddr:{writeAddr:04x} writeQty:{writeQty:04x} writeByteQount:{writeByteQount:02x} writeData:{writeData} {len(data)}bytes: {data.hex()}")
+            # Identify Write Register Config data Request
+            if writeAddr == 0x161e:
+                logging.debug(f"Master 0 Request Config Data Slave ID: {id} Addr:{writeAddr:04x} {len(data)}bytes: {data.hex()}")
+            # Identify Write Register Status data Request
+            if writeAddr == 0x1620:
+                logging.debug(f"Master 0 Request Status Data Slave ID: {id} Addr:{writeAddr:04x} {len(data)}bytes: {data.hex()}")
+
+    # Identify Modbus FC16 (0x10) Write Multiple registers Response
+    def handleResponse(self, data, timestamp=None):
+        id = data[0]
+        writeAddr = (data[2] << 8) | data[3]
+        self.id = id
+        self.correlator.response(id, writeAddr, timestamp)
+        if self.poller is not None:
+            self.poller.response(id, writeAddr)
+        if self.tracer.enabled:
+            writeQty = (data[4] << 8) | data[5]
+            logging.debug(f"Write Multiple registers Response ID: {id} FC{data[1]} writeAddr:{writeAddr:04x} writeQty:{writeQty:04x} {len(data)}bytes: {data.hex()}")
+            # Identify Write Register Config data Response
+            if writeAddr == 0x161e:
+                logging.debug(f"Slave ID: {id} Response -> Master 0 Config Data Addr:{writeAddr:04x} {len(data)}bytes: {data.hex()}")
+            # Identify Write Register Status data Response
+            if writeAddr == 0x1620:
+                logging.debug(f"Slave ID: {id} Response -> Master 0 Status Data Addr:{writeAddr:04x} {len(data)}bytes: {data.hex()}")
+
+    # Identify JK BMS Custom Data Packet, the checksum was validated by the reassembler
+    def handleRecord(self, data, timestamp=None):
+        timestamp = time.time() if timestamp is None else timestamp
+        trace = self.tracer.enabled
+        # Extract JK recordType
+        recordType = data[4]
+
+        # Extract Modbus recordSource
+        if data[5] == 0:
+            recordSource = 'Master'
+            # When master set ID to 0 as there is no modbus request for this data
+            id = 0
+        else:
+            recordSource = 'Slave'
+            id = self.correlator.record(recordType, timestamp)
+            if id is None:
+                # No outstanding request, fall back to the last id seen on the bus
+                id = self.id
+                if trace:
+                    logging.debug(f"No request matches Type: {recordType} record, using last ID: {id}")
+        if trace:
+            logging.info(f"DEBUG Length  {len(data)} Type: {recordType} device id: {id}")
+        packKey = self.packKey(id)
+        if self.poller is not None:
+            self.poller.record(id, recordType)
+        # Config and info are rebroadcast unchanged most of the time
+        if recordType in MEMO_RECORD_TYPES and self.unchanged(id, recordType, data):
+            return
+
+        # Other threads read the pack state from the store snapshots
+        self.store.update(packKey, recordType, data)
+        for listener in self.recordListeners:
+            try:
+                listener(packKey, recordType, data, timestamp)
+            except Exception:
+                logging.exception(f"Record listener failed for ID: {packKey}")
+
+        # Detect new Packs
+        if id not in self.packIds:
+            logging.info(f"New Pack ID:{packKey} discovered")
+            self.metrics.incr(METRIC_NEW_PACKS)
+            self.packIds.add(id)
+
+        # Nobody to hand a decoded dict to, the store snapshot is enough
+        if not self.listeners and not trace and recordType == 2:
+            return
+
+        # Record Type 1 is used for Configuration data
+        if recordType == 1:
+            config = getConfig(data)
+            self.recordChanged(packKey, 'config', self.previous.get((id, 'config')), config)
+            self.previous[(id, 'config')] = config
+            if trace:
+                logging.info(f"Config Data {recordSource}-> ID: {id}, Type: {recordType}, Device Addr: {config.get('DevAddr',None)} Cells: {config.get('CellCount',None)} Checksum: {hex(data[299])}")
+                logging.debug(f"Device: {id} Type: {recordType} State: {config}")
+            self.notify(packKey, 'config', config)
+
+        # Record Type 2 is used for State data
+        elif recordType == 2:
+            state = getState(data)
+            if trace:
+                logging.info(f"State Data {recordSource}-> ID: {id}, Type: {recordType}, SoC: {state.get('SOCStateOfCharge',None)}% Checksum: {hex(data[299])}")
+                logging.debug(f"Device: {id} State: {state}")
+            self.notify(packKey, 'state', state)
+
+        # Record Type 3 is used for Device Info Data
+        elif recordType == 3:
+            info = getInfo(data)
+            self.recordChanged(packKey, 'info', self.previous.get((id, 'info')), info)
+            self.previous[(id, 'info')] = info
+            if trace:
+                logging.info(f"Info Data {recordSource}-> ID: {id}, Type: {recordType}, MnfDeviceID: {info.get('ManufacturerDeviceID',None)} Checksum: {hex(data[299])}")
+                logging.debug(f"Device: {id} Type: {recordType} Info: {info}")
+            self.notify(packKey, 'info', info)
@@ -0,0 +1,205 @@
+"""
+MQTT backend on paho, imported only when publishing is enabled.
+"""
+import json
+import logging
+import threading
+import time
+from collections import deque, OrderedDict
+
+import paho.mqtt.client as mqtt
+
+def onConnect(client, userdata, flags, rc):
+    if rc == 0:
+        logging.info("Connected to MQTT Broker!")
+    else:
+        logging.error("Failed to connect, return code %d\n", rc)
+
+FIRST_RECONNECT_DELAY = 1
+MAX_RECONNECT_DELAY = 60
+
+def onDisconnect(client, userdata, rc):
+    # paho's network loop reconnects on its own with a back off, never block its thread here
+    if rc == 0:
+        logging.info("Disconnected from MQTT Broker")
+    else:
+        logging.warning("Lost MQTT Broker connection with result code: %s, reconnecting in the background", rc)
+
+def onMessage(client, userdata, msg):
+    logging.info(f'Received `{msg.payload.decode()}` from `{msg.topic}` topic')
+
+def connectMqtt(broker, port=1883, clientId=None, username=None, password=None):
+    client = mqtt.Client(clientId or '')
+    if username:
+        client.username_pw_set(username, password)
+    client.on_connect = onConnect
+    client.on_message = onMessage
+    client.on_disconnect = onDisconnect
+    client.reconnect_delay_set(min_delay=FIRST_RECONNECT_DELAY, max_delay=MAX_RECONNECT_DELAY)
+    # Connect from the network loop so a broker outage never blocks start up
+    client.connect_async(broker, port, keepalive=120)
+    return client
+
+# --------------------------------------------------------------------------- #
+# Decoupled MQTT output
+# --------------------------------------------------------------------------- #
+MQTT_QUEUE_SIZE = 256
+MQTT_BATCH_SIZE = 64
+MQTT_BATCH_INTERVAL = 0.2
+# Overflow policies of the output queue
+OVERFLOW_DROP_OLDEST = 'drop-oldest'           # FIFO of messages, the oldest is dropped when full
+OVERFLOW_LATEST_PER_PACK = 'latest-per-pack'   # one entry per topic, newer fields are merged into it
+
+class MqttOutput:
+    """
+    Bounded publish queue drained by its own thread.
+
+    put() never blocks: it only appends to the queue (or merges into the
+    pending message of the same topic) and applies the overflow policy, so the
+    serial side is not slowed down by the broker. The output thread serializes
+    and publishes in batches while the client is connected, and keeps queueing
+    while paho reconnects in the background.
+    """
+    def __init__(self, client, maxSize=MQTT_QUEUE_SIZE, policy=OVERFLOW_LATEST_PER_PACK,
+                 batchSize=MQTT_BATCH_SIZE, batchInterval=MQTT_BATCH_INTERVAL, qos=0):
+        if policy not in (OVERFLOW_DROP_OLDEST, OVERFLOW_LATEST_PER_PACK):
+            raise ValueError(f"Unknown MQTT overflow policy {policy}")
+        self.client = client
+        self.maxSize = maxSize
+        self.policy = policy
+        self.batchSize = batchSize
+        self.batchInterval = batchInterval
+        self.qos = qos
+        self.queue = deque() if policy == OVERFLOW_DROP_OLDEST else OrderedDict()
+        self.condition = threading.Condition()
+        self.connected = threading.Event()
+        self.subscriptions = {}
+        self.running = False
+        self.thread = None
+        self.enqueued = 0
+        self.coalesced = 0
+        self.dropped = 0
+        self.published = 0
+        self.failed = 0
+        self.lastLatency = None
+        self.maxLatency = 0.0
+        self.totalLatency = 0.0
+        client.on_publish = None
+        self._onConnect = client.on_connect
+        self._onDisconnect = client.on_disconnect
+        client.on_connect = self._connected
+        client.on_disconnect = self._disconnected
+
+    def _connected(self, client, userdata, flags, rc):
+        if self._onConnect is not None:
+            self._onConnect(client, userdata, flags, rc)
+        if rc == 0:
+            # Subscriptions do not survive a reconnect with a clean session
+            for topic in self.subscriptions:
+                client.subscribe(topic)
+            self.connected.set()
+            with self.condition:
+                self.condition.notify()
+
+    def _disconnected(self, client, userdata, rc):
+        self.connected.clear()
+        if self._onDisconnect is not None:
+            self._onDisconnect(client, userdata, rc)
+
+    def start(self):
+        self.running = True
+        self.thread = threading.Thread(target=self._run, name='mqtt-output', daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self, timeout=2.0):
+        with self.condition:
+            self.running = False
+            self.condition.notify()
+        if self.thread is not None:
+            self.thread.join(timeout)
+
+    def subscribe(self, topic, callback):
+        # callback(client, userdata, msg) runs on the paho network thread
+        self.subscriptions[topic] = callback
+        self.client.message_callback_add(topic, callback)
+        if self.connected.is_set():
+            self.client.subscribe(topic)
+
+    def put(self, topic, message, retain=False):
+        # message is a dict, merged per topic with the latest-per-pack policy, or a ready payload
+        now = time.monotonic()
+        with self.condition:
+            self.enqueued += 1
+            queue = self.queue
+            if self.policy == OVERFLOW_LATEST_PER_PACK:
+                queued = queue.get(topic)
+                if queued is not None:
+                    if isinstance(message, dict) and isinstance(queued[1], dict):
+                        mergeMessage(queued[1], message)
+                    else:
+                        queue[topic] = (queued[0], message, retain)
+                    self.coalesced += 1
+                    return
+                if len(queue) >= self.maxSize:
+                    queue.popitem(last=False)
+                    self.dropped += 1
+                queue[topic] = (now, message, retain)
+            else:
+                if len(queue) >= self.maxSize:
+                    queue.popleft()
+                    self.dropped += 1
+                queue.append((topic, now, message, retain))
+            if len(queue) >= self.batchSize:
+                self.condition.notify()
+
+    # The DeltaPublisher and friends only need publish()
+    publish = put
+
+    def _take(self):
+        queue = self.queue
+        batch = []
+        while queue and len(batch) < self.batchSize:
+            if self.policy == OVERFLOW_LATEST_PER_PACK:
+                topic, (enqueuedAt, message, retain) = queue.popitem(last=False)
+            else:
+                topic, enqueuedAt, message, retain = queue.popleft()
+            batch.append((topic, enqueuedAt, message, retain))
+        return batch
+
+    def _run(self):
+        while True:
+            with self.condition:
+                if not self.running:
+                    return
+                self.condition.wait(self.batchInterval)
+                if not self.connected.is_set():
+                    continue
+                batch = self._take()
+            for topic, enqueuedAt, message, retain in batch:
+                payload = message if isinstance(message, (str, bytes)) else json.dumps(message)
+                info = self.client.publish(topic, payload, qos=self.qos, retain=retain)
+                if info.rc != mqtt.MQTT_ERR_SUCCESS:
+                    self.failed += 1
+                    continue
+                latency = time.monotonic() - enqueuedAt
+                self.published += 1
+                self.lastLatency = latency
+                self.totalLatency += latency
+                self.maxLatency = max(self.maxLatency, latency)
+
+    def stats(self):
+        with self.condition:
+            depth = len(self.queue)
+        return {'connected': self.connected.is_set(), 'queueDepth': depth, 'enqueued': self.enqueued,
+                'coalesced': self.coalesced, 'dropped': self.dropped, 'published': self.published,
+                'failed': self.failed, 'lastLatency': self.lastLatency, 'maxLatency': self.maxLatency,
+                'meanLatency': self.totalLatency / self.published if self.published else None}
+
+def mergeMessage(queued, message):
+    # Newer values win, record kinds are merged field by field
+    for key, value in message.items():
+        if isinstance(value, dict) and isinstance(queued.get(key), dict):
+            queued[key].update(value)
+        else:
+            queued[key] = value
@@ -0,0 +1,210 @@
+"""
+SQLite persistence of the state records.
+"""
+import logging
+import sqlite3
+import threading
+import time
+from array import array
+from collections import deque
+from operator import itemgetter
+
+from .records import CELL_COUNT_MAX
+
+# One row per pack per state record, the cell voltages as a blob of little endian uint16 mV
+SQLITE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS samples (
+    pack TEXT NOT NULL, ts REAL NOT NULL,
+    vol INTEGER, current INTEGER, power INTEGER, soc INTEGER,
+    tempMos INTEGER, tempBat1 INTEGER, tempBat2 INTEGER,
+    cellMin INTEGER, cellMax INTEGER, cells BLOB,
+    PRIMARY KEY (pack, ts)) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS rollup_1m (
+    pack TEXT NOT NULL, ts INTEGER NOT NULL, samples INTEGER,
+    volMin INTEGER, volMax INTEGER, volAvg REAL,
+    currentMin INTEGER, currentMax INTEGER, currentAvg REAL,
+    socAvg REAL, tempMosMax INTEGER, cellMin INTEGER, cellMax INTEGER,
+    PRIMARY KEY (pack, ts)) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS rollup_1h (
+    pack TEXT NOT NULL, ts INTEGER NOT NULL, samples INTEGER,
+    volMin INTEGER, volMax INTEGER, volAvg REAL,
+    currentMin INTEGER, currentMax INTEGER, currentAvg REAL,
+    socAvg REAL, tempMosMax INTEGER, cellMin INTEGER, cellMax INTEGER,
+    PRIMARY KEY (pack, ts)) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS rollup_state (name TEXT PRIMARY KEY, done REAL NOT NULL);
+CREATE INDEX IF NOT EXISTS samples_ts ON samples (ts);
+CREATE INDEX IF NOT EXISTS rollup_1m_ts ON rollup_1m (ts);
+CREATE INDEX IF NOT EXISTS rollup_1h_ts ON rollup_1h (ts);
+"""
+SQLITE_INSERT = "INSERT OR REPLACE INTO samples VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)"
+# (table, source, seconds per bucket), the hour rollup is built from the minute rollup
+SQLITE_ROLLUPS = (('rollup_1m', 'samples', 60), ('rollup_1h', 'rollup_1m', 3600))
+SQLITE_ROLLUP_SELECT = {
+    'samples': """SELECT pack, CAST(ts / :period AS INTEGER) * :period AS bucket, COUNT(*),
+        MIN(vol), MAX(vol), AVG(vol), MIN(current), MAX(current), AVG(current),
+        AVG(soc), MAX(tempMos), MIN(cellMin), MAX(cellMax)
+        FROM samples WHERE ts >= :since AND ts < :until GROUP BY pack, bucket""",
+    'rollup_1m': """SELECT pack, CAST(ts / :period AS INTEGER) * :period AS bucket, SUM(samples),
+        MIN(volMin), MAX(volMax), SUM(volAvg * samples) / SUM(samples),
+        MIN(currentMin), MAX(currentMax), SUM(currentAvg * samples) / SUM(samples),
+        SUM(socAvg * samples) / SUM(samples), MAX(tempMosMax), MIN(cellMin), MAX(cellMax)
+        FROM rollup_1m WHERE ts >= :since AND ts < :until GROUP BY pack, bucket""",
+}
+# Seconds kept per table, None keeps everything
+SQLITE_RETENTION = {'samples': 7 * 86400, 'rollup_1m': 90 * 86400, 'rollup_1h': None}
+SQLITE_FLUSH_INTERVAL = 1.0
+SQLITE_BATCH_SIZE = 500
+# Rows buffered while the card is slow, the oldest are dropped beyond this
+SQLITE_QUEUE_SIZE = 100000
+SQLITE_MAINTENANCE_INTERVAL = 60.0
+# Longest wait between attempts to reopen a failing database
+SQLITE_RETRY_MAX = 60.0
+SQLITE_CELL_FIELDS = [f"CellVol{cell}" for cell in range(CELL_COUNT_MAX)]
+SQLITE_SAMPLE_FIELDS = itemgetter('BatVol', 'BatCurrent', 'BatWatt', 'SOCStateOfCharge', 'TempMos', 'TempBat1', 'TempBat2')
+
+class SqliteSink:
+    """
+    Background SQLite writer for the decoded state records.
+
+    update() only turns the record into a row tuple and appends it to a
+    bounded deque, the writer thread owns the connection and inserts the
+    queued rows with executemany in one transaction per flush interval. The
+    database runs in WAL mode with synchronous=NORMAL, so a flush costs one
+    sequential WAL append instead of several fsyncs. Every maintenance
+    interval the completed minutes and hours are rolled up and rows past their
+    retention are deleted.
+    """
+    def __init__(self, path, retention=None, flushInterval=SQLITE_FLUSH_INTERVAL, batchSize=SQLITE_BATCH_SIZE,
+                 maxQueue=SQLITE_QUEUE_SIZE, maintenanceInterval=SQLITE_MAINTENANCE_INTERVAL):
+        self.path = path
+        self.retention = dict(SQLITE_RETENTION)
+        self.retention.update(retention or {})
+        self.flushInterval = flushInterval
+        self.batchSize = batchSize
+        self.maintenanceInterval = maintenanceInterval
+        self.queue = deque(maxlen=maxQueue)
+        self.wakeup = threading.Event()
+        self.running = False
+        self.thread = None
+        self.written = 0
+        self.dropped = 0
+        self.errors = 0
+        self.lastError = None
+        self.lastFlush = None
+
+    def update(self, packId, kind, values, timestamp=None):
+        # Bus listener, runs on the ingestion path so it only queues a tuple
+        if kind != 'state':
+            return
+        cells = [values.get(field, 0) for field in SQLITE_CELL_FIELDS]
+        while cells and not cells[-1]:
+            cells.pop()
+        if len(self.queue) == self.queue.maxlen:
+            self.dropped += 1
+        self.queue.append((str(packId), time.time() if timestamp is None else timestamp,
+                           *SQLITE_SAMPLE_FIELDS(values), min(cells, default=None), max(cells, default=None),
+                           array('H', cells).tobytes()))
+        if len(self.queue) >= self.batchSize:
+            self.wakeup.set()
+
+    def start(self):
+        self.running = True
+        self.thread = threading.Thread(target=self._run, name='sqlite', daemon=True)
+        self.thread.start()
+        logging.info(f"Persisting state records to {self.path}")
+        return self
+
+    def stop(self, timeout=5.0):
+        self.running = False
+        self.wakeup.set()
+        if self.thread is not None:
+            self.thread.join(timeout)
+
+    def connect(self):
+        connection = sqlite3.connect(self.path)
+        connection.execute('PRAGMA journal_mode=WAL')
+        connection.execute('PRAGMA synchronous=NORMAL')
+        connection.executescript(SQLITE_SCHEMA)
+        return connection
+
+    def _run(self):
+        # A locked database or an I/O error only pauses the writer, the rows stay queued
+        connection = None
+        nextMaintenance = time.monotonic()
+        retryDelay = 0.0
+        retryAt = 0.0
+        try:
+            while True:
+                self.wakeup.wait(max(self.flushInterval, retryAt - time.monotonic()))
+                self.wakeup.clear()
+                running = self.running
+                if running and time.monotonic() < retryAt:
+                    continue
+                try:
+                    if connection is None:
+                        connection = self.connect()
+                    self.flush(connection)
+                    if running and time.monotonic() >= nextMaintenance:
+                        nextMaintenance = time.monotonic() + self.maintenanceInterval
+                        self.maintain(connection)
+                    retryDelay = 0.0
+                except sqlite3.Error as exc:
+                    self.errors += 1
+                    self.lastError = str(exc)
+                    retryDelay = min(SQLITE_RETRY_MAX, max(self.flushInterval, retryDelay * 2))
+                    retryAt = time.monotonic() + retryDelay
+                    logging.error(f"SQLite writer for {self.path} failed: {exc}, retrying in {retryDelay:g}s")
+                    if connection is not None:
+                        connection.close()
+                        connection = None
+                if not running:
+                    return
+        finally:
+            if connection is not None:
+                connection.close()
+
+    def flush(self, connection):
+        queue = self.queue
+        rows = []
+        while queue:
+            rows.append(queue.popleft())
+        if not rows:
+            return
+        try:
+            with connection:
+                connection.executemany(SQLITE_INSERT, rows)
+        except sqlite3.Error:
+            # Back in front of the rows queued meanwhile, the oldest go when that overflows
+            overflow = len(rows) + len(queue) - queue.maxlen
+            if overflow > 0:
+                self.dropped += overflow
+                rows = rows[overflow:]
+            queue.extendleft(reversed(rows))
+            raise
+        self.written += len(rows)
+        self.lastFlush = time.time()
+
+    def maintain(self, connection, now=None):
+        now = time.time() if now is None else now
+        with connection:
+            for table, source, period in SQLITE_ROLLUPS:
+                self.rollup(connection, table, source, period, now)
+            for table, seconds in self.retention.items():
+                if seconds is not None:
+                    connection.execute(f"DELETE FROM {table} WHERE ts < ?", (now - seconds,))
+
+    @staticmethod
+    def rollup(connection, table, source, period, now):
+        # Aggregate the buckets completed since the last run, the last one again for rows that were still queued
+        until = now // period * period
+        row = connection.execute("SELECT done FROM rollup_state WHERE name = ?", (table,)).fetchone()
+        since = row[0] - period if row is not None else 0
+        if since >= until:
+            return
+        connection.execute(f"INSERT OR REPLACE INTO {table} {SQLITE_ROLLUP_SELECT[source]}",
+                           {'period': period, 'since': since, 'until': until})
+        connection.execute("INSERT OR REPLACE INTO rollup_state VALUES (?, ?)", (table, until))
+
+    def stats(self):
+        return {'queueDepth': len(self.queue), 'written': self.written, 'dropped': self.dropped,
+                'errors': self.errors, 'lastError': self.lastError, 'lastFlush': self.lastFlush}
@@ -0,0 +1,188 @@
+"""
+Active polling master with an adaptive per record type scheduler.
+"""
+import asyncio
+import logging
+import time
+
+from .instrumentation import METRIC_BYTES_READ
+from .protocol import RECORD_TYPE_ADDRS, buildFc16Request, interFrameGap
+
+# Seconds between polls of one pack per record type, state is adapted to the bus load
+POLL_STATE_INTERVAL = 1.0
+POLL_STATE_MAX_INTERVAL = 60.0
+POLL_INTERVALS = {1: 300.0, 2: POLL_STATE_INTERVAL, 3: 3600.0}
+POLL_TIMEOUT = 0.5
+# Wait for the FC16 response this long after the record before the next poll
+POLL_RESPONSE_GRACE = 0.05
+POLL_BACKOFF_MAX = 120.0
+# Consecutive timeouts before a pack is reported unresponsive
+POLL_UNRESPONSIVE = 3
+POLL_TARGET_UTILIZATION = 0.6
+POLL_ADAPT_INTERVAL = 5.0
+# Stay silent this long after seeing requests from another master
+POLL_FOREIGN_QUIET = 30.0
+BITS_PER_CHAR = 10
+METRIC_POLL_REQUESTS = 'pollRequests'
+METRIC_POLL_TIMEOUTS = 'pollTimeouts'
+
+def parsePollIds(spec):
+    # "1-15" or "1,2,5" or a mix of both
+    ids = []
+    for part in spec.split(','):
+        first, _, last = part.partition('-')
+        ids.extend(range(int(first), int(last or first) + 1))
+    return ids
+
+class PollMaster:
+    """
+    Act as the bus master and poll the slave packs with FC16 writes.
+
+    One request is outstanding at a time and only sent once the bus has been
+    idle for the inter frame gap. Every (id, record type) has its own due time,
+    state records are polled every few seconds, config and info rarely. A pack
+    that times out is backed off exponentially. The state interval follows the
+    measured bus utilization so the polls leave room for the rest of the
+    traffic, and polling stops for a while when another master shows up.
+    """
+    def __init__(self, bus, writer, ids, baudrate, intervals=None, timeout=POLL_TIMEOUT,
+                 targetUtilization=POLL_TARGET_UTILIZATION):
+        self.bus = bus
+        self.writer = writer
+        self.ids = list(ids)
+        self.baudrate = baudrate
+        self.gap = interFrameGap(baudrate)
+        self.intervals = dict(POLL_INTERVALS if intervals is None else intervals)
+        self.minStateInterval = self.intervals[2]
+        self.timeout = timeout
+        self.targetUtilization = targetUtilization
+        now = time.monotonic()
+        # Config and info are due first so new packs are complete quickly
+        self.due = {(id, recordType): now for id in self.ids for recordType in (1, 3, 2)}
+        self.failures = dict.fromkeys(self.ids, 0)
+        self.backoffUntil = dict.fromkeys(self.ids, 0.0)
+        self.quietUntil = 0.0
+        self.utilization = 0.0
+        self.sentBytes = 0
+        self.echoedBytes = 0
+        self.sentFrame = None
+        self.outstanding = None
+        self.answered = False
+        self.done = asyncio.Event()
+
+    # Bus hooks
+    def echo(self, data):
+        # True for our own request read back from the bus, anything else is another master
+        if data == self.sentFrame:
+            self.sentFrame = None
+            self.echoedBytes += len(data)
+            return True
+        if time.monotonic() >= self.quietUntil:
+            logging.warning(f"Another master polls the bus, pausing polling for {POLL_FOREIGN_QUIET:.0f}s")
+        self.quietUntil = time.monotonic() + POLL_FOREIGN_QUIET
+        return False
+
+    def record(self, id, recordType):
+        if self.outstanding == (id, recordType) and not self.answered:
+            self.answered = True
+            asyncio.get_running_loop().call_later(POLL_RESPONSE_GRACE, self.done.set)
+
+    def response(self, id, writeAddr):
+        if self.outstanding is not None and self.outstanding[0] == id \
+                and RECORD_TYPE_ADDRS[self.outstanding[1]] == writeAddr and self.answered:
+            self.done.set()
+
+    # Scheduling
+    def next(self, now):
+        # (key, due) of the earliest poll of a pack that is not backed off
+        best = None
+        for key, due in self.due.items():
+            due = max(due, self.backoffUntil[key[0]])
+            if best is None or due < best[1]:
+                best = (key, due)
+        return best
+
+    def schedule(self, id, recordType, answered, now):
+        key = (id, recordType)
+        if answered:
+            if self.failures[id] >= POLL_UNRESPONSIVE:
+                logging.info(f"Pack ID: {id} answers polls again")
+            self.failures[id] = 0
+            self.backoffUntil[id] = 0.0
+            # Keep the cadence, but never queue up missed polls
+            self.due[key] = max(self.due[key] + self.intervals[recordType], now)
+            return
+        failures = self.failures[id] = self.failures[id] + 1
+        if failures == POLL_UNRESPONSIVE:
+            logging.warning(f"Pack ID: {id} does not answer polls, backing off")
+        self.backoffUntil[id] = now + min(POLL_BACKOFF_MAX, self.timeout * 2 ** failures)
+
+    def adapt(self, busBits, elapsed):
+        # Stretch the state interval while the bus is busier than the target, shrink it back when idle
+        self.utilization = busBits / (self.baudrate * elapsed)
+        interval = self.intervals[2]
+        if self.utilization > self.targetUtilization:
+            interval = min(POLL_STATE_MAX_INTERVAL, interval * 1.5)
+        elif self.utilization < self.targetUtilization * 0.75:
+            interval = max(self.minStateInterval, interval / 1.25)
+        if interval != self.intervals[2]:
+            logging.debug(f"Bus utilization {self.utilization:.0%}, state poll interval {interval:.2f}s")
+            self.intervals[2] = interval
+
+    def busBytes(self):
+        # Everything on the wire, our own requests counted once whether the adapter echoes them or not
+        return self.bus.metrics.counters().get(METRIC_BYTES_READ, 0) + self.sentBytes - self.echoedBytes
+
+    async def waitIdle(self):
+        while time.monotonic() - self.writer.lastRead < self.gap:
+            await asyncio.sleep(self.gap)
+
+    async def transact(self, id, recordType):
+        frame = buildFc16Request(id, RECORD_TYPE_ADDRS[recordType])
+        self.outstanding = (id, recordType)
+        self.answered = False
+        self.done.clear()
+        self.sentFrame = frame
+        self.bus.correlator.request(id, RECORD_TYPE_ADDRS[recordType])
+        self.writer.write(frame)
+        self.sentBytes += len(frame)
+        self.bus.metrics.incr(METRIC_POLL_REQUESTS)
+        try:
+            await asyncio.wait_for(self.done.wait(), self.timeout)
+        except asyncio.TimeoutError:
+            pass
+        self.outstanding = None
+        if not self.answered:
+            # Retire the request now, a late record must not be taken for the next poll's answer
+            self.bus.correlator.cancel(id, RECORD_TYPE_ADDRS[recordType])
+            self.bus.metrics.incr(METRIC_POLL_TIMEOUTS)
+        return self.answered
+
+    async def run(self):
+        self.bus.poller = self
+        logging.info(f"Polling slave packs {self.ids} as the bus master")
+        adaptStart = time.monotonic()
+        adaptBytes = self.busBytes()
+        try:
+            while True:
+                now = time.monotonic()
+                if now - adaptStart >= POLL_ADAPT_INTERVAL:
+                    busBytes = self.busBytes()
+                    self.adapt((busBytes - adaptBytes) * BITS_PER_CHAR, now - adaptStart)
+                    adaptStart, adaptBytes = now, busBytes
+                if now < self.quietUntil:
+                    await asyncio.sleep(self.quietUntil - now)
+                    continue
+                (id, recordType), due = self.next(now)
+                if due > now:
+                    await asyncio.sleep(min(due - now, POLL_ADAPT_INTERVAL))
+                    continue
+                await self.waitIdle()
+                answered = await self.transact(id, recordType)
+                self.schedule(id, recordType, answered, time.monotonic())
+        finally:
+            self.bus.poller = None
+
+    def report(self):
+        return {'stateInterval': self.intervals[2], 'utilization': self.utilization,
+                'unresponsive': [id for id, failures in self.failures.items() if failures >= POLL_UNRESPONSIVE]}
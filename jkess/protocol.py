@@ -0,0 +1,349 @@
+"""
+JK-PB RS485 framing: checksums, Modbus FC16 frames and the frame reassembler.
+"""
+import logging
+import struct
+import time
+from collections import deque
+
+from .instrumentation import (METRIC_BYTES_READ, METRIC_CHECKSUM_FAILURES, METRIC_CRC_FAILURES,
+                              METRIC_FRAGMENT_ABORTS, METRIC_REASSEMBLY_LATENCY, METRIC_UNKNOWN_BYTES,
+                              METRIC_UNKNOWN_PACKETS)
+
+# Checksum checksum8_mod256
+def calcCheckSum8Mod256(data: str) -> str:
+    """
+    :return:  The checksum computed with the method of 'sum and modulo 256'.
+    """
+    checksum = sum(data[:299]) % 256
+    return checksum
+# --------------------------------------------------------------------------- #
+# Calculate the modbus CRC
+# --------------------------------------------------------------------------- #
+def calcCrc16(data, size):
+    crcHi = 0XFF
+    crcLo = 0xFF
+    
+    crcHiTable	= [	0x00, 0xC1, 0x81, 0x40, 0x01, 0xC0, 0x80, 0x41, 0x01, 0xC0,
+                    0x80, 0x41, 0x00, 0xC1, 0x81, 0x40, 0x01, 0xC0, 0x80, 0x41,
+                    0x00, 0xC1, 0x81, 0x40, 0x00, 0xC1, 0x81, 0x40, 0x01, 0xC0,
+                    0x80, 0x41, 0x01, 0xC0, 0x80, 0x41, 0x00, 0xC1, 0x81, 0x40,
+                    0x00, 0xC1, 0x81, 0x40, 0x01, 0xC0, 0x80, 0x41, 0x00, 0xC1,
+                    0x81, 0x40, 0x01, 0xC0, 0x80, 0x41, 0x01, 0xC0, 0x80, 0x41,
+                    0x00, 0xC1, 0x81, 0x40, 0x01, 0xC0, 0x80, 0x41, 0x00, 0xC1,
+                    0x81, 0x40, 0x00, 0xC1, 0x81, 0x40, 0x01, 0xC0, 0x80, 0x41,
+                    0x00, 0xC1, 0x81, 0x40, 0x01, 0xC0, 0x80, 0x41, 0x01, 0xC0,
+                    0x80, 0x41, 0x00, 0xC1, 0x81, 0x40, 0x00, 0xC1, 0x81, 0x40,
+                    0x01, 0xC0, 0x80, 0x41, 0x01, 0xC0, 0x80, 0x41, 0x00, 0xC1,
+                    0x81, 0x40, 0x01, 0xC0, 0x80, 0x41, 0x00, 0xC1, 0x81, 0x40,
+                    0x00, 0xC1, 0x81, 0x40, 0x01, 0xC0, 0x80, 0x41, 0x01, 0xC0,
+                    0x80, 0x41, 0x00, 0xC1, 0x81, 0x40, 0x00, 0xC1, 0x81, 0x40,
+                    0x01, 0xC0, 0x80, 0x41, 0x00, 0xC1, 0x81, 0x40, 0x01, 0xC0,
+                    0x80, 0x41, 0x01, 0xC0, 0x80, 0x41, 0x00, 0xC1, 0x81, 0x40,
+                    0x00, 0xC1, 0x81, 0x40, 0x01, 0xC0, 0x80, 0x41, 0x01, 0xC0,
+                    0x80, 0x41, 0x00, 0xC1, 0x81, 0x40, 0x01, 0xC0, 0x80, 0x41,
+                    0x00, 0xC1, 0x81, 0x40, 0x00, 0xC1, 0x81, 0x40, 0x01, 0xC0,
+                    0x80, 0x41, 0x00, 0xC1, 0x81, 0x40, 0x01, 0xC0, 0x80, 0x41,
+                    0x01, 0xC0, 0x80, 0x41, 0x00, 0xC1, 0x81, 0x40, 0x01, 0xC0,
+                    0x80, 0x41, 0x00, 0xC1, 0x81, 0x40, 0x00, 0xC1, 0x81, 0x40,
+                    0x01, 0xC0, 0x80, 0x41, 0x01, 0xC0, 0x80, 0x41, 0x00, 0xC1,
+                    0x81, 0x40, 0x00, 0xC1, 0x81, 0x40, 0x01, 0xC0, 0x80, 0x41,
+                    0x00, 0xC1, 0x81, 0x40, 0x01, 0xC0, 0x80, 0x41, 0x01, 0xC0,
+                    0x80, 0x41, 0x00, 0xC1, 0x81, 0x40]
+
+    crcLoTable = [  0x00, 0xC0, 0xC1, 0x01, 0xC3, 0x03, 0x02, 0xC2, 0xC6, 0x06,
+                    0x07, 0xC7, 0x05, 0xC5, 0xC4, 0x04, 0xCC, 0x0C, 0x0D, 0xCD,
+                    0x0F, 0xCF, 0xCE, 0x0E, 0x0A, 0xCA, 0xCB, 0x0B, 0xC9, 0x09,
+                    0x08, 0xC8, 0xD8, 0x18, 0x19, 0xD9, 0x1B, 0xDB, 0xDA, 0x1A,
+                    0x1E, 0xDE, 0xDF, 0x1F, 0xDD, 0x1D, 0x1C, 0xDC, 0x14, 0xD4,
+                    0xD5, 0x15, 0xD7, 0x17, 0x16, 0xD6, 0xD2, 0x12, 0x13, 0xD3,
+                    0x11, 0xD1, 0xD0, 0x10, 0xF0, 0x30, 0x31, 0xF1, 0x33, 0xF3,
+                    0xF2, 0x32, 0x36, 0xF6, 0xF7, 0x37, 0xF5, 0x35, 0x34, 0xF4,
+                    0x3C, 0xFC, 0xFD, 0x3D, 0xFF, 0x3F, 0x3E, 0xFE, 0xFA, 0x3A,
+                    0x3B, 0xFB, 0x39, 0xF9, 0xF8, 0x38, 0x28, 0xE8, 0xE9, 0x29,
+                    0xEB, 0x2B, 0x2A, 0xEA, 0xEE, 0x2E, 0x2F, 0xEF, 0x2D, 0xED,
+                    0xEC, 0x2C, 0xE4, 0x24, 0x25, 0xE5, 0x27, 0xE7, 0xE6, 0x26,
+                    0x22, 0xE2, 0xE3, 0x23, 0xE1, 0x21, 0x20, 0xE0, 0xA0, 0x60,
+                    0x61, 0xA1, 0x63, 0xA3, 0xA2, 0x62, 0x66, 0xA6, 0xA7, 0x67,
+                    0xA5, 0x65, 0x64, 0xA4, 0x6C, 0xAC, 0xAD, 0x6D, 0xAF, 0x6F,
+                    0x6E, 0xAE, 0xAA, 0x6A, 0x6B, 0xAB, 0x69, 0xA9, 0xA8, 0x68,
+                    0x78, 0xB8, 0xB9, 0x79, 0xBB, 0x7B, 0x7A, 0xBA, 0xBE, 0x7E,
+                    0x7F, 0xBF, 0x7D, 0xBD, 0xBC, 0x7C, 0xB4, 0x74, 0x75, 0xB5,
+                    0x77, 0xB7, 0xB6, 0x76, 0x72, 0xB2, 0xB3, 0x73, 0xB1, 0x71,
+                    0x70, 0xB0, 0x50, 0x90, 0x91, 0x51, 0x93, 0x53, 0x52, 0x92,
+                    0x96, 0x56, 0x57, 0x97, 0x55, 0x95, 0x94, 0x54, 0x9C, 0x5C,
+                    0x5D, 0x9D, 0x5F, 0x9F, 0x9E, 0x5E, 0x5A, 0x9A, 0x9B, 0x5B,
+                    0x99, 0x59, 0x58, 0x98, 0x88, 0x48, 0x49, 0x89, 0x4B, 0x8B,
+                    0x8A, 0x4A, 0x4E, 0x8E, 0x8F, 0x4F, 0x8D, 0x4D, 0x4C, 0x8C,
+                    0x44, 0x84, 0x85, 0x45, 0x87, 0x47, 0x46, 0x86, 0x82, 0x42,
+                    0x43, 0x83, 0x41, 0x81, 0x80, 0x40]
+
+    index = 0
+    while index < size:
+        crc = crcHi ^ data[index]
+        crcHi = crcLo ^ crcHiTable[crc]
+        crcLo = crcLoTable[crc]
+        index += 1
+
+    metCRC16 = (crcHi * 0x0100) + crcLo
+    return metCRC16
+
+# --------------------------------------------------------------------------- #
+# Frame reassembly
+# --------------------------------------------------------------------------- #
+JK_HEADER = b'\x55\xaa\xeb\x90'
+JK_RECORD_SIZE = 300
+FC16 = 0x10
+FC16_RESPONSE_SIZE = 8
+# UnitIdentifier (1) + FunctionCode (1) + WriteAddress (2) + WriteQuantity (2) + WriteByteCount (1) + CRC (2)
+FC16_REQUEST_OVERHEAD = 9
+FC16_MAX_QUANTITY = 123
+FC16_CRC_FAILED = -2
+
+FRAME_FC16_REQUEST = 'fc16Request'
+FRAME_FC16_RESPONSE = 'fc16Response'
+FRAME_JK_RECORD = 'jkRecord'
+
+# FC16 write addresses the master uses to request records from a slave
+REQUEST_CONFIG_ADDR = 0x161e
+REQUEST_STATE_ADDR = 0x1620
+REQUEST_INFO_ADDR = 0x161c
+RECORD_TYPE_ADDRS = {1: REQUEST_CONFIG_ADDR, 2: REQUEST_STATE_ADDR, 3: REQUEST_INFO_ADDR}
+ADDR_RECORD_TYPES = {addr: recordType for recordType, addr in RECORD_TYPE_ADDRS.items()}
+
+def checkCrc16(data, size):
+    # Modbus CRC is sent after the frame, hi byte first as returned by calcCrc16
+    return ((data[size] << 8) | data[size + 1]) == calcCrc16(data, size)
+
+class FrameReassembler:
+    """
+    Rebuild frames from an arbitrary chunked byte stream.
+
+    Bytes are appended to a rolling buffer and scanned for JK 55aaeb90 records
+    and Modbus FC16 requests/responses at any offset, so merged or split reads
+    from the serial port do not matter. Only complete frames that pass their
+    checksum or CRC are returned; anything else is skipped one byte at a time
+    until the stream is back in sync.
+    """
+    def __init__(self, maxBufferSize=4096, metrics=None, tracer=None):
+        self.buffer = bytearray()
+        self.maxBufferSize = maxBufferSize
+        self.metrics = metrics
+        self.tracer = tracer
+        self.skippedBytes = 0
+        self.checksumErrors = 0
+        # Absolute stream offset of buffer[0] and (end offset, arrival timestamp, perf_counter) of the buffered chunks
+        self.consumedTotal = 0
+        self.arrivals = deque()
+        self._skipping = False
+
+    def feed(self, data, timestamp=None):
+        # Returns a list of (frameType, frame) tuples for every complete frame now in the buffer
+        return self._feed(data, timestamp, False)[0]
+
+    def feedTimed(self, data, timestamp=None):
+        # Like feed(), as (frameType, frame, timestamp) with the time.time() the frame's first byte arrived
+        frames, arrivals = self._feed(data, timestamp, True)
+        return [(frameType, frame, arrival[1]) for (frameType, frame), arrival in zip(frames, arrivals)]
+
+    def _feed(self, data, timestamp, timed):
+        # data arrived at timestamp, now when None. Arrivals are only tracked for feedTimed() and the metrics
+        metrics = self.metrics
+        tracked = timed or metrics is not None
+        if tracked:
+            if metrics is not None:
+                metrics.incr(METRIC_BYTES_READ, len(data))
+            self.arrivals.append((self.consumedTotal + len(self.buffer) + len(data),
+                                  time.time() if timestamp is None else timestamp,
+                                  time.perf_counter() if metrics is not None else None))
+        self.buffer += data
+        frames, starts, consumed = self._scan()
+        if consumed:
+            del self.buffer[:consumed]
+        # Never let a stream of garbage grow the buffer without bound
+        overflow = len(self.buffer) - self.maxBufferSize
+        if overflow > 0:
+            if self.buffer.find(JK_HEADER, 0, overflow) >= 0:
+                self._abort()
+            del self.buffer[:overflow]
+            self._skip(overflow)
+            consumed += overflow
+        arrivals = ()
+        if tracked:
+            if starts:
+                arrivals = self.frameArrivals(starts)
+                if metrics is not None:
+                    # Time from the arrival of a frame's first byte to the frame being complete
+                    now = time.perf_counter()
+                    for _, _, perfCounter in arrivals:
+                        metrics.observe(METRIC_REASSEMBLY_LATENCY, now - perfCounter)
+            pending = self.arrivals
+            while pending and pending[0][0] <= self.consumedTotal + consumed:
+                pending.popleft()
+        self.consumedTotal += consumed
+        return frames, arrivals
+
+    def frames(self, chunks):
+        # Generator of complete frames from any iterable of byte chunks
+        for chunk in chunks:
+            yield from self.feed(chunk)
+
+    def reset(self):
+        if self.buffer.startswith(JK_HEADER):
+            self._abort()
+        self._skip(len(self.buffer))
+        self.consumedTotal += len(self.buffer)
+        self.arrivals.clear()
+        self.buffer.clear()
+
+    def _skip(self, count):
+        if count:
+            self.skippedBytes += count
+            if self.metrics is not None:
+                self.metrics.incr(METRIC_UNKNOWN_BYTES, count)
+            self._skipping = True
+
+    def _frameFound(self):
+        # A run of skipped bytes ends at the next good frame and counts as one unknown packet
+        if self._skipping:
+            self._skipping = False
+            if self.metrics is not None:
+                self.metrics.incr(METRIC_UNKNOWN_PACKETS)
+
+    def _abort(self):
+        if self.metrics is not None:
+            self.metrics.incr(METRIC_FRAGMENT_ABORTS)
+
+    def frameArrivals(self, starts):
+        # Arrival of the chunk holding each frame's first byte, starts are buffer offsets
+        arrivals = self.arrivals
+        found = []
+        index = 0
+        for start in starts:
+            start += self.consumedTotal
+            while index < len(arrivals) - 1 and arrivals[index][0] <= start:
+                index += 1
+            found.append(arrivals[index])
+        return found
+
+    def _scan(self):
+        buf = self.buffer
+        end = len(buf)
+        frames = []
+        starts = []
+        pos = 0
+        with memoryview(buf) as view:
+            while pos < end:
+                header = buf.find(JK_HEADER, pos)
+                fcPos = buf.find(FC16, pos + 1) - 1
+                if fcPos < pos:
+                    fcPos = -1
+                if header < 0 and fcPos < 0:
+                    # Keep a possible partial header at the tail for the next read
+                    keep = max(pos, end - len(JK_HEADER) + 1)
+                    self._skip(keep - pos)
+                    pos = keep
+                    break
+                start = header if fcPos < 0 or (0 <= header < fcPos) else fcPos
+                self._skip(start - pos)
+                pos = start
+
+                if pos == header:
+                    if end - pos < JK_RECORD_SIZE:
+                        break
+                    last = pos + JK_RECORD_SIZE - 1
+                    if sum(view[pos:last]) & 0xFF == buf[last]:
+                        self._frameFound()
+                        frames.append((FRAME_JK_RECORD, view[pos:last + 1].tobytes()))
+                        starts.append(pos)
+                        pos = last + 1
+                    elif buf.find(JK_HEADER, pos + 1, last + 1) >= 0:
+                        # The next record starts inside this one, the rest of it never arrived
+                        logging.error(f"Incomplete JK record at offset {pos} of {end}bytes, resyncing")
+                        self._abort()
+                        self._skip(1)
+                        pos += 1
+                    else:
+                        logging.error(f"BAD Checksum JK record at offset {pos} of {end}bytes, resyncing")
+                        self.checksumErrors += 1
+                        if self.metrics is not None:
+                            self.metrics.incr(METRIC_CHECKSUM_FAILURES)
+                        if self.tracer is not None:
+                            self.tracer.fault('JK record checksum error', view[pos:last + 1])
+                        self._skip(1)
+                        pos += 1
+                    continue
+
+                size = self._matchFc16(view, pos, end)
+                if size == 0:
+                    break
+                if size > 0:
+                    self._frameFound()
+                    frameType = FRAME_FC16_REQUEST if size > FC16_RESPONSE_SIZE else FRAME_FC16_RESPONSE
+                    frames.append((frameType, view[pos:pos + size].tobytes()))
+                    starts.append(pos)
+                    pos += size
+                else:
+                    if size == FC16_CRC_FAILED:
+                        if self.metrics is not None:
+                            self.metrics.incr(METRIC_CRC_FAILURES)
+                        if self.tracer is not None:
+                            self.tracer.fault('FC16 CRC error', view[pos:pos + self._fc16Size(view, pos, end)])
+                    self._skip(1)
+                    pos += 1
+        return frames, starts, pos
+
+    @staticmethod
+    def _fc16Size(view, pos, end):
+        # Bytes a FC16 candidate at pos would span, as far as they are buffered
+        size = FC16_REQUEST_OVERHEAD + view[pos + 6] if end - pos >= 7 else FC16_RESPONSE_SIZE
+        return min(size, end - pos)
+
+    @staticmethod
+    def _matchFc16(view, pos, end):
+        # Returns the frame size on a match, 0 when more bytes are needed, FC16_CRC_FAILED for a
+        # frame to a known register address with a bad CRC and -1 when pos is not a FC16 frame
+        avail = end - pos
+        needMore = False
+        crcFailed = False
+        if avail >= 7:
+            writeAddr = (view[pos + 2] << 8) | view[pos + 3]
+            quantity = (view[pos + 4] << 8) | view[pos + 5]
+            byteCount = view[pos + 6]
+            if 0 < quantity <= FC16_MAX_QUANTITY and byteCount == quantity * 2:
+                size = FC16_REQUEST_OVERHEAD + byteCount
+                if avail < size:
+                    needMore = True
+                elif checkCrc16(view[pos:pos + size], size - 2):
+                    return size
+                else:
+                    crcFailed = writeAddr in ADDR_RECORD_TYPES
+        else:
+            needMore = True
+        if avail < FC16_RESPONSE_SIZE:
+            return 0
+        if checkCrc16(view[pos:pos + FC16_RESPONSE_SIZE], FC16_RESPONSE_SIZE - 2):
+            return FC16_RESPONSE_SIZE
+        if needMore:
+            return 0
+        if crcFailed or (avail < FC16_REQUEST_OVERHEAD + 2 and writeAddr in ADDR_RECORD_TYPES):
+            return FC16_CRC_FAILED
+        return -1
+
+# --------------------------------------------------------------------------- #
+# Modbus timing and frame builders
+# --------------------------------------------------------------------------- #
+# Modbus RTU ends a frame after 3.5 idle character times, fixed to 1.75ms above 19200 baud
+MODBUS_FIXED_GAP = 0.00175
+def interFrameGap(baudrate, bitsPerChar=10):
+    if baudrate > 19200:
+        return MODBUS_FIXED_GAP
+    return 3.5 * bitsPerChar / baudrate
+
+def buildFc16Request(id, writeAddr, writeData=b'\x00\x00'):
+    frame = struct.pack('>BBHHB', id, FC16, writeAddr, len(writeData) // 2, len(writeData)) + writeData
+    return frame + struct.pack('>H', calcCrc16(frame, len(frame)))
+
+def buildFc16Response(id, writeAddr, writeQty=1):
+    frame = struct.pack('>BBHH', id, FC16, writeAddr, writeQty)
+    return frame + struct.pack('>H', calcCrc16(frame, len(frame)))
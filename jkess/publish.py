@@ -0,0 +1,278 @@
+"""
+What to publish: deadband deltas, bus events and Home Assistant discovery.
+
+Works with any output that has put(topic, message, retain), see mqtt.MqttOutput.
+"""
+import asyncio
+import hashlib
+import json
+import logging
+import socket
+import threading
+import time
+
+from .records import CELL_COUNT_MAX, CONFIG_LAYOUT, INFO_LAYOUT, STATE_LAYOUT
+
+MONITOR_HOST = socket.gethostname()
+MQTT_TOPIC = "tele"
+MQTT_DISCOVERY_PREFIX = "homeassistant"
+MQTT_TOPIC_HA_STATUS = "homeassistant/status"
+
+# --------------------------------------------------------------------------- #
+# Delta / deadband publishing
+# --------------------------------------------------------------------------- #
+# Smallest change worth publishing per field, looked up by exact name and then by
+# the name without its cell or sensor number. Fields not listed publish on any change.
+MQTT_DEADBANDS = {
+    'CellVol': 5,          # mV
+    'CellVolAve': 5,       # mV
+    'CellVdifMax': 2,      # mV
+    'CellWireRes': 5,      # mOhm
+    'BatVol': 20,          # mV
+    'BatWatt': 10,         # W
+    'BatCurrent': 100,     # mA
+    'BalanCurrent': 10,    # mA
+    'SOCCapRemain': 100,   # mAh
+    'TempMos': 5,          # 0.1C
+    'TempBat': 5,          # 0.1C
+    'SysRunTicks': 600,
+    'RTCTicks': 600,
+    'RunTime': 600,
+}
+# Seconds between publishing every field of a pack regardless of changes
+MQTT_FULL_REFRESH = 300
+# Seconds between publish cycles, every pack gets at most one message per cycle
+MQTT_PUBLISH_INTERVAL = 1.0
+
+_MISSING = object()
+
+class DeltaPublisher:
+    """
+    Publish only the pack fields that changed beyond their deadband.
+
+    The last published value is kept per pack and field, changes are collected
+    by update() and flush() hands one message per pack with the changed fields
+    grouped by record kind to the output (an MqttOutput). Every refreshInterval a pack sends all of
+    its fields so late subscribers catch up.
+    """
+    def __init__(self, output, topic=None, deadbands=None, refreshInterval=MQTT_FULL_REFRESH):
+        self.output = output
+        self.topic = topic if topic is not None else f"{MQTT_TOPIC}/{MONITOR_HOST}"
+        self.deadbands = dict(MQTT_DEADBANDS if deadbands is None else deadbands)
+        self.refreshInterval = refreshInterval
+        self.last = {}
+        self.lastRefresh = {}
+        self.pending = {}
+        self._fieldDeadbands = {}
+
+    def deadband(self, field):
+        deadband = self._fieldDeadbands.get(field)
+        if deadband is None:
+            deadband = self.deadbands.get(field)
+            if deadband is None:
+                deadband = self.deadbands.get(field.rstrip('0123456789'), 0)
+            self._fieldDeadbands[field] = deadband
+        return deadband
+
+    def update(self, packId, kind, values, now=None):
+        now = time.monotonic() if now is None else now
+        key = (packId, kind)
+        last = self.last.setdefault(key, {})
+        changes = self.pending.setdefault(packId, {}).setdefault(kind, {})
+        if now - self.lastRefresh.get(key, -self.refreshInterval) >= self.refreshInterval:
+            self.lastRefresh[key] = now
+            last.update(values)
+            changes.update(values)
+            return
+        deadband = self.deadband
+        for field, value in values.items():
+            previous = last.get(field, _MISSING)
+            if previous is value or previous == value:
+                continue
+            if previous is not _MISSING and isinstance(value, (int, float)) and not isinstance(value, bool):
+                if abs(value - previous) < deadband(field):
+                    continue
+            last[field] = value
+            changes[field] = value
+
+    def messages(self):
+        # Pop the pending changes as (topic, message) per pack
+        pending, self.pending = self.pending, {}
+        for packId, kinds in pending.items():
+            kinds = {kind: changes for kind, changes in kinds.items() if changes}
+            if kinds:
+                kinds['ts'] = round(time.time(), 3)
+                yield f"{self.topic}/{packId}", kinds
+
+    def flush(self):
+        for topic, message in self.messages():
+            self.output.put(topic, message)
+
+# Events waiting for the broker, in order, they are never coalesced
+MQTT_EVENT_QUEUE_SIZE = 1024
+
+class EventPublisher:
+    """
+    Publish bus events, one JSON message per event on <topic>/<pack>/event/<name>.
+
+    Every event is an edge that matters, e.g. an alarm raise followed by its
+    clear, so the output has to be a FIFO (an MqttOutput with the drop-oldest
+    policy), never one that keeps only the latest message of a topic.
+    """
+    def __init__(self, output, topic=None):
+        self.output = output
+        self.topic = topic if topic is not None else f"{MQTT_TOPIC}/{MONITOR_HOST}"
+
+    def update(self, event):
+        # Bus event listener, events are ready payloads so they are never merged with pack data
+        topic = f"{self.topic}/{event['pack']}/event/{event['event']}"
+        if 'name' in event:
+            topic += f"/{event['name']}"
+        self.output.put(topic, json.dumps(event))
+
+async def publishLoop(publisher, interval=MQTT_PUBLISH_INTERVAL):
+    while True:
+        await asyncio.sleep(interval)
+        publisher.flush()
+
+# --------------------------------------------------------------------------- #
+# Home Assistant MQTT discovery
+# --------------------------------------------------------------------------- #
+DISCOVERY_QUEUE_SIZE = 65536
+# Per cell fields, only the first CellCount of them get an entity
+DISCOVERY_CELL_PREFIXES = ('CellVol', 'CellSta', 'CellWireRes', 'CellWireResSta', 'CellConWireRes')
+# unit, device class and scale by field name or name without its number
+DISCOVERY_UNITS = {
+    'CellVol': ('V', 'voltage', 0.001),
+    'CellVolAve': ('V', 'voltage', 0.001),
+    'CellVdifMax': ('V', 'voltage', 0.001),
+    'BatVol': ('V', 'voltage', 0.001),
+    'BatCurrent': ('A', 'current', 0.001),
+    'BalanCurrent': ('A', 'current', 0.001),
+    'BatWatt': ('W', 'power', 1),
+    'TempMos': ('°C', 'temperature', 0.1),
+    'TempBat': ('°C', 'temperature', 0.1),
+    'SOCStateOfCharge': ('%', 'battery', 1),
+    'SOCSOH': ('%', None, 1),
+    'SOCCapRemain': ('Ah', None, 0.001),
+    'SOCFullChargeCap': ('Ah', None, 0.001),
+}
+
+def discoveryFields():
+    # (kind, field, isBit) for everything getConfig, getState and getInfo produce
+    for kind, layout in (('config', CONFIG_LAYOUT), ('state', STATE_LAYOUT), ('info', INFO_LAYOUT)):
+        for name in layout.fieldNames:
+            yield kind, name, False
+        for name in layout.bitNames:
+            yield kind, name, True
+        for name, _, _ in layout.stringFields:
+            yield kind, name, False
+
+class DiscoveryCache:
+    """
+    Home Assistant discovery configs per pack, built once and republished rarely.
+
+    The retained config of every field entity is generated when a pack first
+    shows up and cached together with a hash of its content. Configs are only
+    published again when the hash changes (a new CellCount), or for every pack
+    when Home Assistant announces itself online with its birth message.
+    Entities that disappear, e.g. cells above a lowered CellCount, get an empty
+    retained config so Home Assistant removes them.
+    """
+    def __init__(self, output, stateTopic=None, prefix=None, nodeId=None, statusTopic=None):
+        self.output = output
+        self.statusTopic = statusTopic if statusTopic is not None else MQTT_TOPIC_HA_STATUS
+        self.stateTopic = stateTopic if stateTopic is not None else f"{MQTT_TOPIC}/{MONITOR_HOST}"
+        self.prefix = prefix if prefix is not None else MQTT_DISCOVERY_PREFIX
+        self.nodeId = nodeId if nodeId is not None else f"jkess_{MONITOR_HOST}".replace('.', '_').replace('-', '_')
+        self.lock = threading.Lock()
+        self.cellCounts = {}
+        self.cache = {}
+        self.republished = 0
+
+    def attach(self):
+        # Listen for the Home Assistant birth message
+        self.output.subscribe(self.statusTopic, self.onStatus)
+
+    def onStatus(self, client, userdata, msg):
+        if msg.payload.decode(errors='replace') == 'online':
+            logging.info("Home Assistant is online, republishing discovery")
+            self.republishAll()
+
+    def update(self, packId, kind, values):
+        # Bus listener, cheap unless the pack is new or its CellCount changed
+        cellCount = values.get('CellCount') if kind == 'config' else None
+        with self.lock:
+            if packId in self.cache and (cellCount is None or cellCount == self.cellCounts.get(packId)):
+                return
+            if cellCount is not None:
+                self.cellCounts[packId] = cellCount
+            self._refresh(packId)
+
+    def _refresh(self, packId):
+        configs = self.build(packId, self.cellCounts.get(packId, CELL_COUNT_MAX))
+        digest = hashlib.sha1(b''.join(topic.encode() + payload.encode() for topic, payload in configs.items())).hexdigest()
+        previous = self.cache.get(packId)
+        if previous is not None and previous[0] == digest:
+            return
+        if previous is not None:
+            for topic in previous[1].keys() - configs.keys():
+                self.output.put(topic, '', retain=True)
+        self.cache[packId] = (digest, configs)
+        self._publish(configs)
+        logging.info(f"Published {len(configs)} discovery configs for Pack ID:{packId}")
+
+    def republishAll(self):
+        with self.lock:
+            for digest, configs in self.cache.values():
+                self._publish(configs)
+            self.republished += 1
+
+    def _publish(self, configs):
+        for topic, payload in configs.items():
+            self.output.put(topic, payload, retain=True)
+
+    def build(self, packId, cellCount):
+        # {discovery topic: JSON config} for every entity of one pack
+        device = {'identifiers': [f"{self.nodeId}_{packId}"], 'name': f"JK BMS {packId}",
+                  'manufacturer': 'JK BMS', 'via_device': self.nodeId}
+        stateTopic = f"{self.stateTopic}/{packId}"
+        configs = {}
+        for kind, field, isBit in discoveryFields():
+            prefix = field.rstrip('0123456789')
+            if prefix in DISCOVERY_CELL_PREFIXES and prefix != field and int(field[len(prefix):]) >= cellCount:
+                continue
+            objectId = f"{self.nodeId}_{packId}_{field}".replace('%', 'pct').lower()
+            config = {
+                'name': field,
+                'unique_id': objectId,
+                'object_id': objectId,
+                'state_topic': stateTopic,
+                'device': device,
+            }
+            value = f"value_json.{kind}['{field}']"
+            # Rendered when a delta leaves the field out, binary sensor states read on/off
+            current = 'this.state'
+            if isBit:
+                component = 'binary_sensor'
+                config['payload_on'] = 'ON'
+                config['payload_off'] = 'OFF'
+                value = f"'ON' if {value} else 'OFF'"
+                current = 'this.state | upper'
+            else:
+                component = 'sensor'
+                unit = DISCOVERY_UNITS.get(field) or DISCOVERY_UNITS.get(prefix)
+                if unit is not None:
+                    config['unit_of_measurement'], deviceClass, scale = unit
+                    if deviceClass is not None:
+                        config['device_class'] = deviceClass
+                    config['state_class'] = 'measurement'
+                    if scale != 1:
+                        value = f"({value} * {scale}) | round(3)"
+            if kind != 'state':
+                config['entity_category'] = 'diagnostic'
+            # Delta messages only carry changed fields, keep the current state otherwise
+            config['value_template'] = (f"{{% if '{kind}' in value_json and '{field}' in value_json.{kind} %}}"
+                                        f"{{{{ {value} }}}}{{% else %}}{{{{ {current} }}}}{{% endif %}}")
+            configs[f"{self.prefix}/{component}/{self.nodeId}/{packId}_{field.replace('%', 'pct')}/config"] = json.dumps(config, separators=(',', ':'))
+        return configs
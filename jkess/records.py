@@ -0,0 +1,281 @@
+"""
+Declarative layouts and decoders of the JK config, state and info records.
+"""
+import struct
+from operator import itemgetter
+
+from .protocol import JK_HEADER, JK_RECORD_SIZE, calcCheckSum8Mod256
+
+# Payload starts after the 55aaeb90 header, record type and record source bytes
+JK_PAYLOAD_OFFSET = 6
+CELL_COUNT_MAX = 32
+
+def cellFields(prefix, offset, size, fmt):
+    return [(f"{prefix}{cell}", offset + cell * size, fmt) for cell in range(CELL_COUNT_MAX)]
+
+BIT_CACHE_SIZE = 256
+
+def bitShift(bit):
+    # Bits are numbered the way bitarray numbered them: little endian bytes, MSB first within a byte
+    return 8 * (bit // 8) + 7 - bit % 8
+
+class RecordLayout:
+    """
+    Declarative JK record layout compiled once into a single struct.Struct.
+
+    fields are (name, offset, structFormat) tuples, bitFields are
+    (wordName, offset, structFormat, names) tuples where names[i] is the name
+    of bit i (None to skip it) and strings are (name, offset, size) tuples. Offsets are
+    relative to the payload, i.e. after the 6 byte header.
+    """
+    def __init__(self, fields, bitFields=(), strings=()):
+        items = [(offset, fmt, ('field', name)) for name, offset, fmt in fields]
+        items += [(offset, fmt, ('bits', (wordName, names))) for wordName, offset, fmt, names in bitFields]
+        items += [(offset, f"{size}s", ('string', name)) for name, offset, size in strings]
+        self.stringFields = list(strings)
+        items.sort(key=lambda item: item[0])
+
+        structFormat = '<'
+        position = 0
+        self.fields = []
+        self.bitFields = []
+        self.bitWords = []
+        bitNames = []
+        bitTables = []
+        self.strings = []
+        for index, (offset, fmt, (kind, what)) in enumerate(items):
+            if offset < position:
+                raise ValueError(f"Overlapping record field at offset {offset}")
+            if offset > position:
+                structFormat += f"{offset - position}x"
+            structFormat += fmt
+            position = offset + struct.calcsize('<' + fmt)
+            if kind == 'field':
+                self.fields.append((what, offset, fmt))
+            elif kind == 'bits':
+                wordName, what = what
+                self.bitFields.append((wordName, offset, fmt, what))
+                size = struct.calcsize('<' + fmt)
+                self.bitWords.append((index, size))
+                bitNames += [name for name in what if name is not None]
+                # Per byte of the word, the named bits of every byte value, from the precomputed shifts
+                for byteIndex in range(size):
+                    shifts = [bitShift(bit) - 8 * byteIndex for bit, name in enumerate(what)
+                              if name is not None and bit // 8 == byteIndex]
+                    bitTables.append((len(self.bitWords) - 1, 8 * byteIndex,
+                                      tuple(tuple((byte >> shift) & 1 for shift in shifts) for byte in range(256))))
+            else:
+                self.strings.append((what, index))
+        self.struct = struct.Struct(structFormat)
+        self.size = JK_PAYLOAD_OFFSET + self.struct.size
+        self.names = tuple(kind == 'field' and what or None for _, _, (kind, what) in items)
+        self.itemNames = tuple(what[0] if kind == 'bits' else what for _, _, (kind, what) in items)
+        self.itemIsString = tuple(kind == 'string' for _, _, (kind, _) in items)
+        self.fieldIndexes = tuple(index for index, name in enumerate(self.names) if name is not None)
+        self.fieldNames = tuple(self.names[index] for index in self.fieldIndexes)
+        self._getFields = itemgetter(*self.fieldIndexes)
+        self.bitNames = tuple(bitNames)
+        self.bitTables = tuple(bitTables)
+        self._getWords = lambda values, indexes=tuple(index for index, _ in self.bitWords): tuple(values[index] for index in indexes)
+        self._bitCache = {}
+        # Copying a dict with all the keys in place and updating it beats growing a new one
+        self._template = dict.fromkeys(self.fieldNames + self.bitNames + tuple(name for name, _ in self.strings))
+
+    def expandBits(self, words):
+        # Status and alarm words rarely change, so the expanded bits are cached per word combination
+        bits = self._bitCache.get(words)
+        if bits is None:
+            bits = self._bitCache[words] = dict(zip(self.bitNames, self.bitValues(words)))
+            if len(self._bitCache) > BIT_CACHE_SIZE:
+                self._bitCache.clear()
+        return bits
+
+    def bitValues(self, words):
+        # Tuple of the named bits, one table lookup per byte of each word
+        expanded = ()
+        for word, shift, table in self.bitTables:
+            expanded += table[(words[word] >> shift) & 0xff]
+        return expanded
+
+    def pack(self, values):
+        # Payload bytes for a dict of field, bit word and string values, missing ones are 0
+        packed = []
+        for name, isString in zip(self.itemNames, self.itemIsString):
+            value = values.get(name, b'' if isString else 0)
+            packed.append(value.encode('ascii') if isString and isinstance(value, str) else value)
+        return self.struct.pack(*packed)
+
+    def unpack(self, data):
+        return self.struct.unpack_from(data, JK_PAYLOAD_OFFSET)
+
+    def decode(self, data):
+        values = self.struct.unpack_from(data, JK_PAYLOAD_OFFSET)
+        record = self._template.copy()
+        record.update(zip(self.fieldNames, self._getFields(values)))
+        if self.bitTables:
+            record.update(self.expandBits(self._getWords(values)))
+        for name, index in self.strings:
+            record[name] = values[index].split(b'\x00', 1)[0].decode('ascii', errors='replace')
+        return record
+
+# JK ESS PB BMS Record Type 1 - Config Details 0x1000
+CONFIG_LAYOUT = RecordLayout(
+    fields=[
+        ('VolSmartSleep', 0, 'I'),
+        ('VolCellUV', 4, 'I'),
+        ('VolCellUVPR', 8, 'I'),
+        ('VolCellOV', 12, 'I'),
+        ('VolCellOVPR', 16, 'I'),
+        ('VolBalanTrig', 20, 'I'),
+        ('VolSOC100%', 24, 'I'),
+        ('VolSOC0%', 28, 'I'),
+        ('VolCellRCV', 32, 'I'),
+        ('VolCellRFV', 36, 'I'),
+        ('VolSysPwrOff', 40, 'I'),
+        ('CurBatCOC', 44, 'I'),
+        ('TIMBatCOCPDly', 48, 'I'),
+        ('TIMBatCOCPRDly', 52, 'I'),
+        ('CurBatDcOC', 56, 'I'),
+        ('TIMBatDcOCPDly', 60, 'I'),
+        ('TIMBatDcOCPRDly', 64, 'I'),
+        ('TIMBatSCPRDly', 68, 'I'),
+        ('CurBalanMax', 72, 'I'),
+        ('TMPBatCOT', 76, 'i'),
+        ('TMPBatCOTPR', 80, 'i'),
+        ('TMPBatDcOT', 84, 'i'),
+        ('TMPBatDcOTPR', 88, 'i'),
+        ('TMPBatCUT', 92, 'i'),
+        ('TMPBatCUTPR', 96, 'i'),
+        ('TMPMosOT', 100, 'i'),
+        ('TMPMosOTPR', 104, 'i'),
+        ('CellCount', 108, 'I'),
+        ('BatChargeEN', 112, 'I'),
+        ('BatDisChargeEN', 116, 'I'),
+        ('BalanEN', 120, 'I'),
+        ('CapBatCell', 124, 'I'),
+        ('SCPDelay', 128, 'I'),
+        ('VolStartBalan', 132, 'I'),
+        *cellFields('CellConWireRes', 136, 4, 'I'),
+        ('DevAddr', 264, 'I'),
+        ('TIMProdischarge', 268, 'I'),
+        ('TIMSmartSleep', 280, 'B'),
+        ('FieldEnableControl0', 281, 'B'),
+    ],
+    bitFields=[
+        ('CfgEnable', 276, 'H', ['HeatEN', 'DisableTempSensor', 'GPSHeartbeat', 'PortSwitch', 'LCDAlwaysOn',
+                    'SpecialCharger', 'SmartSleep', 'DisablePCLModule', 'TimedStoredData',
+                    'ChargingFloatMode']),
+    ],
+)
+
+# JK ESS PB BMS Record Type 2 - Status Details 0x1200
+STATE_ALARM_NAMES = ['AlarmWireRes', 'AlarmMosOTP', 'AlarmCellQuantity', 'AlarmCurSensorErr',
+                     'AlarmCellOVP', 'AlarmBatOVP', 'AlarmChOCP', 'AlarmChSCP', 'AlarmChOTP',
+                     'AlarmChUTP', 'AlarmCPUAuxCommuErr', 'AlarmCellUVP', 'AlarmBatUVP',
+                     'AlarmDchOCP', 'AlarmDchSCP', 'AlarmDchOTP', 'AlarmChargeMOS',
+                     'AlarmDischargeMOS', 'GPSDisconneted', 'AlarmModifyPwd',
+                     'AlarmDischargeOnFailed', 'AlarmBatteryOverTemp', 'AlarmTempSenAnomaly',
+                     'AlarmPLCModuleAnomaly']
+STATE_TEMP_SENSOR_NAMES = ['AlarmMOSTempSenAbsent', 'AlarmTempSen1Absent', 'AlarmTempSen2Absent',
+                           'AlarmTempSen3Absent', 'AlarmTempSen4Absent', 'AlarmTempSen5Absent']
+STATE_LAYOUT = RecordLayout(
+    fields=[
+        *cellFields('CellVol', 0, 2, 'H'),
+        ('CellVolAve', 68, 'H'),
+        ('CellVdifMax', 70, 'H'),
+        ('MaxVolCellNbr', 72, 'B'),
+        ('MinVolCellNbr', 73, 'B'),
+        *cellFields('CellWireRes', 74, 2, 'H'),
+        ('TempMos', 138, 'h'),
+        # Byte 144 holds a 4 byte BatVol as well, the 2 byte copy at 228 is the one reported
+        ('BatWatt', 148, 'I'),
+        ('BatCurrent', 152, 'i'),
+        ('TempBat1', 156, 'h'),
+        ('TempBat2', 158, 'h'),
+        ('BalanCurrent', 164, 'h'),
+        ('BalanSta', 166, 'B'),
+        ('SOCStateOfCharge', 167, 'B'),
+        ('SOCCapRemain', 168, 'i'),
+        ('SOCFullChargeCap', 172, 'I'),
+        ('SOCCycleCount', 176, 'I'),
+        ('SOCCycleCap', 180, 'I'),
+        ('SOCSOH', 184, 'B'),
+        ('Precharge', 185, 'B'),
+        ('UserAlarm', 186, 'H'),
+        ('RunTime', 188, 'I'),
+        ('Charge', 192, 'B'),
+        ('DisCharge', 193, 'B'),
+        ('UserAlarm2', 194, 'H'),
+        ('TimeDcOCPR', 196, 'H'),
+        ('TimeDcSCPR', 198, 'H'),
+        ('TimeCOCPR', 200, 'H'),
+        ('TimeCSCPR', 202, 'H'),
+        ('TimeUVPR', 204, 'H'),
+        ('TimeOVPR', 206, 'H'),
+        ('Heating', 209, 'B'),
+        # Byte 210 Reserved
+        ('TimeEmergency', 212, 'H'),
+        ('BatDisCurCorrect', 214, 'H'),
+        ('VolChargCur', 216, 'H'),
+        ('VolDischargCur', 218, 'H'),
+        ('BatVolCorrect', 220, 'f'),
+        ('BatVol', 228, 'H'),
+        ('HeatCurrent', 230, 'h'),
+        # Byte 238 holds RVD as well, the copy at 269 is the one reported
+        ('ChargerPlugged', 239, 'B'),
+        ('SysRunTicks', 240, 'I'),
+        # Byte 244 - 248  Reserved
+        ('TempBat3', 248, 'h'),
+        ('TempBat4', 250, 'h'),
+        ('TempBat5', 252, 'h'),
+        ('RTCTicks', 256, 'I'),
+        ('TimeEnterSleep', 264, 'I'),
+        ('PCLModuleSta', 268, 'B'),
+        ('RVD', 269, 'B'),
+    ],
+    bitFields=[
+        # CellSta Cell Status #64 Bits 0-31 for 4 bytes
+        ('CellSta', 64, 'I', [f"CellSta{cell}" for cell in range(CELL_COUNT_MAX)]),
+        # CellWireResSta Cell Status #140 Bits 0-31 for 4 bytes
+        ('CellWireResSta', 140, 'I', [f"CellWireResSta{cell}" for cell in range(CELL_COUNT_MAX)]),
+        # Alarms Array Byte 160 = 4 bytes into bits
+        ('BatAlarms', 160, 'I', STATE_ALARM_NAMES),
+        # TempSensor Alarms Array Byte 208 = 1 bytes into bits
+        ('TempSenAlarms', 208, 'B', STATE_TEMP_SENSOR_NAMES),
+    ],
+)
+
+# JK ESS PB BMS Record Type 3 - Device Details 0x1400
+INFO_LAYOUT = RecordLayout(
+    fields=[
+        ('ODDRunTime', 32, 'I'),
+        ('PWROnTimes', 36, 'I'),
+    ],
+    strings=[
+        ('ManufacturerDeviceID', 0, 16),
+        ('HardwareVersion', 16, 8),
+        ('SoftwareVersion', 24, 8),
+    ],
+)
+
+RECORD_LAYOUTS = {1: CONFIG_LAYOUT, 2: STATE_LAYOUT, 3: INFO_LAYOUT}
+
+def getConfig (data):
+    return CONFIG_LAYOUT.decode(data)
+
+def getState (data):
+    return STATE_LAYOUT.decode(data)
+
+def getInfo (data):
+    return INFO_LAYOUT.decode(data)
+
+def buildRecord(recordType, recordSource, values):
+    # Complete 300 byte 55aaeb90 record with the checksum in the last byte
+    record = bytearray(JK_RECORD_SIZE)
+    record[:4] = JK_HEADER
+    record[4] = recordType
+    record[5] = recordSource
+    payload = RECORD_LAYOUTS[recordType].pack(values)
+    record[JK_PAYLOAD_OFFSET:JK_PAYLOAD_OFFSET + len(payload)] = payload
+    record[-1] = calcCheckSum8Mod256(record)
+    return bytes(record)
@@ -0,0 +1,141 @@
+"""
+Event driven serial transport, imported only when a port is read.
+"""
+import asyncio
+import logging
+import time
+
+import serial
+
+from .capture import CAPTURE_RX, CAPTURE_TX
+from .monitor import JkBusMonitor
+from .poll import PollMaster
+from .protocol import FrameReassembler, interFrameGap
+
+# A bus that never goes idle is still handed to the reassembler in bursts of this size
+MAX_BURST_SIZE = 1024
+
+class SerialFrameReader:
+    """
+    Async iterator of (frameType, frame, timestamp) tuples read from a serial port.
+
+    The port is registered with the event loop via add_reader so the task only
+    wakes up when bytes arrive. Bytes are collected until the bus has been idle
+    for the Modbus inter frame gap and the burst is then handed to the
+    reassembler, so frame ends follow the line timing rather than read sizes.
+    Every frame carries the time.time() its burst started to arrive, not the
+    time it was handed on.
+    """
+    def __init__(self, port, baudrate, reassembler=None, gap=None, queueSize=1024, capture=None):
+        self.port = port
+        self.baudrate = baudrate
+        self.reassembler = reassembler if reassembler is not None else FrameReassembler()
+        self.gap = gap if gap is not None else interFrameGap(baudrate)
+        self.queue = asyncio.Queue(queueSize)
+        self.pending = bytearray()
+        self.droppedFrames = 0
+        self.capture = capture
+        self.ser = None
+        self.loop = None
+        self.lastRead = 0.0
+        self.burstStart = None
+        self._gapHandle = None
+        self._error = None
+
+    def open(self):
+        self.loop = asyncio.get_running_loop()
+        self.ser = serial.Serial(self.port, self.baudrate, timeout=0)
+        self.loop.add_reader(self.ser.fileno(), self._onReadable)
+        return self
+
+    def close(self):
+        if self._gapHandle is not None:
+            self._gapHandle.cancel()
+            self._gapHandle = None
+        if self.ser is not None:
+            if self.loop is not None and not self.loop.is_closed():
+                self.loop.remove_reader(self.ser.fileno())
+            self.ser.close()
+            self.ser = None
+
+    def _onReadable(self):
+        try:
+            data = self.ser.read(self.ser.in_waiting or 1)
+        except (serial.SerialException, OSError) as e:
+            self._fail(e)
+            return
+        if not data:
+            return
+        self.lastRead = time.monotonic()
+        if not self.pending:
+            self.burstStart = time.time()
+        self.pending += data
+        # Restart the idle timer on every byte burst
+        if self._gapHandle is not None:
+            self._gapHandle.cancel()
+        if len(self.pending) >= MAX_BURST_SIZE:
+            self._onGap()
+        else:
+            self._gapHandle = self.loop.call_later(self.gap, self._onGap)
+
+    def _onGap(self):
+        self._gapHandle = None
+        burst = bytes(self.pending)
+        self.pending.clear()
+        if self.capture is not None:
+            self.capture.write(CAPTURE_RX, burst, self.burstStart)
+        for frame in self.reassembler.feedTimed(burst, self.burstStart):
+            self._put(frame)
+
+    def write(self, data):
+        if self.capture is not None:
+            self.capture.write(CAPTURE_TX, data)
+        self.ser.write(data)
+
+    def _put(self, item):
+        try:
+            self.queue.put_nowait(item)
+        except asyncio.QueueFull:
+            self.droppedFrames += 1
+
+    def _fail(self, error):
+        self._error = error
+        self.close()
+        # Wake up the consumer even when the queue is full
+        while self.queue.full():
+            self.queue.get_nowait()
+            self.droppedFrames += 1
+        self.queue.put_nowait(None)
+
+    def __aiter__(self):
+        if self.ser is None:
+            self.open()
+        return self
+
+    async def __anext__(self):
+        item = await self.queue.get()
+        if item is None:
+            if self._error is not None:
+                raise self._error
+            raise StopAsyncIteration
+        return item
+
+async def read_serial(port, baudrate, bus=None, capture=None, poll=None):
+    if bus is None:
+        bus = JkBusMonitor()
+    reader = SerialFrameReader(port, baudrate, bus.reassembler, capture=capture)
+    logging.info(f"Start Reading from the serial port {port} with baudrate {baudrate}")
+    poller = None
+    try:
+        reader.open()
+        if poll:
+            poller = asyncio.create_task(PollMaster(bus, reader, poll, baudrate).run())
+        async for frameType, frame, timestamp in reader:
+            bus.handleFrame(frameType, frame, timestamp)
+    except (serial.SerialException, OSError) as e:
+        logging.error("Serial port error: %s", e)
+    finally:
+        if poller is not None:
+            poller.cancel()
+        reader.close()  # Close the serial port
+    return bus
@@ -0,0 +1,211 @@
+"""
+Virtual RS485 bus of JK-PB packs on a pseudo terminal.
+"""
+import asyncio
+import logging
+import os
+import random
+import time
+import tty
+
+from .protocol import (ADDR_RECORD_TYPES, FRAME_FC16_REQUEST, FRAME_FC16_RESPONSE, FRAME_JK_RECORD,
+                       RECORD_TYPE_ADDRS, FrameReassembler, buildFc16Request, buildFc16Response)
+from .records import buildRecord
+
+class SimulatedPack:
+    def __init__(self, id, cellCount, random):
+        self.id = id
+        self.cellCount = cellCount
+        self.random = random
+        self.soc = random.randint(20, 95)
+        self.cellVol = [random.randint(3250, 3350) for _ in range(cellCount)]
+
+    def config(self):
+        return {'CellCount': self.cellCount, 'DevAddr': self.id, 'VolCellOV': 3650, 'VolCellUV': 2800,
+                'CapBatCell': 280000, 'BatChargeEN': 1, 'BatDisChargeEN': 1, 'BalanEN': 1}
+
+    def state(self):
+        rnd = self.random
+        self.cellVol = [min(3650, max(2800, vol + rnd.randint(-3, 3))) for vol in self.cellVol]
+        current = rnd.randint(-50000, 50000)
+        values = {f"CellVol{cell}": vol for cell, vol in enumerate(self.cellVol)}
+        values.update({
+            'CellSta': (1 << self.cellCount) - 1,
+            'CellVolAve': sum(self.cellVol) // self.cellCount,
+            'CellVdifMax': max(self.cellVol) - min(self.cellVol),
+            'MaxVolCellNbr': self.cellVol.index(max(self.cellVol)),
+            'MinVolCellNbr': self.cellVol.index(min(self.cellVol)),
+            'TempMos': rnd.randint(250, 400),
+            'BatVol': sum(self.cellVol) // 10,
+            'BatWatt': abs(sum(self.cellVol) * current) // 1000000,
+            'BatCurrent': current,
+            'TempBat1': rnd.randint(200, 350),
+            'TempBat2': rnd.randint(200, 350),
+            'BatAlarms': 0 if rnd.random() > 0.01 else 1 << rnd.randrange(24),
+            'SOCStateOfCharge': self.soc,
+            'SOCCapRemain': self.soc * 2800,
+            'SOCFullChargeCap': 280000,
+            'SOCCycleCount': 42,
+            'SOCSOH': 100,
+            'Charge': 1,
+            'DisCharge': 1,
+            'SysRunTicks': int(time.monotonic() * 10),
+        })
+        return values
+
+    def info(self):
+        return {'ManufacturerDeviceID': f"BK_BMS{self.id:02d}", 'HardwareVersion': '15A',
+                'SoftwareVersion': '15.24', 'ODDRunTime': 1000, 'PWROnTimes': 7}
+
+class BusSimulator:
+    """
+    Stand-in for a bank of JK-PB BMS units on a pseudo-terminal.
+
+    Acts as the master (id 0) and the slaves 1..packs: every cycle the master
+    sends its own state record and polls each slave with an FC16 write, the
+    slave answers with the requested 55aaeb90 record followed by the FC16
+    response. Config and info records are polled every infoEvery cycles.
+    With respond set there is no master, the slaves only answer the FC16
+    requests written to the pty, like a bank polled by the monitor.
+    Frames can be split over several writes, merged with the next frame and
+    randomly corrupted. Point the monitor at simulator.path.
+    """
+    def __init__(self, packs=4, rate=1.0, cellCount=16, corruption=0.0, splitWrites=True,
+                 mergeWrites=True, infoEvery=30, seed=None, respond=False):
+        self.random = random.Random(seed)
+        self.packs = [SimulatedPack(id, cellCount, self.random) for id in range(0, packs + 1)]
+        self.rate = rate
+        self.corruption = corruption
+        self.splitWrites = splitWrites
+        self.mergeWrites = mergeWrites
+        self.infoEvery = infoEvery
+        self.respond = respond
+        self.requests = FrameReassembler()
+        self.master = None
+        self.slave = None
+        self.path = None
+        self.cycles = 0
+        self.sent = {FRAME_FC16_REQUEST: 0, FRAME_FC16_RESPONSE: 0, FRAME_JK_RECORD: 0}
+        self.corrupted = dict.fromkeys(self.sent, 0)
+        self.pending = bytearray()
+        # Bytes the pty did not take yet, written when it is writable again
+        self.outgoing = bytearray()
+        self.drained = asyncio.Event()
+        self.drained.set()
+
+    def open(self):
+        self.master, self.slave = os.openpty()
+        tty.setraw(self.slave)
+        self.path = os.ttyname(self.slave)
+        os.set_blocking(self.master, False)
+        # Drain whatever the monitor writes so the pty never fills up
+        asyncio.get_running_loop().add_reader(self.master, self._drain)
+        logging.info(f"Simulating {len(self.packs) - 1} slave packs on {self.path}")
+        return self.path
+
+    def close(self):
+        if self.master is not None:
+            loop = asyncio.get_running_loop()
+            loop.remove_reader(self.master)
+            loop.remove_writer(self.master)
+            os.close(self.master)
+            os.close(self.slave)
+            self.master = self.slave = None
+
+    def _drain(self):
+        try:
+            data = os.read(self.master, 4096)
+        except OSError:
+            return
+        if not self.respond:
+            return
+        # Answer requests for existing slaves, other ids stay silent like an absent pack
+        for frameType, frame in self.requests.feed(data):
+            id, writeAddr = frame[0], (frame[2] << 8) | frame[3]
+            if frameType != FRAME_FC16_REQUEST or not 0 < id < len(self.packs) or writeAddr not in ADDR_RECORD_TYPES:
+                continue
+            self.sent[FRAME_FC16_REQUEST] += 1
+            for frameType, frame in self.answer(self.packs[id], ADDR_RECORD_TYPES[writeAddr]):
+                self._frame(frameType, frame)
+        if self.pending:
+            self._write(bytes(self.pending))
+            self.pending.clear()
+
+    def answer(self, pack, recordType):
+        values = {1: pack.config, 2: pack.state, 3: pack.info}[recordType]()
+        yield FRAME_JK_RECORD, buildRecord(recordType, 1, values)
+        yield FRAME_FC16_RESPONSE, buildFc16Response(pack.id, RECORD_TYPE_ADDRS[recordType])
+
+    def _frame(self, frameType, frame):
+        self.sent[frameType] += 1
+        if self.corruption and self.random.random() < self.corruption:
+            frame = bytearray(frame)
+            frame[self.random.randrange(len(frame))] ^= 1 << self.random.randrange(8)
+            self.corrupted[frameType] += 1
+        self.pending += frame
+        # Merge a frame into the next write now and then, like a busy USB adapter
+        if self.mergeWrites and self.random.random() < 0.3:
+            return
+        self._write(bytes(self.pending))
+        self.pending.clear()
+
+    def _write(self, data):
+        # Never blocks, what the pty cannot take now waits for the event loop to report it writable
+        self.outgoing += data
+        if self.drained.is_set():
+            self._flush()
+
+    def _flush(self):
+        outgoing = self.outgoing
+        while outgoing:
+            size = len(outgoing)
+            if self.splitWrites:
+                size = self.random.randint(1, min(size, 128))
+            try:
+                written = os.write(self.master, outgoing[:size])
+            except BlockingIOError:
+                if self.drained.is_set():
+                    self.drained.clear()
+                    asyncio.get_running_loop().add_writer(self.master, self._flush)
+                return
+            del outgoing[:written]
+        if not self.drained.is_set():
+            asyncio.get_running_loop().remove_writer(self.master)
+            self.drained.set()
+
+    def cycleFrames(self):
+        # Frames for one polling cycle of the whole bus
+        master = self.packs[0]
+        yield FRAME_JK_RECORD, buildRecord(2, 0, master.state())
+        for pack in self.packs[1:]:
+            recordTypes = [2]
+            if self.cycles % self.infoEvery == 0:
+                recordTypes = [1, 3, 2]
+            for recordType in recordTypes:
+                yield FRAME_FC16_REQUEST, buildFc16Request(pack.id, RECORD_TYPE_ADDRS[recordType])
+                yield from self.answer(pack, recordType)
+
+    async def run(self, duration=None):
+        start = time.monotonic()
+        try:
+            if self.respond:
+                # The slaves answer from the pty reader
+                if duration is None:
+                    await asyncio.Event().wait()
+                await asyncio.sleep(duration)
+                return
+            while duration is None or time.monotonic() - start < duration:
+                cycleStart = time.monotonic()
+                for frameType, frame in self.cycleFrames():
+                    self._frame(frameType, frame)
+                    await asyncio.sleep(0)
+                    # A slow reader holds the cycle up instead of the queued bytes piling up
+                    await self.drained.wait()
+                if self.pending:
+                    self._write(bytes(self.pending))
+                    self.pending.clear()
+                self.cycles += 1
+                if self.rate:
+                    await asyncio.sleep(max(0, 1 / self.rate - (time.monotonic() - cycleStart)))
+        finally:
+            logging.info(f"Simulator sent {self.sent} in {self.cycles} cycles, {self.corrupted} corrupted")
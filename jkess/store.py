@@ -0,0 +1,133 @@
+"""
+Compact per pack state store with lock free snapshots.
+"""
+import struct
+import time
+from operator import itemgetter
+
+from .records import RECORD_LAYOUTS
+
+_MISSING = object()
+
+RECORD_KINDS = {1: 'config', 2: 'state', 3: 'info'}
+
+class StoreFields:
+    """
+    Field ids of one record kind in the state store.
+
+    Every numeric struct item of the layout (fields and raw bit words) gets a
+    slot in a float64 buffer, in struct order, so a record is stored straight
+    from its unpacked tuple. Bit names resolve to (word slot, shift) and the
+    strings are kept apart.
+    """
+    def __init__(self, layout):
+        self.layout = layout
+        numeric = [index for index, isString in enumerate(layout.itemIsString) if not isString]
+        self.names = tuple(layout.itemNames[index] for index in numeric)
+        self.index = {name: slot for slot, name in enumerate(self.names)}
+        self.bits = {}
+        for wordName, _, _, names in layout.bitFields:
+            for bit, name in enumerate(names):
+                if name is not None:
+                    # Same bit numbering as the decoder: byte by byte, MSB first
+                    self.bits[name] = (self.index[wordName], 8 * (bit // 8) + 7 - bit % 8)
+        self.stringNames = tuple(name for name, _ in layout.strings)
+        self.getNumeric = itemgetter(*numeric)
+        self.getStrings = itemgetter(*(index for _, index in layout.strings)) if layout.strings else None
+        self.packer = struct.Struct(f"<{len(self.names)}d")
+
+STORE_FIELDS = {recordType: StoreFields(RECORD_LAYOUTS[recordType]) for recordType in RECORD_KINDS}
+
+class PackSnapshot:
+    """
+    Immutable view of one record kind of one pack.
+
+    values is a read only float64 memoryview over bytes owned by the snapshot,
+    so readers in any thread can keep it as long as they like.
+    """
+    __slots__ = ('packId', 'kind', 'version', 'timestamp', 'fields', 'values', 'strings')
+
+    def __init__(self, packId, kind, version, timestamp, fields, data, strings):
+        self.packId = packId
+        self.kind = kind
+        self.version = version
+        self.timestamp = timestamp
+        self.fields = fields
+        self.values = memoryview(data).cast('d')
+        self.strings = strings
+
+    def get(self, name, default=None):
+        slot = self.fields.index.get(name)
+        if slot is not None:
+            value = self.values[slot]
+            return int(value) if value.is_integer() else value
+        bit = self.fields.bits.get(name)
+        if bit is not None:
+            return (int(self.values[bit[0]]) >> bit[1]) & 1
+        if name in self.fields.stringNames:
+            return self.strings[self.fields.stringNames.index(name)]
+        return default
+
+    def __getitem__(self, name):
+        value = self.get(name, _MISSING)
+        if value is _MISSING:
+            raise KeyError(name)
+        return value
+
+    def asDict(self):
+        # Same keys as getConfig/getState/getInfo
+        layout = self.fields.layout
+        return {name: self.get(name) for name in layout.fieldNames + layout.bitNames + self.fields.stringNames}
+
+class PackSlot:
+    __slots__ = ('buffers', 'snapshots', 'versions')
+
+    def __init__(self):
+        self.buffers = {recordType: bytearray(fields.packer.size) for recordType, fields in STORE_FIELDS.items()}
+        self.snapshots = dict.fromkeys(RECORD_KINDS.values())
+        self.versions = dict.fromkeys(RECORD_KINDS.values(), 0)
+
+class PackStateStore:
+    """
+    Fixed slot per pack holding the latest config, state and info records.
+
+    update() writes the unpacked record into the slot buffer in place and then
+    publishes a new PackSnapshot by replacing a single reference, which is
+    atomic, so readers never lock and never see a half written record. A pack
+    costs a few buffers and one bytes object per kind, not a dict of boxed
+    values, so memory and GC pressure stay flat as packs are added.
+    """
+    def __init__(self):
+        self.slots = {}
+        self.version = 0
+
+    def update(self, packId, recordType, data, timestamp=None):
+        fields = STORE_FIELDS.get(recordType)
+        if fields is None:
+            return None
+        slot = self.slots.get(packId)
+        if slot is None:
+            slot = self.slots[packId] = PackSlot()
+        values = fields.layout.unpack(data)
+        buffer = slot.buffers[recordType]
+        fields.packer.pack_into(buffer, 0, *fields.getNumeric(values))
+        strings = ()
+        if fields.getStrings is not None:
+            strings = fields.getStrings(values)
+            strings = tuple(value.split(b'\x00', 1)[0].decode('ascii', errors='replace')
+                            for value in (strings if isinstance(strings, tuple) else (strings,)))
+        kind = RECORD_KINDS[recordType]
+        version = slot.versions[kind] + 1
+        slot.versions[kind] = version
+        snapshot = PackSnapshot(packId, kind, version, time.time() if timestamp is None else timestamp,
+                                fields, bytes(buffer), strings)
+        slot.snapshots[kind] = snapshot
+        self.version += 1
+        return snapshot
+
+    def snapshot(self, packId, kind='state'):
+        slot = self.slots.get(packId)
+        return slot.snapshots[kind] if slot is not None else None
+
+    def packs(self):
+        return list(self.slots)
@@ -0,0 +1,62 @@
+from jkess.alarms import ALARM_CLEAR, ALARM_RAISE, AlarmEngine
+from jkess.monitor import JkBusMonitor
+from jkess.records import STATE_ALARM_NAMES, bitShift, buildRecord
+
+def stateRecord(*alarms):
+    return buildRecord(2, 1, {'BatAlarms': sum(1 << bitShift(STATE_ALARM_NAMES.index(name)) for name in alarms)})
+
+def alarmEngine(**delays):
+    engine = AlarmEngine(**delays)
+    events = []
+    engine.addListener(lambda event: events.append((event['name'], event['state'], event['timestamp'])))
+    return engine, events
+
+def testXorEdges():
+    engine, events = alarmEngine()
+    engine.update(1, 2, stateRecord('AlarmMosOTP'), 0.0)
+    engine.update(1, 2, stateRecord('AlarmMosOTP', 'AlarmCellOVP'), 1.0)
+    engine.update(1, 2, stateRecord('AlarmCellOVP'), 2.0)
+    engine.update(1, 2, stateRecord('AlarmCellOVP'), 3.0)
+    assert events == [('AlarmMosOTP', ALARM_RAISE, 0.0), ('AlarmCellOVP', ALARM_RAISE, 1.0),
+                      ('AlarmMosOTP', ALARM_CLEAR, 2.0)]
+    assert engine.active(1) == ['AlarmCellOVP']
+
+def testRaiseDelay():
+    engine, events = alarmEngine(raiseDelay=5.0)
+    engine.update(1, 2, stateRecord(), 0.0)
+    for timestamp in (10.0, 12.0, 14.9):
+        engine.update(1, 2, stateRecord('AlarmCellOVP'), timestamp)
+    assert events == []
+    engine.update(1, 2, stateRecord('AlarmCellOVP'), 15.0)
+    assert events == [('AlarmCellOVP', ALARM_RAISE, 15.0)]
+
+def testClearHoldOff():
+    engine, events = alarmEngine(clearDelay=30.0)
+    engine.update(1, 2, stateRecord('AlarmCellOVP'), 0.0)
+    for timestamp in (10.0, 39.9):
+        engine.update(1, 2, stateRecord(), timestamp)
+    assert events == [('AlarmCellOVP', ALARM_RAISE, 0.0)]
+    engine.update(1, 2, stateRecord(), 40.0)
+    assert events[1:] == [('AlarmCellOVP', ALARM_CLEAR, 40.0)]
+
+def testToggleShorterThanDelay():
+    engine, events = alarmEngine(raiseDelay=5.0)
+    engine.update(1, 2, stateRecord(), 0.0)
+    engine.update(1, 2, stateRecord('AlarmCellOVP'), 1.0)
+    engine.update(1, 2, stateRecord(), 3.0)
+    # The delay starts over when the bit comes back
+    engine.update(1, 2, stateRecord('AlarmCellOVP'), 10.0)
+    engine.update(1, 2, stateRecord('AlarmCellOVP'), 14.0)
+    assert events == []
+    engine.update(1, 2, stateRecord('AlarmCellOVP'), 15.0)
+    assert events == [('AlarmCellOVP', ALARM_RAISE, 15.0)]
+
+def testReplayKeepsCaptureTimeline():
+    # Records fed back to back still debounce on the times they were captured at
+    engine, events = alarmEngine(raiseDelay=5.0)
+    bus = JkBusMonitor()
+    bus.addRecordListener(engine.update)
+    for timestamp, alarms in ((1000.0, ()), (1002.0, ('AlarmCellOVP',)), (1006.0, ('AlarmCellOVP',)),
+                              (1007.0, ('AlarmCellOVP',))):
+        bus.feed(stateRecord(*alarms), timestamp)
+    assert events == [('AlarmCellOVP', ALARM_RAISE, 1007.0)]
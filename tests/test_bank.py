@@ -0,0 +1,27 @@
+from jkess.bank import BankAggregator
+
+def packState(current, watt, cells, temp):
+    values = {'BatCurrent': current, 'BatWatt': watt, 'SOCCapRemain': 50000, 'SOCFullChargeCap': 100000, 'TempMos': temp}
+    values.update({f"CellVol{cell}": voltage for cell, voltage in enumerate(cells)})
+    return values
+
+def testMixedChargeAndStalePack():
+    bank = BankAggregator()
+    bank.update(2, 'state', packState(-25000, 1300, (3200, 3350), 310))
+    bank.update(1, 'state', packState(10000, 530, (3300, 3310), 250))
+    bank.update(3, 'state', packState(-5000, 260, (3250, 3260), 280))
+    summary = bank.summary
+    assert (summary['current'], summary['power'], summary['packs']) == (-20000, -1030, 3)
+    assert (summary['cellMinPack'], summary['cellMaxPack'], summary['tempMaxPack']) == (2, 2, 2)
+    # Pack 2, the least recently seen, goes silent
+    bank.lastSeen[2] -= bank.staleTimeout
+    assert bank.expire()
+    summary = bank.build()
+    assert (summary['current'], summary['power'], summary['packs']) == (5000, 270, 2)
+    assert (summary['cellMin'], summary['cellMinPack']) == (3250, 3)
+    assert (summary['cellMax'], summary['cellMaxPack']) == (3310, 1)
+    assert (summary['tempMax'], summary['tempMaxPack']) == (280, 3)
+    assert len(bank.cellMin) == len(bank.cellMax) == len(bank.tempMax) == 2
+    # Its next record turns a discharging pack into a charging one
+    bank.update(3, 'state', packState(5000, 260, (3250, 3260), 280))
+    assert (bank.summary['current'], bank.summary['power']) == (15000, 790)
@@ -0,0 +1,33 @@
+import pytest
+
+from jkess.batch import BATCH_CELL_GROUPS, decodeBatch
+from jkess.records import STATE_LAYOUT, buildRecord, getState
+
+np = pytest.importorskip('numpy')
+
+def testDecodeBatchMatchesGetState():
+    states = [buildRecord(2, 1, {'SOCStateOfCharge': soc, 'BatCurrent': 1000 - 100 * soc, 'CellVol5': 3200 + soc,
+                                 'TempMos': 250 - soc, 'BatAlarms': soc})
+              for soc in range(20)]
+    bad = bytearray(states[7])
+    bad[50] ^= 0x01
+    records = states[:7] + [bytes(bad)] + states[8:] + [buildRecord(1, 1, {'CellCount': 16})]
+    result = decodeBatch(b''.join(records))
+    assert result['valid'].tolist() == [index != 7 for index in range(len(records))]
+    assert result['recordType'].tolist() == [2] * 20 + [1]
+    assert result['config']['CellCount'].tolist() == [16]
+    state = result['state']
+    expected = [getState(record) for index, record in enumerate(states) if index != 7]
+    assert len(state['SOCStateOfCharge']) == len(expected)
+    for name, _, _ in STATE_LAYOUT.fields:
+        prefix = name.rstrip('0123456789')
+        if prefix in BATCH_CELL_GROUPS:
+            column = state[prefix][:, int(name[len(prefix):])]
+        else:
+            column = state[name]
+        assert column.tolist() == [values[name] for values in expected], name
+    assert state['BatAlarms'].tolist() == [soc for soc in range(20) if soc != 7]
+
+def testDecodeBatchRejectsPartialRecords():
+    with pytest.raises(ValueError):
+        decodeBatch(buildRecord(2, 1, {})[:299])
@@ -0,0 +1,90 @@
+import asyncio
+import os
+
+import pytest
+
+from jkess.capture import (CAPTURE_INDEX, CAPTURE_JK_RECORD, CAPTURE_MAGIC, CAPTURE_RX, CAPTURE_TX, CaptureReader,
+                           CaptureWriter, replayCapture)
+from jkess.monitor import JkBusMonitor
+from jkess.protocol import FRAME_JK_RECORD, REQUEST_STATE_ADDR, buildFc16Request, buildFc16Response
+from jkess.records import buildRecord
+
+def writeCapture(path, count=1000):
+    # Records every half second from t=100, of every tag and length
+    written = []
+    writer = CaptureWriter(str(path))
+    for index in range(count):
+        tag = (CAPTURE_RX, CAPTURE_TX, CAPTURE_JK_RECORD)[index % 3]
+        data = bytes([index & 0xff]) * (index % 300)
+        writer.write(tag, data, 100.0 + index * 0.5)
+        written.append((100.0 + index * 0.5, tag, data))
+    writer.close()
+    return written
+
+def readAll(reader, start=None):
+    return [(timestamp, tag, bytes(data)) for timestamp, tag, data in reader.records(start)]
+
+def testRoundTripAndSeek(tmp_path):
+    path = tmp_path / 'bus.jkcap'
+    written = writeCapture(path)
+    reader = CaptureReader(str(path))
+    try:
+        assert readAll(reader) == written
+        # One index entry every 256 records
+        assert [offset for _, offset in reader.index][0] == len(CAPTURE_MAGIC)
+        assert [timestamp for timestamp, _ in reader.index] == [100.0, 228.0, 356.0, 484.0]
+        assert reader.seek(50.0) == len(CAPTURE_MAGIC)
+        assert reader.seek(300.0) == reader.index[1][1]
+        assert readAll(reader, 300.0) == [record for record in written if record[0] >= 300.0]
+        assert readAll(reader, 1000.0) == []
+    finally:
+        reader.close()
+
+def testCaptureCutOffMidRecord(tmp_path):
+    path = tmp_path / 'bus.jkcap'
+    written = writeCapture(path, 300)
+    # A capture still being written, the last record and index entry are only partly there
+    os.truncate(path, os.path.getsize(path) - 5)
+    with open(f"{path}.idx", 'ab') as index:
+        index.write(CAPTURE_INDEX.pack(500.0, 0)[:7])
+    reader = CaptureReader(str(path))
+    try:
+        assert readAll(reader) == written[:-1]
+        assert len(reader.index) == 2
+    finally:
+        reader.close()
+
+def testAppendKeepsOneMagic(tmp_path):
+    path = tmp_path / 'bus.jkcap'
+    writer = CaptureWriter(str(path))
+    writer.write(CAPTURE_RX, b'\x01', 1.0)
+    writer.close()
+    writer = CaptureWriter(str(path))
+    writer.write(CAPTURE_RX, b'\x02', 2.0)
+    writer.close()
+    reader = CaptureReader(str(path))
+    try:
+        assert readAll(reader) == [(1.0, CAPTURE_RX, b'\x01'), (2.0, CAPTURE_RX, b'\x02')]
+    finally:
+        reader.close()
+
+def testNotACapture(tmp_path):
+    path = tmp_path / 'other.bin'
+    path.write_bytes(b'not a capture file')
+    with pytest.raises(ValueError):
+        CaptureReader(str(path))
+
+def testReplayFeedsTheBus(tmp_path):
+    path = tmp_path / 'bus.jkcap'
+    writer = CaptureWriter(str(path))
+    for id in range(1, 4):
+        writer.write(CAPTURE_RX, buildFc16Request(id, REQUEST_STATE_ADDR), id * 1.0)
+        writer.writeFrame(FRAME_JK_RECORD, buildRecord(2, 1, {'SOCStateOfCharge': id}), id + 0.25)
+        writer.write(CAPTURE_RX, buildFc16Response(id, REQUEST_STATE_ADDR), id + 0.3)
+    writer.close()
+    bus = JkBusMonitor()
+    socs = {}
+    bus.addListener(lambda id, kind, values: socs.__setitem__(id, values['SOCStateOfCharge']))
+    assert asyncio.run(replayCapture(str(path), bus)) == 9
+    assert socs == {1: 1, 2: 2, 3: 3}
+    assert bus.correlator.report()[2]['last'] == pytest.approx(0.25)
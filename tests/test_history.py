@@ -0,0 +1,42 @@
+from jkess.history import TelemetryHistory, TelemetryRing
+
+def testRingWrapAround():
+    ring = TelemetryRing(4, 2)
+    for index in range(6):
+        ring.append(float(index), (index, -index))
+    segments = ring.segments()
+    assert [len(times) for times, _ in segments] == [2, 2]
+    assert [timestamp for times, _ in segments for timestamp in times] == [2.0, 3.0, 4.0, 5.0]
+    assert [rows[row, 0] for _, rows in segments for row in range(len(rows))] == [2.0, 3.0, 4.0, 5.0]
+    assert [timestamp for times, _ in ring.segments(last=3) for timestamp in times] == [3.0, 4.0, 5.0]
+    assert [timestamp for times, _ in ring.segments(since=3.5) for timestamp in times] == [4.0, 5.0]
+
+def testSegmentsAreViews():
+    ring = TelemetryRing(4, 1)
+    for index in range(3):
+        ring.append(float(index), (index,))
+    (times, rows), = ring.segments()
+    assert isinstance(times, memoryview) and isinstance(rows, memoryview)
+    assert rows.obj is ring.data and times.obj is ring.times
+    # The ring wraps over the oldest row, the view shows the new value
+    ring.append(3.0, (3,))
+    ring.append(4.0, (40,))
+    assert (times[0], rows[0, 0]) == (4.0, 40.0)
+
+def testBucketRollover():
+    history = TelemetryHistory(series=('BatCurrent',), rawCapacity=16, resolutions=((10, 8), (60, 8), (900, 8)))
+    # Two samples every 10 seconds for 30 minutes
+    for second in range(0, 1800, 5):
+        history.add(float(second), {'BatCurrent': second % 60})
+    assert history.raw.count == 16
+    tens = history.column('BatCurrent', 10, statistic='max')
+    assert tens[-1] == (1780.0, 45.0)
+    assert history.aggregates[10].current() == (1790, [50.0], [55.0], [52.5])
+    assert history.aggregates[60].ring.count == 8
+    # Closed minutes hold min 0, max 55 and mean 27.5 of their 12 samples
+    assert history.column('BatCurrent', 60, statistic='min')[-1] == (1680.0, 0.0)
+    assert history.column('BatCurrent', 60, statistic='max')[-1] == (1680.0, 55.0)
+    assert history.column('BatCurrent', 60)[-1] == (1680.0, 27.5)
+    # The first quarter closed when its last minute rolled into the next quarter
+    assert history.column('BatCurrent', 900) == [(0.0, 27.5)]
+    assert history.aggregates[900].current()[0] == 900
@@ -0,0 +1,53 @@
+import json
+import urllib.error
+import urllib.request
+
+import pytest
+
+from jkess.history import HistoryStore
+from jkess.httpd import MetricsCache, startHttpServer
+from jkess.mqtt import MqttOutput
+from jkess.store import PackStateStore
+
+class Client:
+    on_connect = on_disconnect = on_publish = None
+
+def testOutputMetrics():
+    output = MqttOutput(Client())
+    output.published, output.totalLatency, output.lastLatency, output.maxLatency = 4, 0.2, 0.05, 0.1
+    body = MetricsCache(PackStateStore(), outputs={'mqtt': output}).outputMetrics().decode()
+    assert 'jkess_output_published_total{output="mqtt"} 4\n' in body
+    assert 'jkess_output_queueDepth{output="mqtt"} 0\n' in body
+    assert 'jkess_output_publish_latency_seconds_sum{output="mqtt"} 0.2\n' in body
+    assert 'jkess_output_publish_latency_max_seconds{output="mqtt"} 0.1\n' in body
+
+def testLiveRejectsBadInterval():
+    server = startHttpServer(PackStateStore(), 0, '127.0.0.1')
+    try:
+        for interval in ('-1', 'nan', 'inf', 'fast'):
+            with pytest.raises(urllib.error.HTTPError) as error:
+                urllib.request.urlopen(f"http://127.0.0.1:{server.server_address[1]}/live?interval={interval}", timeout=5)
+            assert error.value.code == 400
+        assert server.live.clients == 0
+    finally:
+        server.shutdown()
+        server.server_close()
+
+def testHistoryEndpoint():
+    history = HistoryStore(series=('BatCurrent', 'TempMos'), resolutions=((10, 4),))
+    for second in range(25):
+        history.update(1, 'state', {'BatCurrent': second, 'TempMos': 250}, float(second))
+    server = startHttpServer(PackStateStore(), 0, '127.0.0.1', history=history)
+    url = f"http://127.0.0.1:{server.server_address[1]}/history"
+    try:
+        with urllib.request.urlopen(f"{url}/1?series=BatCurrent&resolution=10&statistic=max", timeout=5) as response:
+            assert json.load(response) == {'BatCurrent': [[0.0, 9.0], [10.0, 19.0]]}
+        with urllib.request.urlopen(f"{url}/1?last=2", timeout=5) as response:
+            assert json.load(response) == {'BatCurrent': [[23.0, 23.0], [24.0, 24.0]], 'TempMos': [[23.0, 250.0], [24.0, 250.0]]}
+        for query, code in (('2', 404), ('1?resolution=60', 400), ('1?series=Nope', 400)):
+            with pytest.raises(urllib.error.HTTPError) as error:
+                urllib.request.urlopen(f"{url}/{query}", timeout=5)
+            assert error.value.code == code
+    finally:
+        server.shutdown()
+        server.server_close()
@@ -0,0 +1,34 @@
+import json
+
+from jkess.live import LiveFanout
+
+def streamOnce(fanout, **options):
+    # The events of the first write, the viewer is gone after it
+    writes = []
+
+    def write(data):
+        writes.append(data)
+        raise OSError('viewer gone')
+    assert fanout.admit()
+    fanout.stream(write, **options)
+    assert fanout.clients == 0
+    return [json.loads(line[len('data: '):]) for line in writes[0].decode().splitlines() if line.startswith('data: ')]
+
+def testLatestValuePerPackAndKind():
+    fanout = LiveFanout()
+    for soc in (10, 20, 30):
+        fanout.update(1, 'state', {'SOCStateOfCharge': soc})
+    fanout.update(2, 'state', {'SOCStateOfCharge': 50})
+    fanout.update(1, 'info', {'ManufacturerDeviceID': 'JK'})
+    events = streamOnce(fanout)
+    assert sorted((event['pack'], event['kind'], event['values']) for event in events if event['kind'] == 'state') \
+        == [(1, 'state', {'SOCStateOfCharge': 30}), (2, 'state', {'SOCStateOfCharge': 50})]
+    assert len(events) == 3
+    assert [event['pack'] for event in streamOnce(fanout, packs={2}, kinds={'state'})] == [2]
+
+def testFieldSelection():
+    fanout = LiveFanout()
+    fanout.update(1, 'state', {'CellVol0': 3300, 'CellVol12': 3310, 'CellVolAve': 3305, 'BatVol': 52800})
+    fanout.update(1, 'info', {'ManufacturerDeviceID': 'JK'})
+    events = streamOnce(fanout, fields=frozenset(('CellVol', 'BatVol')))
+    assert [event['values'] for event in events] == [{'CellVol0': 3300, 'CellVol12': 3310, 'BatVol': 52800}]
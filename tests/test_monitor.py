@@ -0,0 +1,66 @@
+from jkess.monitor import JkBusMonitor, RequestCorrelator
+from jkess.protocol import REQUEST_STATE_ADDR, buildFc16Request, buildFc16Response
+from jkess.records import buildRecord
+
+def stateFrames(id, soc, record=True, responseFirst=False):
+    frames = [buildFc16Request(id, REQUEST_STATE_ADDR)]
+    answer = [buildRecord(2, 1, {'SOCStateOfCharge': soc})] if record else []
+    answer.append(buildFc16Response(id, REQUEST_STATE_ADDR))
+    return frames + (answer[::-1] if responseFirst else answer)
+
+def decodedSoc(frames):
+    bus = JkBusMonitor()
+    socs = {}
+    bus.addListener(lambda id, kind, values: socs.__setitem__(id, values['SOCStateOfCharge']))
+    for frame in frames:
+        bus.feed(frame)
+    return socs
+
+def testLostRecordKeepsLaterPacks():
+    frames = []
+    for id in range(1, 5):
+        frames += stateFrames(id, 10 * id, record=id != 2)
+    assert decodedSoc(frames) == {1: 10, 3: 30, 4: 40}
+
+def testRecordAfterResponse():
+    frames = []
+    for id in range(1, 4):
+        frames += stateFrames(id, 10 * id, responseFirst=True)
+    assert decodedSoc(frames) == {1: 10, 2: 20, 3: 30}
+
+def testRecordGoesToLatestRequest():
+    correlator = RequestCorrelator()
+    correlator.request(4, REQUEST_STATE_ADDR, 0.0)
+    correlator.request(6, REQUEST_STATE_ADDR, 0.55)
+    assert correlator.record(2, 0.56) == 6
+    assert correlator.record(2, 0.57) == 4
+    assert correlator.record(2, 0.58) is None
+
+def testCancelCountsTimeout():
+    correlator = RequestCorrelator()
+    correlator.request(4, REQUEST_STATE_ADDR, 0.0)
+    correlator.cancel(4, REQUEST_STATE_ADDR)
+    assert correlator.record(2, 0.1) is None
+    assert correlator.report()[4]['timeouts'] == 1
+
+def testLatencyFromArrivalTimes():
+    bus = JkBusMonitor()
+    record1, record2 = buildRecord(2, 1, {'SOCStateOfCharge': 10}), buildRecord(2, 1, {'SOCStateOfCharge': 20})
+    # Handed on long after they arrived, split and merged like serial reads
+    chunks = [(buildFc16Request(1, REQUEST_STATE_ADDR), 100.0),
+              (buildFc16Response(1, REQUEST_STATE_ADDR) + record1[:100], 100.02),
+              (record1[100:], 100.03),
+              (buildFc16Request(2, REQUEST_STATE_ADDR), 100.2),
+              (record2 + buildFc16Response(2, REQUEST_STATE_ADDR), 100.35)]
+    for data, timestamp in chunks:
+        bus.feed(data, timestamp)
+    report = bus.correlator.report()
+    assert abs(report[1]['last'] - 0.02) < 1e-9 and abs(report[2]['last'] - 0.15) < 1e-9
+    assert report[1]['responses'] == report[2]['responses'] == 1
+    assert report[1]['timeouts'] == report[2]['timeouts'] == 0
+
+def testInfoCountersDoNotDefeatMemo():
+    bus = JkBusMonitor()
+    assert not bus.unchanged(1, 3, buildRecord(3, 1, {'ODDRunTime': 100, 'PWROnTimes': 5}))
+    assert bus.unchanged(1, 3, buildRecord(3, 1, {'ODDRunTime': 101, 'PWROnTimes': 6}))
+    assert not bus.unchanged(1, 3, buildRecord(3, 1, {'ODDRunTime': 101, 'PWROnTimes': 6, 'ManufacturerDeviceID': 'other'}))
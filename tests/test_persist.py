@@ -0,0 +1,31 @@
+import os
+import sqlite3
+import time
+
+from jkess.persist import SqliteSink
+from jkess.records import buildRecord, getState
+
+def state(**values):
+    return getState(buildRecord(2, 1, values))
+
+def testWriterSurvivesErrors(tmp_path):
+    # The database directory is missing at first, so opening it fails until it appears
+    path = str(tmp_path / 'missing' / 'jkess.db')
+    now = time.time()
+    sink = SqliteSink(path, flushInterval=0.02).start()
+    try:
+        sink.update(1, 'state', state(BatVol=53000, CellVol0=3300), timestamp=now)
+        deadline = time.monotonic() + 2
+        while not sink.errors and time.monotonic() < deadline:
+            time.sleep(0.01)
+        assert sink.errors and sink.thread.is_alive()
+        os.mkdir(tmp_path / 'missing')
+        sink.update(1, 'state', state(BatVol=53010, CellVol0=3301), timestamp=now + 1)
+        deadline = time.monotonic() + 5
+        while sink.written < 2 and time.monotonic() < deadline:
+            time.sleep(0.01)
+    finally:
+        sink.stop()
+    assert sink.written == 2
+    with sqlite3.connect(path) as connection:
+        assert connection.execute("SELECT vol FROM samples ORDER BY ts").fetchall() == [(53000,), (53010,)]
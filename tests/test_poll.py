@@ -0,0 +1,33 @@
+import asyncio
+
+from jkess.monitor import JkBusMonitor
+from jkess.poll import PollMaster
+from jkess.protocol import REQUEST_STATE_ADDR, buildFc16Response
+from jkess.records import buildRecord
+
+class Writer:
+    lastRead = 0.0
+
+    def __init__(self):
+        self.written = []
+
+    def write(self, frame):
+        self.written.append(frame)
+
+def testTimeoutRetiresRequest():
+    async def run():
+        bus = JkBusMonitor()
+        poller = PollMaster(bus, Writer(), [4, 6], 115200, timeout=0.05)
+        bus.poller = poller
+        assert not await poller.transact(4, 2)
+        assert not bus.correlator.pending
+        # Pack 6 answers the next poll, it must not be credited to the silent pack 4
+        loop = asyncio.get_running_loop()
+        loop.call_later(0.01, bus.feed, buildRecord(2, 1, {'SOCStateOfCharge': 60}))
+        loop.call_later(0.02, bus.feed, buildFc16Response(6, REQUEST_STATE_ADDR))
+        assert await poller.transact(6, 2)
+        return bus
+    bus = asyncio.run(run())
+    report = bus.correlator.report()
+    assert report[4]['timeouts'] == 1
+    assert report[6]['count'] == 1 and report[6]['timeouts'] == 0
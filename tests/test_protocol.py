@@ -0,0 +1,95 @@
+import random
+
+from jkess.instrumentation import (METRIC_CHECKSUM_FAILURES, METRIC_CRC_FAILURES, METRIC_FRAGMENT_ABORTS,
+                                   METRIC_UNKNOWN_PACKETS, IngestMetrics)
+from jkess.protocol import (FC16_CRC_FAILED, FRAME_FC16_REQUEST, FRAME_FC16_RESPONSE, FRAME_JK_RECORD,
+                            REQUEST_INFO_ADDR, REQUEST_STATE_ADDR, FrameReassembler, buildFc16Request,
+                            buildFc16Response)
+from jkess.records import buildRecord
+
+def busFrames(packs=4):
+    frames = [(FRAME_JK_RECORD, buildRecord(2, 0, {'SOCStateOfCharge': 99}))]
+    for id in range(1, packs + 1):
+        frames.append((FRAME_FC16_REQUEST, buildFc16Request(id, REQUEST_STATE_ADDR)))
+        frames.append((FRAME_JK_RECORD, buildRecord(2, 1, {'SOCStateOfCharge': id})))
+        frames.append((FRAME_FC16_RESPONSE, buildFc16Response(id, REQUEST_STATE_ADDR)))
+    return frames
+
+def reassembler():
+    metrics = IngestMetrics()
+    return FrameReassembler(metrics=metrics), metrics
+
+def testSplitAndMergedChunks():
+    frames = busFrames()
+    stream = b''.join(frame for _, frame in frames)
+    randomizer = random.Random(1)
+    for _ in range(20):
+        frameReassembler = FrameReassembler()
+        chunks = []
+        pos = 0
+        while pos < len(stream):
+            size = randomizer.randint(1, 700)
+            chunks.append(stream[pos:pos + size])
+            pos += size
+        assert list(frameReassembler.frames(chunks)) == frames
+        assert frameReassembler.skippedBytes == 0
+    # Every byte on its own
+    assert list(FrameReassembler().frames(stream[pos:pos + 1] for pos in range(len(stream)))) == frames
+
+def testResyncAfterGarbage():
+    frameReassembler, metrics = reassembler()
+    frames = busFrames(1)
+    garbage = bytes([0x55, 0xaa, 0x10, 0x00, 0x10, 0xeb, 0x90, 0x01]) * 8
+    assert frameReassembler.feed(garbage + b''.join(frame for _, frame in frames)) == frames
+    assert frameReassembler.skippedBytes == len(garbage)
+    assert metrics.counters()[METRIC_UNKNOWN_PACKETS] == 1
+
+def testTruncatedRecordThenGoodRecord():
+    frameReassembler, metrics = reassembler()
+    truncated = buildRecord(2, 1, {'SOCStateOfCharge': 1})[:180]
+    record = buildRecord(2, 1, {'SOCStateOfCharge': 2})
+    assert frameReassembler.feed(truncated) == []
+    assert frameReassembler.feed(record) == [(FRAME_JK_RECORD, record)]
+    assert frameReassembler.skippedBytes == len(truncated)
+    assert metrics.counters()[METRIC_FRAGMENT_ABORTS] == 1
+
+def testBadChecksum8():
+    frameReassembler, metrics = reassembler()
+    bad = bytearray(buildRecord(2, 1, {'SOCStateOfCharge': 1}))
+    bad[100] ^= 0x04
+    record = buildRecord(2, 1, {'SOCStateOfCharge': 2})
+    assert frameReassembler.feed(bytes(bad) + record) == [(FRAME_JK_RECORD, record)]
+    assert frameReassembler.checksumErrors == 1
+    assert metrics.counters()[METRIC_CHECKSUM_FAILURES] == 1
+
+def testFc16CrcFailuresCounted():
+    frameReassembler, metrics = reassembler()
+    request = bytearray(buildFc16Request(3, REQUEST_INFO_ADDR))
+    request[-1] ^= 0xff
+    assert FrameReassembler._matchFc16(memoryview(bytes(request)), 0, len(request)) == FC16_CRC_FAILED
+    response = buildFc16Response(3, REQUEST_INFO_ADDR)
+    assert frameReassembler.feed(bytes(request) + response) == [(FRAME_FC16_RESPONSE, response)]
+    assert metrics.counters()[METRIC_CRC_FAILURES] == 1
+
+def testOverflowPastMaxBufferSize():
+    frameReassembler, metrics = reassembler()
+    frameReassembler.maxBufferSize = 128
+    # A record that would not fit the buffer is given up, only the newest bytes are kept
+    assert frameReassembler.feed(buildRecord(2, 1, {})[:200]) == []
+    assert len(frameReassembler.buffer) == 128
+    assert metrics.counters()[METRIC_FRAGMENT_ABORTS] == 1
+    for _ in range(10):
+        assert frameReassembler.feed(bytes(range(100))) == []
+        assert len(frameReassembler.buffer) <= 128
+    assert frameReassembler.skippedBytes == 200 + 1000 - len(frameReassembler.buffer)
+    # A frame that arrives in one read is still found
+    record = buildRecord(2, 1, {'SOCStateOfCharge': 3})
+    assert frameReassembler.feed(record) == [(FRAME_JK_RECORD, record)]
+
+def testFrameArrivalTimes():
+    frameReassembler = FrameReassembler()
+    record = buildRecord(2, 1, {})
+    response = buildFc16Response(1, REQUEST_STATE_ADDR)
+    assert frameReassembler.feedTimed(record[:100], 10.0) == []
+    assert frameReassembler.feedTimed(record[100:] + response, 10.5) == [(FRAME_JK_RECORD, record, 10.0),
+                                                                         (FRAME_FC16_RESPONSE, response, 10.5)]
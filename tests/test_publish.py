@@ -0,0 +1,24 @@
+import json
+
+from jkess.mqtt import OVERFLOW_DROP_OLDEST, MqttOutput
+from jkess.publish import DiscoveryCache, EventPublisher
+
+class Client:
+    on_connect = on_disconnect = on_publish = None
+
+def testAlarmEdgesAreNotCoalesced():
+    output = MqttOutput(Client(), policy=OVERFLOW_DROP_OLDEST)
+    publisher = EventPublisher(output, 'tele/host')
+    for edge in ('raise', 'clear'):
+        publisher.update({'event': 'alarm', 'name': 'AlarmMosOTP', 'pack': 1, 'state': edge, 'timestamp': 0})
+    queued = [(topic, json.loads(message)['state']) for topic, _, message, _ in output.queue]
+    assert queued == [('tele/host/1/event/alarm/AlarmMosOTP', 'raise'), ('tele/host/1/event/alarm/AlarmMosOTP', 'clear')]
+    assert output.coalesced == 0
+
+def testBinarySensorTemplatesMatchPayloads():
+    configs = DiscoveryCache(MqttOutput(Client()), 'tele/host').build(1, 4)
+    bits = [json.loads(config) for topic, config in configs.items() if '/binary_sensor/' in topic]
+    assert bits
+    for config in bits:
+        assert (config['payload_on'], config['payload_off']) == ('ON', 'OFF')
+        assert "'ON' if" in config['value_template'] and 'this.state | upper' in config['value_template']
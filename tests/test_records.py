@@ -0,0 +1,30 @@
+import json
+import os
+
+import pytest
+
+from jkess.records import JK_PAYLOAD_OFFSET, getConfig, getInfo, getState
+
+DECODERS = {1: getConfig, 2: getState, 3: getInfo}
+# Fixed random frames and what the baseline decoders made of them, see make_golden.py
+with open(os.path.join(os.path.dirname(__file__), 'golden_records.json')) as file:
+    GOLDEN = json.load(file)['records']
+# Offset of the TempSenAlarms byte in the state payload
+TEMP_SEN_ALARMS = 208
+
+@pytest.mark.parametrize('golden', GOLDEN, ids=lambda golden: f"type{golden['type']}")
+def testMatchesBaseline(golden):
+    frame = bytes.fromhex(golden['frame'])
+    decoded = DECODERS[golden['type']](frame)
+    expected = dict(golden['values'])
+    if golden['type'] == 2:
+        # The baseline overwrote AlarmTempSen1Absent with bit 0, it now reports bit 1 of TempSenAlarms
+        assert expected['AlarmTempSen1Absent'] == decoded['AlarmMOSTempSenAbsent']
+        expected['AlarmTempSen1Absent'] = (frame[JK_PAYLOAD_OFFSET + TEMP_SEN_ALARMS] >> 6) & 1
+    assert {name: decoded.get(name) for name in expected} == expected
+
+def testInfoStrings():
+    frame = bytearray(300)
+    frame[JK_PAYLOAD_OFFSET:JK_PAYLOAD_OFFSET + 32] = b'JK_PB2A16S20P\x00\x00\x0015A\x00\x00\x00\x00\x0015.41\x00\x00\x00'
+    info = getInfo(bytes(frame))
+    assert (info['ManufacturerDeviceID'], info['HardwareVersion'], info['SoftwareVersion']) == ('JK_PB2A16S20P', '15A', '15.41')
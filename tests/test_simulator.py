@@ -0,0 +1,31 @@
+import asyncio
+import os
+
+from jkess.simulator import BusSimulator
+
+def testFullPtyDoesNotBlock():
+    async def main():
+        simulator = BusSimulator(1, seed=1)
+        simulator.open()
+        os.set_blocking(simulator.slave, False)
+        data = bytes(range(256)) * 1024
+        try:
+            # Far more than the pty buffer, queued without a reader
+            simulator._write(data)
+            assert not simulator.drained.is_set()
+            received = bytearray()
+            readable = asyncio.Event()
+            asyncio.get_running_loop().add_reader(simulator.slave, readable.set)
+            while len(received) < len(data):
+                await asyncio.wait_for(readable.wait(), 5)
+                readable.clear()
+                try:
+                    received += os.read(simulator.slave, 65536)
+                except BlockingIOError:
+                    pass
+            asyncio.get_running_loop().remove_reader(simulator.slave)
+            await asyncio.wait_for(simulator.drained.wait(), 5)
+            assert received == data
+        finally:
+            simulator.close()
+    asyncio.run(main())
@@ -0,0 +1,33 @@
+import pytest
+
+from jkess.records import buildRecord, getConfig, getInfo, getState
+from jkess.store import PackStateStore
+
+def testSnapshotsMatchTheDecoders():
+    store = PackStateStore()
+    for recordType, kind, decode, values in ((1, 'config', getConfig, {'CellCount': 16, 'BalanEN': 1}),
+                                             (2, 'state', getState, {'CellVol3': 3312, 'BatCurrent': -1500,
+                                                                     'BatAlarms': 0x0402}),
+                                             (3, 'info', getInfo, {'ManufacturerDeviceID': 'JK_PB2A16S20P'})):
+        record = buildRecord(recordType, 1, values)
+        snapshot = store.update(1, recordType, record, 10.0)
+        assert (snapshot.packId, snapshot.kind, snapshot.version, snapshot.timestamp) == (1, kind, 1, 10.0)
+        assert snapshot.asDict() == decode(record)
+        assert store.snapshot(1, kind) is snapshot
+    assert store.version == 3
+
+def testSnapshotsAreImmutableAndVersioned():
+    store = PackStateStore()
+    first = store.update(1, 2, buildRecord(2, 1, {'SOCStateOfCharge': 40}))
+    with pytest.raises(TypeError):
+        first.values[0] = 1.0
+    second = store.update(1, 2, buildRecord(2, 1, {'SOCStateOfCharge': 41}))
+    # The old snapshot keeps the record it was made from
+    assert (first.version, first['SOCStateOfCharge']) == (1, 40)
+    assert (second.version, second['SOCStateOfCharge']) == (2, 41)
+    assert store.snapshot(1) is second
+    assert store.update(2, 2, buildRecord(2, 1, {})).version == 1
+    assert store.version == 3 and store.packs() == [1, 2]
+    assert store.snapshot(1, 'config') is None and store.snapshot(3) is None
+    with pytest.raises(KeyError):
+        second['NoSuchField']